@@ -21,12 +21,13 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-vlav^zkf7bz%nk4wjlmuvpub364@n(e0uu@4#1(7kym)jmzq#('
+SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-vlav^zkf7bz%nk4wjlmuvpub364@n(e0uu@4#1(7kym)jmzq#(')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv('DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+# Host names the server answers to when DEBUG is off, comma separated
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', 'localhost,127.0.0.1,[::1]').split(',') if host]
 
 
 # Application definition
@@ -51,6 +52,18 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',  # To require authentication on all endpoints by default
     ],
+    # orjson-backed JSON (falling back to DRF's encoder when orjson is not installed), and
+    # MessagePack for clients sending "Accept: application/msgpack", see contacts/renderers.py
+    'DEFAULT_RENDERER_CLASSES': [
+        'contacts.renderers.ORJSONRenderer',
+        'contacts.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'contacts.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 
@@ -65,6 +78,9 @@ SIMPLE_JWT = {
 
 
 MIDDLEWARE = [
+    # First, so their timings cover the other middleware too
+    'contacts.metrics.MetricsMiddleware',
+    'contacts.instrumentation.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -106,10 +122,88 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD', 'password'),  # Default to 'password' if not set
         'HOST': os.getenv('DB_HOST', 'db'),        # 'db' is the Docker service name for PostgreSQL
         'PORT': os.getenv('DB_PORT', '5432'),      # Default PostgreSQL port
+        # Connections are reused by the requests of a worker thread for DB_CONN_MAX_AGE seconds
+        # and checked before each request reuses them. Django's persistent connections are not
+        # meant for ASGI, where they are off by default: use a pooler (DB_POOLER) instead.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0' if os.getenv('APP_SERVER') == 'asgi' else '60')),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'OPTIONS': {
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+        },
     }
 }
 
+# DB_POOLER=pgbouncer: DB_HOST is a PgBouncer in transaction pooling mode (see docker-compose.yml),
+# which cannot keep the server-side cursors of QuerySet.iterator() open across transactions
+if os.getenv('DB_POOLER') == 'pgbouncer':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Local development and tests can run against SQLite (DB_ENGINE=sqlite3); name search then uses
+# an FTS5 trigram index in place of pg_trgm
+if os.getenv('DB_ENGINE', 'postgresql') == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            # A file-backed test database lets concurrency tests use one connection per thread
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+
+# Optional in-process trigram index of contact names, see contacts/name_index.py
+CONTACT_NAME_INDEX = {
+    'ENABLED': os.getenv('NAME_INDEX_ENABLED', '0') == '1',
+    'MAX_CONTACTS': int(os.getenv('NAME_INDEX_MAX_CONTACTS', '5000000')),
+    'SNAPSHOT_PATH': os.getenv('NAME_INDEX_SNAPSHOT_PATH'),
+}
+
+# Spam likelihood cache, see contacts/spam_cache.py. SPAM_CACHE_SHARED names an alias in CACHES
+# (e.g. a Redis or Memcached cache shared by all workers) used as a second tier.
+SPAM_LIKELIHOOD_CACHE = {
+    'ENABLED': os.getenv('SPAM_CACHE_ENABLED', '1') == '1',
+    'MAX_ENTRIES': int(os.getenv('SPAM_CACHE_MAX_ENTRIES', '100000')),
+    'TTL': int(os.getenv('SPAM_CACHE_TTL', '60')),
+    'SHARED_CACHE': os.getenv('SPAM_CACHE_SHARED') or None,
+    'SHARED_TTL': int(os.getenv('SPAM_CACHE_SHARED_TTL', '300')),
+    'SNAPSHOT_PATH': os.getenv('SPAM_SNAPSHOT_PATH'),
+}
+
+# Search result cache, see contacts/search_cache.py. SEARCH_CACHE_SHARED names an alias in CACHES
+# shared by all workers, which also makes invalidations visible to every worker at once.
+SEARCH_RESULT_CACHE = {
+    'ENABLED': os.getenv('SEARCH_CACHE_ENABLED', '1') == '1',
+    'MAX_ENTRIES': int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '2000')),
+    'TTL': int(os.getenv('SEARCH_CACHE_TTL', '30')),
+    'SHARED_CACHE': os.getenv('SEARCH_CACHE_SHARED') or None,
+    'SHARED_TTL': int(os.getenv('SEARCH_CACHE_SHARED_TTL', '60')),
+}
 
+# Per-request query counts and timings, see contacts/instrumentation.py. Requests over budget are
+# logged as warnings.
+REQUEST_INSTRUMENTATION = {
+    'ENABLED': os.getenv('REQUEST_INSTRUMENTATION_ENABLED', '1') == '1',
+    'SERVER_TIMING': os.getenv('SERVER_TIMING_HEADER', '1') == '1',
+    'QUERY_BUDGET': int(os.getenv('REQUEST_QUERY_BUDGET', '20')),
+    'TIME_BUDGET_MS': int(os.getenv('REQUEST_TIME_BUDGET_MS', '500')),
+    'PATH_BUDGETS': {
+        '/api/search/': {'QUERY_BUDGET': 6, 'TIME_BUDGET_MS': 200},
+        '/api/autocomplete/': {'QUERY_BUDGET': 2, 'TIME_BUDGET_MS': 20},
+        '/api/lookup/': {'QUERY_BUDGET': 3, 'TIME_BUDGET_MS': 100},
+        '/api/mark_spam/': {'QUERY_BUDGET': 10},
+        '/api/profile/': {'QUERY_BUDGET': 3},
+    },
+}
+
+# Request counts and latency histograms served at /api/metrics/, see contacts/metrics.py. With
+# several worker processes, point METRICS_MULTIPROCESS_DIR at a directory shared by them (emptied
+# when the server starts) so every scrape reports the whole node.
+REQUEST_METRICS = {
+    'ENABLED': os.getenv('METRICS_ENABLED', '1') == '1',
+    'MULTIPROCESS_DIR': os.getenv('METRICS_MULTIPROCESS_DIR') or None,
+    'FLUSH_INTERVAL': int(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+    'SCRAPE_TOKEN': os.getenv('METRICS_SCRAPE_TOKEN') or None,
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -155,6 +249,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'contacts.User'
 
 
+# Async search and lookup views (ASYNC_VIEWS=1, for ASGI servers) and the worker threads running
+# their concurrent queries, see contacts/concurrency.py
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+ASYNC_QUERY_THREADS = int(os.getenv('ASYNC_QUERY_THREADS', '16'))
+
+# Logging: records are written by a background thread (see contacts/log.py) as JSON lines, to a
+# file rotated at LOG_ROTATE_WHEN and whenever it reaches LOG_MAX_BYTES
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -163,18 +264,27 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'contacts.log.JSONFormatter',
+        },
     },
     'handlers': {
         'file': {
-            'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': 'api.log',
-            'formatter': 'verbose',
+            'level': os.getenv('LOG_LEVEL', 'INFO'),
+            'class': 'contacts.log.QueueFileHandler',
+            'filename': os.getenv('LOG_FILE', 'api.log'),
+            'max_bytes': int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024))),
+            'backup_count': int(os.getenv('LOG_BACKUP_COUNT', '10')),
+            'when': os.getenv('LOG_ROTATE_WHEN', 'midnight'),
+            'queue_size': int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+            # One file per process, set by gunicorn.conf.py when several workers write logs
+            'per_process': os.getenv('LOG_PER_PROCESS', '0') == '1',
+            'formatter': os.getenv('LOG_FORMAT', 'json'),
         },
     },
     'root': {
         'handlers': ['file'],
-        'level': 'INFO',
+        'level': os.getenv('LOG_LEVEL', 'INFO'),
     },
 }
 
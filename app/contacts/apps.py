@@ -1,6 +1,29 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, post_save, post_delete
 
 
 class ContactsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'contacts'
+
+    def ready(self):
+        from . import directory
+        from .models import User, Contact, SpamNumber
+        from .name_index import name_index
+        from .search import contact_name_saved, install_sqlite_name_index
+        from .search_cache import search_cache
+        from .spam_cache import spam_cache
+
+        post_migrate.connect(install_sqlite_name_index, sender=self)
+        post_save.connect(name_index.contact_saved, sender=Contact)
+        post_delete.connect(name_index.contact_deleted, sender=Contact)
+        post_save.connect(spam_cache.spam_number_changed, sender=SpamNumber)
+        post_delete.connect(spam_cache.spam_number_changed, sender=SpamNumber)
+        post_save.connect(contact_name_saved, sender=Contact)
+        post_save.connect(search_cache.contact_changed, sender=Contact)
+        post_delete.connect(search_cache.contact_changed, sender=Contact)
+        post_save.connect(search_cache.spam_number_changed, sender=SpamNumber)
+        post_delete.connect(search_cache.spam_number_changed, sender=SpamNumber)
+        for model in [User, Contact, SpamNumber]:
+            post_save.connect(directory.record_saved, sender=model)
+            post_delete.connect(directory.record_deleted, sender=model)
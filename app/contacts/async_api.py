@@ -0,0 +1,101 @@
+"""
+Base of the async API views.
+
+DRF views are synchronous: under ASGI each request holds a thread while it waits on the database.
+:class:`AsyncAPIView` is a Django async view that behaves like the API views for its clients: it
+authenticates the JWT access token (reading the user with the async ORM), answers errors with
+DRF's status codes and bodies, and renders JSON with :func:`contacts.renderers.json_dumps`.
+Content negotiation and the browsable API are not supported.
+"""
+import json
+
+from django.http import HttpResponse
+from django.views import View
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, ParseError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .renderers import json_dumps, orjson
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` reading the user with the async ORM."""
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        # Same checks as JWTAuthentication.get_user
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        try:
+            user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if jwt_settings.CHECK_REVOKE_TOKEN and (
+            validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+        ):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(json_dumps(data), status=status, content_type='application/json')
+
+
+def parse_json(request):
+    """Return the decoded JSON body of ``request``, raising ``ParseError`` when it is malformed."""
+    try:
+        if orjson is not None:
+            return orjson.loads(request.body)
+        return json.loads(request.body)
+    except ValueError as exc:
+        raise ParseError(f'JSON parse error - {exc}')
+
+
+class AsyncAPIView(View):
+    """Async view restricted to users authenticated by a JWT access token."""
+
+    authentication = AsyncJWTAuthentication()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Token authenticated, like the DRF views
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            authenticated = await self.authentication.aauthenticate(request)
+            if authenticated is None:
+                raise NotAuthenticated()
+            request.user, request.auth = authenticated
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            return self.handle_exception(request, exc)
+
+    def handle_exception(self, request, exc):
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            response = json_response(data, status.HTTP_401_UNAUTHORIZED)
+            response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+            return response
+        return json_response(data, exc.status_code)
@@ -0,0 +1,112 @@
+"""
+Prefix completions for the search box.
+
+Names and numbers are read as ordered ranges of indexes, stopping after ``limit`` distinct
+values, so the cost of a completion does not grow with the number of contacts:
+
+* names from ``contacts_contact_name_prefix``, an index of ``(name_normalized COLLATE "C", id)``
+  on PostgreSQL and of ``(name_normalized, id)`` on SQLite, whose default collation already
+  orders by code point. Only the one row of each distinct name returned is read from the table;
+* numbers from the PhoneDirectory primary key, which holds every known number once. The numbers
+  starting with some digits are one range of keys per number length.
+"""
+from django.db import connections, router
+
+from .models import Contact, PhoneDirectory
+from .util import PHONE_NUMBER_SEPARATORS, normalize_name
+
+
+DEFAULT_AUTOCOMPLETE_LIMIT = 8
+MAX_AUTOCOMPLETE_LIMIT = 20
+
+# Seconds clients may reuse a completion
+AUTOCOMPLETE_MAX_AGE = 60
+
+# Longest phone number accepted, in digits (E.164)
+MAX_PHONE_DIGITS = 15
+
+
+def complete_names(prefix, limit):
+    """
+    Return up to ``limit`` distinct contact names starting with ``prefix``, alphabetically.
+
+    Popular names repeat across contact lists, so rather than reading their duplicates the
+    recursive query seeks from each distinct name straight to the next one, one index probe per
+    name returned.
+    """
+    term = normalize_name(prefix)
+    connection = connections[router.db_for_read(Contact)]
+    qn = connection.ops.quote_name
+    table = qn(Contact._meta.db_table)
+    key = f'{table}.{qn("name_normalized")}'
+    if connection.vendor == 'postgresql':
+        key = f'({key} COLLATE "C")'
+
+    sql = f"""
+        WITH RECURSIVE prefix_names (name_normalized, depth) AS (
+            SELECT (
+                SELECT {key} FROM {table} WHERE {key} >= %s AND {key} < %s ORDER BY {key} LIMIT 1
+            ), 1
+            UNION ALL
+            SELECT (
+                SELECT {key} FROM {table}
+                WHERE {key} > prefix_names.name_normalized AND {key} < %s ORDER BY {key} LIMIT 1
+            ), depth + 1
+            FROM prefix_names WHERE prefix_names.name_normalized IS NOT NULL AND depth < %s
+        )
+        SELECT (SELECT {qn('name')} FROM {table} WHERE {key} = prefix_names.name_normalized LIMIT 1)
+        FROM prefix_names WHERE prefix_names.name_normalized IS NOT NULL
+        ORDER BY depth
+    """
+    # Every string starting with the term sorts between the term and the term followed by the
+    # highest code point
+    upper = term + '\U0010ffff'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [term, upper, upper, limit])
+        return [name for name, in cursor.fetchall()]
+
+
+def phone_key_ranges(digits):
+    """Return the ``(low, high)`` phone key ranges of the numbers starting with ``digits``."""
+    start = int(digits)
+    return [
+        (start * 10 ** (length - len(digits)), (start + 1) * 10 ** (length - len(digits)))
+        for length in range(len(digits), MAX_PHONE_DIGITS + 1)
+    ]
+
+
+def complete_numbers(prefix, limit):
+    """Return up to ``limit`` known phone numbers whose digits start with ``prefix``, shortest first."""
+    digits = PHONE_NUMBER_SEPARATORS.sub('', prefix).removeprefix('+')
+    # Phone keys are the digits of a number without its leading "+", they never start with a zero
+    if not digits.isascii() or not digits.isdigit() or digits[0] == '0' or len(digits) > MAX_PHONE_DIGITS:
+        return []
+
+    # One bounded range scan per number length: OR-ing the ranges in a single WHERE makes the
+    # databases collect every match before sorting
+    connection = connections[router.db_for_read(PhoneDirectory)]
+    qn = connection.ops.quote_name
+    ranges = phone_key_ranges(digits)
+    scan = f"""
+        SELECT * FROM (
+            SELECT {qn('phone_key')}, {qn('phone_number')} FROM {qn(PhoneDirectory._meta.db_table)}
+            WHERE {qn('phone_key')} >= %s AND {qn('phone_key')} < %s
+            ORDER BY {qn('phone_key')} LIMIT %s
+        ) AS key_range_{{}}
+    """
+    sql = f"""
+        SELECT {qn('phone_number')} FROM ({' UNION ALL '.join(scan.format(i) for i in range(len(ranges)))}) AS matches
+        ORDER BY {qn('phone_key')} LIMIT %s
+    """
+    params = [value for low, high in ranges for value in (low, high, limit)] + [limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [phone_number for phone_number, in cursor.fetchall()]
+
+
+def autocomplete(prefix, limit=DEFAULT_AUTOCOMPLETE_LIMIT):
+    """Return the names and phone numbers completing ``prefix``, at most ``limit`` of each."""
+    return {
+        'names': complete_names(prefix, limit),
+        'numbers': complete_numbers(prefix, limit),
+    }
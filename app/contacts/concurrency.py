@@ -0,0 +1,67 @@
+"""
+Concurrent database queries for async views.
+
+Django's async ORM methods (``aget``, ``ain_bulk``...) run the query in the single thread set aside
+for the synchronous code of the request, so queries awaited together still run one after the
+other. :func:`database_task` runs a function in a pool of worker threads instead, each with its own
+database connection, so independent queries gathered with ``asyncio.gather`` run at the same time:
+
+    names, phone_matches = await asyncio.gather(
+        database_task(name_page, query, term, position, limit),
+        database_task(extra_page, query, term, position, limit, fuzzy),
+    )
+
+Every worker thread keeps a persistent connection, so a worker process uses up to
+``ASYNC_QUERY_THREADS`` (setting, default 16) connections on top of those of its requests. They
+outlive ``CONN_MAX_AGE``, which defaults to 0 under ASGI and would make every task connect again:
+before each task a connection is only dropped when an error made it unusable, or when it fails
+the check done with ``CONN_HEALTH_CHECKS``. Queries are counted by the request instrumentation.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .instrumentation import current_queries
+
+
+DEFAULT_QUERY_THREADS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_QUERY_THREADS', DEFAULT_QUERY_THREADS),
+                thread_name_prefix='database-task',
+            )
+        return _executor
+
+
+def reuse_connections():
+    for connection in connections.all(initialized_only=True):
+        connection.close_at = None
+        # Like at the start of a request, without the age limit
+        connection.close_if_unusable_or_obsolete()
+
+
+def run_task(function, args):
+    reuse_connections()
+    queries = current_queries.get()
+    with ExitStack() as stack:
+        if queries is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+        return function(*args)
+
+
+def database_task(function, *args):
+    """Return an awaitable calling ``function(*args)`` in a database worker thread."""
+    return sync_to_async(run_task, thread_sensitive=False, executor=get_executor())(function, args)
@@ -0,0 +1,168 @@
+"""
+Maintenance of the PhoneDirectory caller-ID table.
+
+Entries are recomputed from their sources, a few grouped ``IN`` queries per batch of phone keys,
+whenever a User, Contact or SpamNumber with that key is written: by signals for single rows and
+explicitly by the bulk paths (contact imports and spam marks) that bypass them. A recomputation
+first locks the entries it replaces (see :func:`lock_entries`), so concurrent writes of one number
+take turns and the last one reads what the others committed instead of overwriting it.
+``manage.py rebuild_phone_directory`` recomputes the whole table in batches of phone key ranges.
+"""
+from django.db import connections, router, transaction
+from django.db.models import Count, Min
+
+from .models import User, SpamNumber, Contact, PhoneDirectory, DEFAULT_SPAM_LIKELIHOOD
+
+
+# Contact names kept per directory entry
+MAX_DIRECTORY_NAMES = 20
+
+# Phone keys per rebuild batch, taken from each source table
+REBUILD_BATCH_SIZE = 2000
+
+DIRECTORY_FIELDS = ['phone_number', 'registered_user', 'names', 'contact_count', 'spam_likelihood']
+
+
+def build_entries(phone_keys):
+    """Compute the directory entries of ``phone_keys`` from their sources, skipping unknown numbers."""
+    users = {
+        user.phone_key: user
+        for user in User.objects.filter(phone_key__in=phone_keys).only('id', 'phone_key', 'phone_number')
+    }
+    spam_numbers = {
+        phone_key: (phone_number, spam_likelihood)
+        for phone_key, phone_number, spam_likelihood in SpamNumber.objects.filter(
+            phone_key__in=phone_keys
+        ).values_list('phone_key', 'phone_number', 'spam_likelihood')
+    }
+    contact_names = {}
+    rows = Contact.objects.filter(phone_key__in=phone_keys).values('phone_key', 'name_normalized').annotate(
+        count=Count('id'), display_name=Min('name'), phone_number=Min('phone_number'),
+    ).order_by()
+    for row in rows:
+        contact_names.setdefault(row['phone_key'], []).append(row)
+
+    entries = {}
+    for phone_key in set(users) | set(spam_numbers) | set(contact_names):
+        user = users.get(phone_key)
+        phone_number, spam_likelihood = spam_numbers.get(phone_key, (None, DEFAULT_SPAM_LIKELIHOOD))
+        names = contact_names.get(phone_key, [])
+        # Most saved name first, ties go to the alphabetically first
+        names.sort(key=lambda row: (-row['count'], row['display_name']))
+
+        entries[phone_key] = PhoneDirectory(
+            phone_key=phone_key,
+            phone_number=user.phone_number if user else phone_number or names[0]['phone_number'],
+            registered_user=user,
+            names=[[row['display_name'], row['count']] for row in names[:MAX_DIRECTORY_NAMES]],
+            contact_count=sum(row['count'] for row in names),
+            spam_likelihood=spam_likelihood,
+        )
+    return entries
+
+
+def save_entries(entries, update_fields=DIRECTORY_FIELDS):
+    PhoneDirectory.objects.bulk_create(
+        entries, update_conflicts=True, unique_fields=['phone_key'], update_fields=update_fields,
+    )
+
+
+def lock_entries(phone_keys):
+    """
+    Lock the directory entries of ``phone_keys`` until the end of the transaction, in phone key
+    order so concurrent callers cannot deadlock. Missing entries are first inserted as
+    placeholders, which the caller replaces or deletes, as a row that does not exist cannot be
+    locked; inserting a key another transaction is inserting waits for it too. Queries run after
+    the lock, in PostgreSQL's default READ COMMITTED isolation, see every write committed by the
+    previous holder. Databases without ``SELECT ... FOR UPDATE`` (SQLite) already run one write
+    transaction at a time.
+    """
+    if not connections[router.db_for_write(PhoneDirectory)].features.has_select_for_update:
+        return
+    phone_keys = sorted(phone_keys)
+    PhoneDirectory.objects.bulk_create(
+        [PhoneDirectory(phone_key=phone_key, phone_number='') for phone_key in phone_keys], ignore_conflicts=True,
+    )
+    list(PhoneDirectory.objects.filter(pk__in=phone_keys).order_by('pk').select_for_update().values_list('pk'))
+
+
+def refresh_directory(phone_keys):
+    """Recompute the directory entries of ``phone_keys``, deleting those no longer known."""
+    phone_keys = {phone_key for phone_key in phone_keys if phone_key}
+    if not phone_keys:
+        return
+
+    with transaction.atomic():
+        lock_entries(phone_keys)
+        entries = build_entries(phone_keys)
+        if entries:
+            save_entries(list(entries.values()))
+        if len(entries) < len(phone_keys):
+            PhoneDirectory.objects.filter(pk__in=phone_keys - set(entries)).delete()
+
+
+def update_spam_likelihoods(spam_numbers):
+    """Copy the likelihoods of ``spam_numbers`` to their directory entries, creating missing ones."""
+    entries = [
+        PhoneDirectory(
+            phone_key=spam_number.phone_key,
+            phone_number=spam_number.phone_number,
+            spam_likelihood=spam_number.spam_likelihood,
+        )
+        for spam_number in spam_numbers
+    ]
+    if entries:
+        save_entries(entries, update_fields=['spam_likelihood'])
+
+
+def nth_phone_key(model, after, n):
+    keys = model.objects.filter(phone_key__gt=after).order_by('phone_key').values_list('phone_key', flat=True)
+    return next(iter(keys.distinct()[n - 1:n]), None)
+
+
+def rebuild_directory(batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recompute the whole directory, one range of phone keys per transaction. Each range ends at the
+    ``batch_size``-th key of whichever source table reaches it first, so batches stay bounded.
+
+    Yields the number of entries written by each batch.
+    """
+    sources = [Contact, User, SpamNumber]
+    last = 0
+    while True:
+        upper = min(
+            (key for key in (nth_phone_key(model, last, batch_size) for model in sources) if key is not None),
+            default=None,
+        )
+        key_range = {'phone_key__gt': last}
+        if upper is not None:
+            key_range['phone_key__lte'] = upper
+
+        with transaction.atomic():
+            phone_keys = set()
+            for model in sources:
+                phone_keys.update(model.objects.filter(**key_range).values_list('phone_key', flat=True).distinct())
+            lock_entries(phone_keys)
+            entries = build_entries(phone_keys)
+            PhoneDirectory.objects.filter(**key_range).exclude(pk__in=list(entries)).delete()
+            if entries:
+                save_entries(list(entries.values()))
+        yield len(entries)
+
+        if upper is None:
+            return
+        last = upper
+
+
+def record_saved(sender, instance, created=False, **kwargs):
+    """Refresh the entries of a saved User, Contact or SpamNumber, and of its previous number."""
+    previous = getattr(instance, '_loaded_phone_key', None)
+    # Other User fields are read through the registered_user join
+    if sender is User and not created and previous == instance.phone_key:
+        return
+    refresh_directory({instance.phone_key, previous})
+    instance._loaded_phone_key = instance.phone_key
+
+
+def record_deleted(sender, instance, **kwargs):
+    refresh_directory({instance.phone_key, getattr(instance, '_loaded_phone_key', None)})
@@ -0,0 +1,206 @@
+"""
+Incremental parsers and chunked writer for address book imports.
+
+Uploads are read from the request stream piece by piece, so memory use does not depend on the
+size of the upload: each parser yields one ``{'name': ..., 'phone_number': ...}`` item at a time
+and :func:`import_contacts` validates and writes them in fixed-size chunks.
+"""
+import codecs
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+
+from .directory import refresh_directory
+from .models import Contact
+from .name_index import name_index
+from .search import record_name_words
+from .search_cache import search_cache, CONTACTS
+from .util import phone_number_validator
+
+
+# Rows validated and written per bulk_create statement
+IMPORT_CHUNK_SIZE = 1000
+
+# Bytes read from the request stream at a time
+READ_SIZE = 64 * 1024
+
+# Largest single JSON array item accepted, guards the buffer against malformed uploads
+MAX_ITEM_SIZE = 1024 * 1024
+
+# Errors echoed back in the import summary, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+CSV_HEADER = ['name', 'phone_number']
+
+
+class ImportFormatError(ValueError):
+    """The upload is not well-formed for its content type."""
+
+
+def iter_ndjson(stream):
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise ImportFormatError(f"Invalid JSON on line {line_number}.") from e
+
+
+def iter_csv(stream):
+    try:
+        for row in csv.reader(codecs.iterdecode(stream, 'utf-8')):
+            if not row:
+                continue
+            if [column.strip().lower() for column in row] == CSV_HEADER:
+                continue
+            yield dict(zip(CSV_HEADER, row)) if len(row) == len(CSV_HEADER) else row
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFormatError("Invalid CSV.") from e
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """Yield the items of a top-level JSON array, decoding the stream a bounded piece at a time."""
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        data = stream.read(read_size)
+        try:
+            buffer = buffer[position:] + text_decoder.decode(data or b'', final=not data)
+        except UnicodeDecodeError as e:
+            raise ImportFormatError("Invalid UTF-8.") from e
+        position = 0
+        eof = not data
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if buffer[position:position + 1] != '[':
+        raise ImportFormatError("Expected a JSON array.")
+    position += 1
+
+    while True:
+        skip_whitespace()
+        if buffer[position:position + 1] == ']':
+            return
+        if started:
+            if buffer[position:position + 1] != ',':
+                raise ImportFormatError("Expected ',' or ']' in JSON array.")
+            position += 1
+            skip_whitespace()
+
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                item = end = None
+            # A value ending with the buffer may continue in the next read (e.g. a number)
+            if end is not None and (end < len(buffer) or eof):
+                break
+            if eof or len(buffer) - position > MAX_ITEM_SIZE:
+                raise ImportFormatError("Truncated or invalid JSON array.")
+            fill()
+
+        position = end
+        started = True
+        yield item
+
+
+PARSERS = {
+    'application/json': iter_json_array,
+    'application/x-ndjson': iter_ndjson,
+    'text/csv': iter_csv,
+}
+
+
+def validate_item(item):
+    """Return a Contact field dict for a valid item, raising ``ValidationError`` otherwise."""
+    if not isinstance(item, dict):
+        raise ValidationError("Expected an object with name and phone_number.")
+
+    name = item.get('name')
+    phone_number = item.get('phone_number')
+    if not isinstance(name, str) or not name.strip() or len(name) > 255:
+        raise ValidationError("Name must be a non-empty string of at most 255 characters.")
+    if not isinstance(phone_number, str):
+        raise ValidationError("Phone number must be a string.")
+    phone_number_validator(phone_number)
+
+    return {'name': name.strip(), 'phone_number': phone_number}
+
+
+def import_contacts(user, items, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Validate and insert ``items`` as contacts of ``user``, one chunk at a time.
+
+    Rows conflicting with the ``unique_name_phone`` constraint, already saved or repeated in the
+    upload, are counted as ``skipped``. Each chunk is checked against the saved contacts with one
+    query and written by its own bulk_create, so an upload interrupted half-way keeps the chunks
+    already written, followed by one refresh of the phone directory entries of its new numbers,
+    of the fuzzy search vocabulary and of the in-process name index (bulk_create sends no
+    signals). A conflicting row saved by a concurrent request between the check and the insert
+    is still ignored by the insert, but counted as accepted.
+    """
+    summary = {'received': 0, 'accepted': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    chunk = []
+
+    def flush():
+        existing = set(
+            Contact.objects.filter(
+                name__in={contact.name for contact in chunk},
+                phone_number__in={contact.phone_number for contact in chunk},
+            ).values_list('name', 'phone_number')
+        )
+        new_contacts = []
+        for contact in chunk:
+            key = (contact.name, contact.phone_number)
+            if key not in existing:
+                existing.add(key)
+                new_contacts.append(contact)
+        summary['accepted'] += len(new_contacts)
+        summary['skipped'] += len(chunk) - len(new_contacts)
+        chunk.clear()
+        if not new_contacts:
+            return
+
+        Contact.objects.bulk_create(new_contacts, ignore_conflicts=True)
+        refresh_directory({contact.phone_key for contact in new_contacts})
+        record_name_words(new_contacts)
+        name_index.load_inserted()
+        search_cache.bump(CONTACTS)
+
+    for index, item in enumerate(items):
+        summary['received'] += 1
+        try:
+            fields = validate_item(item)
+        except ValidationError as e:
+            summary['invalid'] += 1
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append({'index': index, 'error': e.messages[0]})
+            continue
+
+        contact = Contact(user=user, **fields)
+        contact.set_derived_fields()
+        chunk.append(contact)
+        if len(chunk) >= chunk_size:
+            flush()
+
+    if chunk:
+        flush()
+
+    return summary
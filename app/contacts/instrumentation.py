@@ -0,0 +1,177 @@
+"""
+Per-request SQL and timing instrumentation.
+
+:class:`RequestInstrumentationMiddleware` records, for every request, the number of SQL queries and
+the time spent running them, the time spent in the view and the time spent rendering its response
+(serialization). They are sent back in a ``Server-Timing`` header, readable in browser developer
+tools, and logged once per request by the ``contacts.instrumentation`` logger, in the record's
+``timings`` attribute (a field of the JSON log lines, see :mod:`contacts.log`), at WARNING level
+when the request went over its query or time budget. Queries run while a streamed response is
+being sent are not counted. Under ASGI the middleware runs asynchronously; queries of the async ORM
+and of :func:`contacts.concurrency.database_task` are counted, and the ``db`` time of queries run
+concurrently is their total.
+
+Configured by the ``REQUEST_INSTRUMENTATION`` setting, read when the middleware is loaded:
+
+- ``ENABLED``: record requests (default ``True``). When disabled the middleware removes itself
+  from the middleware chain, so it costs nothing.
+- ``SERVER_TIMING``: send the ``Server-Timing`` header (default ``True``).
+- ``QUERY_BUDGET`` / ``TIME_BUDGET_MS``: queries and total milliseconds allowed per request.
+- ``PATH_BUDGETS``: budgets overriding those for paths starting with a prefix, e.g.
+  ``{'/api/search/': {'QUERY_BUDGET': 5}}``. The longest matching prefix wins.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'QUERY_BUDGET': 20,
+    'TIME_BUDGET_MS': 500,
+    'PATH_BUDGETS': {},
+}
+
+logger = logging.getLogger(__name__)
+
+# QueryTimer of the current request, for queries run in other threads
+current_queries = ContextVar('current_queries', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_INSTRUMENTATION', {})}
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and the time spent running them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.seconds += time.perf_counter() - started
+                self.count += 1
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_ended = None
+        self.render_ended = None
+
+    def mark_rendered(self, response):
+        self.render_ended = time.perf_counter()
+
+
+class RequestInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.server_timing = config['SERVER_TIMING']
+        self.budgets = {'': (config['QUERY_BUDGET'], config['TIME_BUDGET_MS'])}
+        for prefix, budget in config['PATH_BUDGETS'].items():
+            self.budgets[prefix] = (
+                budget.get('QUERY_BUDGET', config['QUERY_BUDGET']),
+                budget.get('TIME_BUDGET_MS', config['TIME_BUDGET_MS']),
+            )
+        # Longest prefixes first
+        self.prefixes = sorted(self.budgets, key=len, reverse=True)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = request.instrumentation = RequestTimings()
+        queries = QueryTimer()
+        token = current_queries.set(queries)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        return self.finish(request, response, timings, queries)
+
+    async def __acall__(self, request):
+        timings = request.instrumentation = RequestTimings()
+        queries = QueryTimer()
+        token = current_queries.set(queries)
+        try:
+            with ExitStack() as stack:
+                # The async ORM runs queries in the thread of the request's synchronous code, with
+                # the connections of that thread
+                for connection in await sync_to_async(connections.all)():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = await self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        return self.finish(request, response, timings, queries)
+
+    def finish(self, request, response, timings, queries):
+        ended = time.perf_counter()
+        view_ended = timings.view_ended or ended
+        metrics = {
+            'db': queries.seconds * 1000,
+            'view': (view_ended - timings.view_started) * 1000 if timings.view_started else 0.0,
+            'render': (timings.render_ended - view_ended) * 1000 if timings.render_ended else 0.0,
+            'total': (ended - timings.started) * 1000,
+        }
+        query_budget, time_budget = self.budget(request.path)
+        over_budget = [
+            name for name, over in [('queries', queries.count > query_budget), ('time', metrics['total'] > time_budget)]
+            if over
+        ]
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={duration:.1f}' + (f';desc="{queries.count} queries"' if name == 'db' else '')
+                for name, duration in metrics.items()
+            )
+
+        level = logging.WARNING if over_budget else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, '%s %s %s', request.method, request.path, response.status_code, extra={'timings': {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': queries.count,
+                **{f'{name}_ms': round(duration, 2) for name, duration in metrics.items()},
+                'over_budget': over_budget,
+            }})
+        return response
+
+    def budget(self, path):
+        return next(self.budgets[prefix] for prefix in self.prefixes if path.startswith(prefix))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumentation.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook, the callback marks the end
+        timings = request.instrumentation
+        timings.view_ended = time.perf_counter()
+        response.add_post_render_callback(timings.mark_rendered)
+        return response
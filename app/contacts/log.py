@@ -0,0 +1,265 @@
+"""
+Non-blocking, structured logging.
+
+:class:`QueueFileHandler` only puts records on a bounded in-memory queue; a background listener
+thread formats them and writes them to a file rotated by size and by time, so request threads
+never wait for the disk. When the queue is full (the disk cannot keep up) records are dropped and
+counted rather than blocking; the count is written to the file as a warning once the listener
+catches up, at most every ``DROPPED_REPORT_INTERVAL`` seconds, and when the handler is flushed or
+closed. Records still queued are written when the handler is closed, which ``logging.shutdown``
+does when the process exits.
+
+Rotation renames the file, which is only safe with one writer: with ``per_process`` every process
+writes and rotates a file of its own, ``api.<pid>.log`` for ``api.log``. Gunicorn turns it on
+(``LOG_PER_PROCESS``) when it runs several workers. Files of exited processes are left as they are.
+
+:class:`JSONFormatter` writes each record as one JSON line: time, level, logger, message, the
+source location, any ``extra`` fields and the formatted exception.
+
+Use it from ``LOGGING``::
+
+    'handlers': {
+        'file': {
+            'class': 'contacts.log.QueueFileHandler',
+            'filename': 'api.log',
+            'max_bytes': 50 * 1024 * 1024,
+            'backup_count': 10,
+            'when': 'midnight',
+            'formatter': 'json',
+        },
+    },
+"""
+import copy
+import datetime
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import weakref
+
+from .renderers import json_dumps
+
+
+# Records waiting to be written before new ones are dropped
+QUEUE_SIZE = 10_000
+
+# Seconds between the warnings counting dropped records
+DROPPED_REPORT_INTERVAL = 10
+
+# Attributes of every LogRecord, anything else was passed in ``extra``
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+JSON_TYPES = (str, int, float, bool, type(None), list, tuple, dict)
+
+
+class JSONFormatter(logging.Formatter):
+    FIELDS = {'time', 'level', 'logger', 'message', 'module', 'line', 'process', 'thread', 'exception', 'stack'}
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                # Other objects, e.g. the HttpRequest Django logs errors with, are written as text
+                entry[key] = value if isinstance(value, JSON_TYPES) else str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        try:
+            return json_dumps(entry).decode()
+        except TypeError:
+            # A list or dict holding values JSON cannot encode
+            return json_dumps({key: value if key in self.FIELDS else repr(value) for key, value in entry.items()}).decode()
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    Rotates at the ``when``/``interval`` time boundaries, like its base class, and also whenever
+    the file would grow past ``max_bytes``. Rotated files are named after the time of the period;
+    several rotations within one period get a counter appended instead of overwriting each other.
+    """
+
+    def __init__(self, filename, max_bytes=0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+        self.bytes_written = 0
+
+    def _open(self):
+        stream = super()._open()
+        # Appending: the position is the size of the file
+        self.bytes_written = stream.tell()
+        return stream
+
+    def emit(self, record):
+        # Formatted once: its size decides on a size rollover before it is written
+        try:
+            message = self.format(record) + self.terminator
+            size = len(message) if message.isascii() else len(message.encode(self.encoding or 'utf-8', 'replace'))
+            if self.stream is None:
+                self.stream = self._open()
+            if self.shouldRollover(record) or (
+                self.max_bytes and self.bytes_written and self.bytes_written + size > self.max_bytes
+            ):
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(message)
+            self.flush()
+            self.bytes_written += size
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        rollover_at = self.rolloverAt
+        super().doRollover()
+        # A size rollover does not move the next time boundary
+        if time.time() < rollover_at:
+            self.rolloverAt = rollover_at
+
+    def rotation_filename(self, default_name):
+        name = super().rotation_filename(default_name)
+        counter = 1
+        candidate = name
+        while os.path.exists(candidate):
+            candidate = f'{name}.{counter}'
+            counter += 1
+        return candidate
+
+
+class QueueListener(logging.handlers.QueueListener):
+    def __init__(self, queue, handler, report_dropped):
+        super().__init__(queue, handler, respect_handler_level=True)
+        self.report_dropped = report_dropped
+
+    def handle(self, record):
+        super().handle(record)
+        # The queue has room again: count what was dropped while it was full
+        self.report_dropped()
+
+    def enqueue_sentinel(self):
+        # Wait for room in a full queue rather than fail to stop
+        self.queue.put(self._sentinel)
+
+
+def process_filename(filename):
+    """Return ``filename`` with the current process id before its extension."""
+    root, extension = os.path.splitext(filename)
+    return f'{root}.{os.getpid()}{extension}'
+
+
+class QueueFileHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler writing through a background listener to a :class:`SizeAndTimeRotatingFileHandler`.
+    The formatter set on this handler is used by the file handler, in the listener thread.
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, when='midnight', interval=1,
+                 encoding='utf-8', queue_size=QUEUE_SIZE, per_process=False):
+        super().__init__(queue.Queue(queue_size))
+        self.filename = filename
+        self.per_process = per_process
+        self.target_options = {
+            'max_bytes': max_bytes, 'backupCount': backup_count, 'when': when, 'interval': interval,
+            'encoding': encoding, 'delay': True,
+        }
+        self.target = self.open_target()
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.dropped_reported_at = time.monotonic()
+        self.report_lock = threading.Lock()
+        self.listener = None
+        self.start()
+        # Threads do not survive fork: forked workers (e.g. preloaded gunicorn) start their own listener
+        handler = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: handler() and handler().restart())
+
+    def open_target(self):
+        filename = process_filename(self.filename) if self.per_process else self.filename
+        return SizeAndTimeRotatingFileHandler(filename, **self.target_options)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def start(self):
+        self.listener = QueueListener(self.queue, self.target, self.report_dropped)
+        self.listener.start()
+
+    def restart(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.dropped = 0
+        self.reported_dropped = 0
+        if self.per_process:
+            formatter = self.target.formatter
+            self.target.close()
+            self.target = self.open_target()
+            self.target.setFormatter(formatter)
+        self.start()
+
+    def prepare(self, record):
+        # Only merge the arguments into the message (they may change once the call returns), the
+        # listener does the formatting. Other handlers get the record unchanged.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def report_dropped(self, force=False):
+        """
+        Write a warning counting the records dropped since the last one, at most every
+        ``DROPPED_REPORT_INTERVAL`` seconds unless ``force``.
+        """
+        # Not under the handler lock: logging.shutdown holds it while flush() waits for the listener
+        with self.report_lock:
+            dropped = self.dropped - self.reported_dropped
+            now = time.monotonic()
+            if dropped <= 0 or (not force and now - self.dropped_reported_at < DROPPED_REPORT_INTERVAL):
+                return
+            self.reported_dropped = self.dropped
+            self.dropped_reported_at = now
+        record = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0, "Dropped %d log records, the log file could not keep up",
+            (dropped,), None,
+        )
+        record.dropped = dropped
+        self.target.handle(record)
+
+    def flush(self):
+        # Wait until the listener has written everything queued so far
+        if self.listener is not None and self.listener._thread is not None:
+            self.queue.join()
+        self.report_dropped(force=True)
+        self.target.flush()
+
+    def close(self):
+        if self.listener is not None and self.listener._thread is not None:
+            # Writes the records still queued before returning
+            self.listener.stop()
+        self.listener = None
+        self.report_dropped(force=True)
+        self.target.close()
+        super().close()
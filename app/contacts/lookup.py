@@ -0,0 +1,40 @@
+from .models import PhoneDirectory
+from .util import phone_number_key
+
+
+# Maximum number of phone numbers accepted by a batch lookup
+MAX_LOOKUP_NUMBERS = 500
+
+
+def lookup_numbers(phone_numbers):
+    """
+    Resolve caller-ID information for many phone numbers with a single primary key read of their
+    PhoneDirectory entries, matching numbers on their canonical ``phone_key``.
+
+    Returns a dict mapping each phone number to its spam likelihood, best-guess name (the
+    registered user's name, else the most common contact name) and whether it is registered.
+    """
+    keys = {phone_number: phone_number_key(phone_number) for phone_number in phone_numbers}
+    return directory_results(keys, directory_entries().in_bulk(set(keys.values())))
+
+
+async def alookup_numbers(phone_numbers):
+    """:func:`lookup_numbers` for async views, reading the entries with the async ORM."""
+    keys = {phone_number: phone_number_key(phone_number) for phone_number in phone_numbers}
+    return directory_results(keys, await directory_entries().ain_bulk(set(keys.values())))
+
+
+def directory_entries():
+    return PhoneDirectory.objects.select_related('registered_user')
+
+
+def directory_results(keys, entries):
+    results = {}
+    for phone_number, phone_key in keys.items():
+        entry = entries.get(phone_key) or PhoneDirectory(phone_key=phone_key)
+        results[phone_number] = {
+            'spam_likelihood': entry.spam_likelihood,
+            'name': entry.best_name,
+            'registered': entry.registered_user is not None,
+        }
+    return results
@@ -0,0 +1,111 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from contacts.autocomplete import DEFAULT_AUTOCOMPLETE_LIMIT, autocomplete
+from contacts.directory import refresh_directory
+from contacts.models import User, Contact
+from contacts.search import record_name_words
+from contacts.views import AutocompleteView
+
+
+FIRST_NAMES = [
+    'Aaron', 'Abigail', 'Adam', 'Aisha', 'Alex', 'Amelia', 'Ana', 'Andrew', 'Anna', 'Arjun', 'Ben',
+    'Carlos', 'Charlotte', 'Chen', 'Chloe', 'Daniel', 'David', 'Diego', 'Elena', 'Emily', 'Emma',
+    'Ethan', 'Fatima', 'Grace', 'Hannah', 'Hiro', 'Isabella', 'Ivan', 'Jack', 'James', 'Jane',
+    'John', 'Jose', 'Julia', 'Kai', 'Laura', 'Leo', 'Liam', 'Lucas', 'Maria', 'Mei', 'Mia',
+    'Mohammed', 'Noah', 'Olivia', 'Omar', 'Priya', 'Rahul', 'Sara', 'Sofia', 'Tom', 'Yuki', 'Zoe',
+]
+LAST_NAMES = [
+    'Ahmed', 'Anderson', 'Brown', 'Chen', 'Clark', 'Davis', 'Fernandez', 'Garcia', 'Gonzalez',
+    'Gupta', 'Hall', 'Harris', 'Hernandez', 'Ito', 'Jackson', 'Johnson', 'Jones', 'Khan', 'Kim',
+    'Kumar', 'Lee', 'Lewis', 'Lopez', 'Martin', 'Martinez', 'Miller', 'Moore', 'Nguyen', 'Patel',
+    'Perez', 'Robinson', 'Rodriguez', 'Sanchez', 'Schmidt', 'Silva', 'Singh', 'Smith', 'Tanaka',
+    'Taylor', 'Thomas', 'Thompson', 'Walker', 'White', 'Williams', 'Wilson', 'Wright', 'Young',
+]
+
+BENCHMARK_USERNAME = 'autocomplete-benchmark'
+SEED_BATCH_SIZE = 10_000
+
+
+class Command(BaseCommand):
+    help = "Time autocomplete queries for random name and number prefixes, optionally seeding contacts first."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Synthetic contacts to insert before timing (owned by a dedicated benchmark user).",
+        )
+        parser.add_argument('--queries', type=int, default=1000, help="Prefixes to time per kind.")
+        parser.add_argument('--limit', type=int, default=DEFAULT_AUTOCOMPLETE_LIMIT, help="Completions per prefix.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        if options['seed']:
+            self.seed(rng, options['seed'])
+
+        self.stdout.write(f"{Contact.objects.count()} contacts on {connection.vendor}.")
+        name_prefixes = [
+            rng.choice(FIRST_NAMES)[:rng.randint(1, 4)].lower() for _ in range(options['queries'])
+        ]
+        number_prefixes = [
+            str(rng.randint(1, 9)) + ''.join(str(rng.randint(0, 9)) for _ in range(rng.randint(0, 5)))
+            for _ in range(options['queries'])
+        ]
+        for kind, prefixes in (('names', name_prefixes), ('numbers', number_prefixes)):
+            self.report(kind, [self.time(autocomplete, prefix, options['limit']) for prefix in prefixes])
+
+        # The whole view: token check, query parameters, both queries and JSON rendering
+        user = User.objects.order_by('id').first()
+        if user is not None:
+            self.authorization = f'Bearer {RefreshToken.for_user(user).access_token}'
+            self.view = AutocompleteView.as_view()
+            self.report('view', [
+                self.time(self.request_view, prefix, options['limit']) for prefix in name_prefixes + number_prefixes
+            ])
+
+    def request_view(self, prefix, limit):
+        request = RequestFactory().get('/api/autocomplete/', {'prefix': prefix, 'limit': limit})
+        request.META['HTTP_AUTHORIZATION'] = self.authorization
+        self.view(request).render()
+
+    def time(self, function, prefix, limit):
+        started = time.perf_counter()
+        function(prefix, limit)
+        return (time.perf_counter() - started) * 1000
+
+    def report(self, kind, timings):
+        timings.sort()
+        percentile = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))]
+        self.stdout.write(
+            f"{kind:>8}: mean {statistics.fmean(timings):.2f}ms, p50 {percentile(0.5):.2f}ms, "
+            f"p95 {percentile(0.95):.2f}ms, p99 {percentile(0.99):.2f}ms, max {timings[-1]:.2f}ms"
+        )
+
+    def seed(self, rng, count):
+        user, _ = User.objects.get_or_create(
+            username=BENCHMARK_USERNAME, defaults={'phone_number': '+19999999999'},
+        )
+        started = time.monotonic()
+        for offset in range(0, count, SEED_BATCH_SIZE):
+            contacts = []
+            for _ in range(min(SEED_BATCH_SIZE, count - offset)):
+                contact = Contact(
+                    user=user,
+                    name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                    phone_number=f'+{rng.randint(1, 99)}{rng.randint(10 ** 9, 10 ** 10 - 1)}',
+                )
+                contact.set_derived_fields()
+                contacts.append(contact)
+            with transaction.atomic():
+                Contact.objects.bulk_create(contacts, ignore_conflicts=True)
+                refresh_directory({contact.phone_key for contact in contacts})
+                record_name_words(contacts)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f"Seeded {count} contacts in {time.monotonic() - started:.1f}s.")
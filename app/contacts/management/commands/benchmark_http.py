@@ -0,0 +1,109 @@
+import http.client
+import statistics
+import threading
+import time
+from itertools import cycle
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from contacts.models import User
+
+
+DEFAULT_PATHS = ['/api/search/?query=john', '/api/autocomplete/?prefix=jo']
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent authenticated requests to a running server and report its throughput and "
+        "latency percentiles, e.g. to compare runserver with Gunicorn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the server.")
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help=f"Path to request, repeat for several (used in turn). Default: {', '.join(DEFAULT_PATHS)}.",
+        )
+        parser.add_argument('--method', default='GET')
+        parser.add_argument('--body', help="JSON request body.")
+        parser.add_argument('--concurrency', type=int, default=16, help="Clients sending requests at once.")
+        parser.add_argument('--requests', type=int, default=2000, help="Requests in total.")
+        parser.add_argument('--warmup', type=int, default=50, help="Requests sent first and not measured.")
+        parser.add_argument('--username', default='autocomplete-benchmark', help="User the requests are made as.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        user, _ = User.objects.get_or_create(
+            username=options['username'], defaults={'phone_number': '+10000000001'},
+        )
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+        body = options['body'].encode() if options['body'] else None
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        paths = cycle(options['paths'] or DEFAULT_PATHS)
+        lock = threading.Lock()
+        latencies = []
+        errors = []
+
+        def next_path(remaining):
+            with lock:
+                if remaining[0] <= 0:
+                    return None
+                remaining[0] -= 1
+                return next(paths)
+
+        def client(remaining, measure):
+            # One keep-alive connection per client, reopened when the server closes it
+            connection = None
+            while (path := next_path(remaining)) is not None:
+                started = time.perf_counter()
+                try:
+                    if connection is None:
+                        connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+                    connection.request(options['method'], path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        errors.append(response.status)
+                    if response.getheader('Connection', '').lower() == 'close':
+                        connection.close()
+                        connection = None
+                except (OSError, http.client.HTTPException) as exc:
+                    errors.append(type(exc).__name__)
+                    connection = None
+                if measure:
+                    latencies.append(time.perf_counter() - started)
+
+        def run(count, measure):
+            remaining = [count]
+            clients = [
+                threading.Thread(target=client, args=(remaining, measure))
+                for _ in range(options['concurrency'])
+            ]
+            started = time.perf_counter()
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            return time.perf_counter() - started
+
+        run(options['warmup'], measure=False)
+        errors.clear()
+        elapsed = run(options['requests'], measure=True)
+        if not latencies:
+            raise CommandError("No request was sent.")
+
+        latencies.sort()
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"{len(latencies)} requests, concurrency {options['concurrency']}: "
+            f"{len(latencies) / elapsed:.0f} req/s"
+        )
+        self.stdout.write(
+            f"  latency ms: p50 {quantiles[49] * 1000:.1f}  p90 {quantiles[89] * 1000:.1f}  "
+            f"p99 {quantiles[98] * 1000:.1f}  max {latencies[-1] * 1000:.1f}"
+        )
+        if errors:
+            self.stdout.write(self.style.WARNING(f"  {len(errors)} errors, e.g. {errors[:5]}"))
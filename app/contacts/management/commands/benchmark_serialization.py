@@ -0,0 +1,67 @@
+import io
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from contacts import renderers
+from contacts.renderers import MessagePackRenderer, ORJSONParser, ORJSONRenderer, pack_msgpack
+
+
+def search_payload(size, rng):
+    """A page of search results shaped like ``/api/search/`` responses."""
+    return [
+        {
+            'name': f"{rng.choice(['John', 'Zoë', 'Priya', 'Chen'])} {rng.choice(['Doe', 'Ångström', 'Patel', 'Li'])} {i}",
+            'phone_number': f"+{rng.randint(1, 99)}{rng.randint(10 ** 9, 10 ** 10 - 1)}",
+            'spam_likelihood': rng.choice([0.1, 0.3, 1.0]),
+            'email': f"user{i}@example.com" if i % 3 == 0 else None,
+        }
+        for i in range(size)
+    ]
+
+
+def bulk_mark_payload(size, rng):
+    """A ``/api/mark_spam/bulk/`` request body."""
+    return {'phone_numbers': [f"+{rng.randint(10 ** 10, 10 ** 11 - 1)}" for _ in range(size)]}
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode times of DRF's JSON classes, the orjson classes and MessagePack on API payloads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help="Runs per measurement.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        number = options['number']
+        encoders = [('drf json', JSONRenderer().render), ('orjson', ORJSONRenderer().render)]
+        if renderers.msgpack is not None:
+            encoders.append(('msgpack', MessagePackRenderer().render))
+        encoders.append(('msgpack (built-in)', pack_msgpack))
+        decoders = [('drf json', JSONParser().parse), ('orjson', ORJSONParser().parse)]
+
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING("orjson is not installed, its classes fall back to DRF's."))
+
+        payloads = [
+            ('search, 20 results', search_payload(20, rng)),
+            ('search, 100 results', search_payload(100, rng)),
+            ('bulk mark, 1000 numbers', bulk_mark_payload(1000, rng)),
+        ]
+        for label, payload in payloads:
+            self.stdout.write(f"{label}:")
+            body = JSONRenderer().render(payload)
+            for name, encode in encoders:
+                self.report(f"encode {name}", self.time(lambda: encode(payload), number), len(encode(payload)))
+            for name, decode in decoders:
+                self.report(f"decode {name}", self.time(lambda: decode(io.BytesIO(body)), number), len(body))
+
+    def time(self, function, number):
+        # Best of 5, in microseconds per call
+        return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+    def report(self, label, microseconds, size):
+        self.stdout.write(f"  {label:<28} {microseconds:9.1f} us  {size:>7} bytes")
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contacts.spam_cache import get_config
+from contacts.spam_snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    help = "Export all spam numbers to the memory-mapped spam snapshot shared by the workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help="Snapshot file to write (defaults to SPAM_LIKELIHOOD_CACHE['SNAPSHOT_PATH']).",
+        )
+        parser.add_argument(
+            '--interval', type=float,
+            help="Keep running and rebuild the snapshot every this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        path = options['output'] or get_config()['SNAPSHOT_PATH']
+        if not path:
+            raise CommandError("No snapshot path: pass --output or set SPAM_LIKELIHOOD_CACHE['SNAPSHOT_PATH'].")
+
+        while True:
+            started = time.monotonic()
+            count = build_snapshot(path)
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f"Wrote {count} spam numbers to {path} in {elapsed:.2f}s."))
+
+            if not options['interval']:
+                return
+            time.sleep(max(0.0, options['interval'] - elapsed))
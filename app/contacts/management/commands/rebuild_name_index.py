@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contacts.name_index import get_config, name_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the in-process contact name index and write it to its snapshot file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help="Snapshot file to write (defaults to CONTACT_NAME_INDEX['SNAPSHOT_PATH']).",
+        )
+
+    def handle(self, *args, **options):
+        config = get_config()
+        path = options['output'] or config['SNAPSHOT_PATH']
+        if not path:
+            raise CommandError("No snapshot path: pass --output or set CONTACT_NAME_INDEX['SNAPSHOT_PATH'].")
+
+        started = time.monotonic()
+        index = name_index.build(config)
+        built = time.monotonic()
+
+        if index.overflowed:
+            raise CommandError(f"More than {config['MAX_CONTACTS']} contacts, raise CONTACT_NAME_INDEX['MAX_CONTACTS'].")
+
+        index.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index)} contacts ({len(index.postings)} trigrams) in {built - started:.2f}s, "
+            f"wrote {path} in {time.monotonic() - built:.2f}s."
+        ))
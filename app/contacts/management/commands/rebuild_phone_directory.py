@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from contacts.directory import REBUILD_BATCH_SIZE, rebuild_directory
+
+
+class Command(BaseCommand):
+    help = "Recompute the phone directory from users, contacts and spam numbers, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=REBUILD_BATCH_SIZE,
+            help="Phone numbers per batch and transaction.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        entries = batches = 0
+        for count in rebuild_directory(options['batch_size']):
+            entries += count
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Batch {batches}: {count} entries.")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {entries} directory entries in {batches} batches in {time.monotonic() - started:.2f}s."
+        ))
@@ -0,0 +1,283 @@
+"""
+In-process request metrics in the Prometheus text exposition format.
+
+:class:`MetricsMiddleware` counts requests by view (URL name), method and status code and records
+their latency in a histogram with fixed buckets per view. Every thread increments its own shard of
+the counters, so recording a request takes no lock; shards are only summed when scraped.
+
+With several worker processes each one only sees its own requests. Setting ``MULTIPROCESS_DIR``
+makes workers write their counters to a file of their own in that directory, at most every
+``FLUSH_INTERVAL`` seconds and when they exit, and the scrape sums all the files, so one scrape of
+any worker returns the numbers of the whole node. Files of exited workers are kept, so counters do
+not go backwards; empty the directory when the server (re)starts.
+
+Configured by the ``REQUEST_METRICS`` setting:
+
+- ``ENABLED``: record requests (default ``True``). When disabled the middleware removes itself
+  from the middleware chain.
+- ``MULTIPROCESS_DIR`` / ``FLUSH_INTERVAL``: shared directory of the per-process files (default
+  ``None``, each process reports its own numbers) and seconds between writes.
+- ``SCRAPE_TOKEN``: when set, scrapes must send ``Authorization: Bearer <token>``. Otherwise
+  only admin users may read the metrics.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5,
+    'SCRAPE_TOKEN': None,
+}
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# View label of requests that did not match any URL
+UNMATCHED_VIEW = 'unmatched'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class Shard:
+    """Counters written by one thread."""
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        # View -> request count per bucket (the last one is +Inf), followed by the sum of latencies
+        self.latencies = {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+        # Held while this process writes its file
+        self.flush_lock = threading.Lock()
+        self.flushed_at = 0.0
+        self.file_pid = None
+        self.file_path = None
+        self.exit_flush = None
+        if hasattr(os, 'register_at_fork'):
+            # A thread of the parent may have held the lock when the worker was forked
+            os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        self.flush_lock = threading.Lock()
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def observe(self, view, method, status, seconds):
+        shard = self.shard()
+        shard.requests[(view, method, status)] += 1
+        histogram = shard.latencies.get(view)
+        if histogram is None:
+            histogram = shard.latencies[view] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def snapshot(self):
+        """Return the counters of every thread of this process, summed."""
+        requests = defaultdict(int)
+        latencies = {}
+        with self.lock:
+            shards = list(self.shards)
+        for shard in shards:
+            # Copying a dict or list is atomic, so threads can keep recording meanwhile
+            for key, count in dict(shard.requests).items():
+                requests[key] += count
+            for view, histogram in dict(shard.latencies).items():
+                merge_histogram(latencies, view, list(histogram))
+        return {'requests': requests, 'latencies': latencies}
+
+    def flush(self, directory):
+        """Write this process's counters to its file in ``directory``."""
+        with self.flush_lock:
+            self.write(directory)
+
+    def write(self, directory):
+        if self.file_pid != os.getpid() or os.path.dirname(self.file_path) != directory:
+            # Forked workers start their own file, named after the process and its start time
+            self.file_pid = os.getpid()
+            self.file_path = os.path.join(directory, f'metrics-{self.file_pid}-{time.time_ns()}.json')
+        snapshot = self.snapshot()
+        data = {
+            'requests': [[*key, count] for key, count in snapshot['requests'].items()],
+            'latencies': snapshot['latencies'],
+        }
+        # Written next to the file, under a name the scrape skips, then swapped in
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as metrics_file:
+                json.dump(data, metrics_file)
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.flushed_at = time.monotonic()
+
+    def flush_at_exit(self, directory):
+        if self.exit_flush is None:
+            atexit.register(self.exit)
+        self.exit_flush = directory
+
+    def exit(self):
+        try:
+            self.flush(self.exit_flush)
+        except OSError:
+            pass
+
+    def maybe_flush(self, directory, interval):
+        # Requests finding another thread writing the file leave it to that thread
+        if time.monotonic() - self.flushed_at > interval and self.flush_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self.flushed_at > interval:
+                    self.write(directory)
+            finally:
+                self.flush_lock.release()
+
+    def collect(self, directory=None):
+        """Return the counters of this process, or of every process writing to ``directory``."""
+        if directory is None:
+            return self.snapshot()
+
+        self.flush(directory)
+        requests = defaultdict(int)
+        latencies = {}
+        for name in os.listdir(directory):
+            if not name.startswith('metrics-') or not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as metrics_file:
+                    data = json.load(metrics_file)
+            except (OSError, ValueError):
+                continue
+            for view, method, status, count in data['requests']:
+                requests[(view, method, status)] += count
+            for view, histogram in data['latencies'].items():
+                merge_histogram(latencies, view, histogram)
+        return {'requests': requests, 'latencies': latencies}
+
+    def reset(self):
+        with self.lock:
+            self.shards = []
+            self.local = threading.local()
+
+
+def merge_histogram(latencies, view, histogram):
+    total = latencies.get(view)
+    if total is None:
+        latencies[view] = histogram
+    else:
+        for i, value in enumerate(histogram):
+            total[i] += value
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def render_prometheus(metrics):
+    """Render collected metrics in the Prometheus text exposition format."""
+    lines = [
+        '# HELP contacts_http_requests_total Requests by view, method and status code.',
+        '# TYPE contacts_http_requests_total counter',
+    ]
+    for (view, method, status), count in sorted(metrics['requests'].items()):
+        lines.append(
+            f'contacts_http_requests_total{{view="{escape_label(view)}",method="{escape_label(method)}",'
+            f'status="{status}"}} {count}'
+        )
+
+    lines += [
+        '# HELP contacts_http_request_duration_seconds Request latency by view.',
+        '# TYPE contacts_http_request_duration_seconds histogram',
+    ]
+    for view, histogram in sorted(metrics['latencies'].items()):
+        label = f'view="{escape_label(view)}"'
+        cumulative = 0
+        for bound, count in zip((*LATENCY_BUCKETS, float('inf')), histogram):
+            cumulative += count
+            lines.append(f'contacts_http_request_duration_seconds_bucket{{{label},le="{format_bound(bound)}"}} {cumulative}')
+        lines.append(f'contacts_http_request_duration_seconds_sum{{{label}}} {histogram[-1]}')
+        lines.append(f'contacts_http_request_duration_seconds_count{{{label}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.directory = config['MULTIPROCESS_DIR']
+        self.flush_interval = config['FLUSH_INTERVAL']
+        if self.directory:
+            metrics.flush_at_exit(self.directory)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    def record(self, request, response, started):
+        match = request.resolver_match
+        metrics.observe(
+            match.view_name if match else UNMATCHED_VIEW, request.method, response.status_code,
+            time.perf_counter() - started,
+        )
+        if self.directory:
+            try:
+                metrics.maybe_flush(self.directory, self.flush_interval)
+            except OSError:
+                # The request is done, it must not fail on the metrics file
+                logger.warning("Could not write the metrics file to %s.", self.directory, exc_info=True)
+
+
+metrics = MetricsRegistry()
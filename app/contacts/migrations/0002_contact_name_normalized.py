@@ -0,0 +1,40 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def populate_name_normalized(apps, schema_editor):
+    Contact = apps.get_model('contacts', 'Contact')
+    Contact.objects.using(schema_editor.connection.alias).update(name_normalized=Lower('name'))
+
+
+def create_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS contacts_contact_name_trgm '
+            'ON contacts_contact USING gin (name_normalized gin_trgm_ops)'
+        )
+
+
+def drop_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS contacts_contact_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='contact',
+            name='name_normalized',
+            field=models.CharField(db_index=True, default='unknown', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_name_normalized, migrations.RunPython.noop),
+        # SQLite gets its trigram index from contacts.search.install_sqlite_name_index (post_migrate)
+        migrations.RunPython(create_name_trigram_index, drop_name_trigram_index),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:49
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_spam_reports(apps, schema_editor):
+    # Each existing SpamNumber was at least reported by its marked_by user
+    SpamNumber = apps.get_model('contacts', 'SpamNumber')
+    SpamReport = apps.get_model('contacts', 'SpamReport')
+    using = schema_editor.connection.alias
+    now = django.utils.timezone.now()
+
+    rows = SpamNumber.objects.using(using).values_list('marked_by_id', 'phone_number').iterator(chunk_size=5000)
+    batch = []
+    for reporter_id, phone_number in rows:
+        batch.append(SpamReport(reporter_id=reporter_id, phone_number=phone_number, created_at=now))
+        if len(batch) == 5000:
+            SpamReport.objects.using(using).bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    SpamReport.objects.using(using).bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0002_contact_name_normalized'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpamReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=15, validators=[django.core.validators.RegexValidator(message='Enter a valid phone number with country code (e.g., +1234567890).', regex='^\\+?[1-9]\\d{1,14}$')])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reporter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spam_reports', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='spamreport',
+            constraint=models.UniqueConstraint(fields=('reporter', 'phone_number'), name='unique_reporter_phone'),
+        ),
+        migrations.RunPython(backfill_spam_reports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+from django.db import migrations, models
+from django.db.models import BigIntegerField, Case, Count, F, Min, Sum, Value, When
+from django.db.models.functions import Cast, Replace
+
+
+# Same canonical key as contacts.util.phone_number_key, computed in the database
+PHONE_KEY = Case(
+    When(phone_number__regex=r'^\+?[0-9]{1,18}$', then=Cast(Replace(F('phone_number'), Value('+'), Value('')), BigIntegerField())),
+    default=Value(0),
+    output_field=BigIntegerField(),
+)
+
+
+def populate_phone_keys(apps, schema_editor):
+    using = schema_editor.connection.alias
+    for model_name in ['User', 'Contact', 'SpamNumber', 'SpamReport']:
+        apps.get_model('contacts', model_name).objects.using(using).update(phone_key=PHONE_KEY)
+
+    # "+1234567890" and "1234567890" are now the same number: merge their spam counts
+    SpamNumber = apps.get_model('contacts', 'SpamNumber')
+    duplicates = SpamNumber.objects.using(using).values('phone_key').annotate(
+        rows=Count('id'), marked_count=Sum('marked_count'), keep_id=Min('id')
+    ).filter(rows__gt=1)
+    for duplicate in duplicates:
+        SpamNumber.objects.using(using).filter(phone_key=duplicate['phone_key']).exclude(id=duplicate['keep_id']).delete()
+        SpamNumber.objects.using(using).filter(id=duplicate['keep_id']).update(
+            marked_count=duplicate['marked_count'],
+            spam_likelihood=min(1.0, duplicate['marked_count'] * 0.1),
+        )
+
+    SpamReport = apps.get_model('contacts', 'SpamReport')
+    duplicates = SpamReport.objects.using(using).values('reporter_id', 'phone_key').annotate(
+        rows=Count('id'), keep_id=Min('id')
+    ).filter(rows__gt=1)
+    for duplicate in duplicates:
+        SpamReport.objects.using(using).filter(
+            reporter_id=duplicate['reporter_id'], phone_key=duplicate['phone_key']
+        ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0003_spamreport'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='spamreport',
+            name='unique_reporter_phone',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone_key',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='phone_key',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='spamreport',
+            name='phone_key',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='spamnumber',
+            name='phone_key',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_phone_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='spamnumber',
+            name='phone_key',
+            field=models.BigIntegerField(editable=False, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='spamreport',
+            constraint=models.UniqueConstraint(fields=('reporter', 'phone_key'), name='unique_reporter_phone'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0004_phone_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='spamreport',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Min
+
+
+BATCH_SIZE = 2000
+MAX_NAMES = 20
+
+
+def populate_directory(apps, schema_editor):
+    # Same entries as contacts.directory.rebuild_directory, over the historical models
+    User = apps.get_model('contacts', 'User')
+    SpamNumber = apps.get_model('contacts', 'SpamNumber')
+    Contact = apps.get_model('contacts', 'Contact')
+    PhoneDirectory = apps.get_model('contacts', 'PhoneDirectory')
+
+    last = 0
+    while True:
+        uppers = []
+        for model in (Contact, User, SpamNumber):
+            keys = model.objects.filter(phone_key__gt=last).order_by('phone_key').values_list('phone_key', flat=True)
+            uppers += keys.distinct()[BATCH_SIZE - 1:BATCH_SIZE]
+        upper = min(uppers, default=None)
+        key_range = {'phone_key__gt': last}
+        if upper is not None:
+            key_range['phone_key__lte'] = upper
+
+        users = {user.phone_key: user for user in User.objects.filter(**key_range)}
+        spam_numbers = {
+            spam_number.phone_key: spam_number for spam_number in SpamNumber.objects.filter(**key_range)
+        }
+        names = {}
+        rows = Contact.objects.filter(**key_range).values('phone_key', 'name_normalized').annotate(
+            count=Count('id'), display_name=Min('name'), phone_number=Min('phone_number'),
+        ).order_by()
+        for row in rows:
+            names.setdefault(row['phone_key'], []).append(row)
+
+        entries = []
+        for phone_key in set(users) | set(spam_numbers) | set(names):
+            user = users.get(phone_key)
+            spam_number = spam_numbers.get(phone_key)
+            rows = sorted(names.get(phone_key, []), key=lambda row: (-row['count'], row['display_name']))
+            source = user or spam_number
+            entries.append(PhoneDirectory(
+                phone_key=phone_key,
+                phone_number=source.phone_number if source else rows[0]['phone_number'],
+                registered_user=user,
+                names=[[row['display_name'], row['count']] for row in rows[:MAX_NAMES]],
+                contact_count=sum(row['count'] for row in rows),
+                spam_likelihood=spam_number.spam_likelihood if spam_number else 0.1,
+            ))
+        PhoneDirectory.objects.bulk_create(entries)
+
+        if upper is None:
+            return
+        last = upper
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0005_spamreport_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhoneDirectory',
+            fields=[
+                ('phone_key', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('phone_number', models.CharField(max_length=15)),
+                ('names', models.JSONField(default=list)),
+                ('contact_count', models.PositiveIntegerField(default=0)),
+                ('spam_likelihood', models.FloatField(default=0.1)),
+                ('registered_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(populate_directory, migrations.RunPython.noop),
+    ]
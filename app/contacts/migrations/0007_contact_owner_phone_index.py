@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0006_phonedirectory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['user', 'phone_key'], name='contacts_owner_phone_idx'),
+        ),
+    ]
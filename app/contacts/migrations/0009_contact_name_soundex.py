@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:10
+
+from django.db import migrations, models
+
+from contacts.util import name_tokens, soundex
+
+
+BATCH_SIZE = 5000
+
+
+def populate_soundex(apps, schema_editor):
+    Contact = apps.get_model('contacts', 'Contact')
+    last_id = 0
+    while True:
+        batch = list(Contact.objects.filter(id__gt=last_id).order_by('id').only('id', 'name')[:BATCH_SIZE])
+        if not batch:
+            return
+        for contact in batch:
+            tokens = name_tokens(contact.name)
+            contact.name_soundex_first = soundex(tokens[0]) if tokens else ''
+            contact.name_soundex_last = soundex(tokens[-1]) if tokens else ''
+        Contact.objects.bulk_update(batch, ['name_soundex_first', 'name_soundex_last'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0008_drop_redundant_fk_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='name_soundex_first',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='name_soundex_last',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=4),
+        ),
+        migrations.RunPython(populate_soundex, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_name_prefix_index(apps, schema_editor):
+    # Ordered by code point, so a prefix is one contiguous range of the index whatever the
+    # database collation. SQLite's default BINARY collation already orders the plain index this way.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS contacts_contact_name_prefix '
+            'ON contacts_contact ((name_normalized COLLATE "C"), name)'
+        )
+
+
+def drop_name_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS contacts_contact_name_prefix')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0009_contact_name_soundex'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_prefix_index, drop_name_prefix_index),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:51
+
+import contacts.util
+from django.db import migrations, models
+from django.db.models import CharField, Count, F, Q, Value
+from django.db.models.functions import Cast, Concat
+
+
+# Same canonical form as contacts.models.PhoneKeyModel.set_derived_fields: "+" and the key digits
+CANONICAL_PHONE_NUMBER = Concat(Value('+'), Cast(F('phone_key'), CharField()), output_field=CharField())
+
+
+def canonicalize_phone_numbers(apps, schema_editor):
+    using = schema_editor.connection.alias
+    for model_name, unique_fields in [
+        ('SpamNumber', []), ('SpamReport', []), ('PhoneDirectory', []),
+        ('User', ['phone_key']), ('Contact', ['name', 'phone_key']),
+    ]:
+        rows = apps.get_model('contacts', model_name).objects.using(using)
+        # Rows that are the same under a unique constraint once canonical ("+1234567890" and
+        # "1234567890" saved apart) keep their spelling: none of them can be dropped safely
+        collisions = rows.values(*unique_fields).annotate(rows=Count('pk')).filter(rows__gt=1) if unique_fields else []
+        excluded = Q()
+        for collision in collisions:
+            excluded |= Q(**{field: collision[field] for field in unique_fields})
+        changed = rows.filter(phone_key__gt=0).exclude(phone_number=CANONICAL_PHONE_NUMBER)
+        if excluded:
+            changed = changed.exclude(excluded)
+        changed.update(phone_number=CANONICAL_PHONE_NUMBER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0011_contact_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contact',
+            name='phone_number',
+            field=models.CharField(default='0000000000', max_length=16, validators=[contacts.util.PhoneNumberValidator(message='Enter a valid phone number with country code (e.g., +1234567890).', regex='^\\+?[1-9]\\d{1,14}$')]),
+        ),
+        migrations.AlterField(
+            model_name='phonedirectory',
+            name='phone_number',
+            field=models.CharField(max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='spamnumber',
+            name='phone_number',
+            field=models.CharField(max_length=16, unique=True, validators=[contacts.util.PhoneNumberValidator(message='Enter a valid phone number with country code (e.g., +1234567890).', regex='^\\+?[1-9]\\d{1,14}$')]),
+        ),
+        migrations.AlterField(
+            model_name='spamreport',
+            name='phone_number',
+            field=models.CharField(max_length=16, validators=[contacts.util.PhoneNumberValidator(message='Enter a valid phone number with country code (e.g., +1234567890).', regex='^\\+?[1-9]\\d{1,14}$')]),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='phone_number',
+            field=models.CharField(max_length=16, unique=True, validators=[contacts.util.PhoneNumberValidator(message='Enter a valid phone number with country code (e.g., +1234567890).', regex='^\\+?[1-9]\\d{1,14}$')]),
+        ),
+        migrations.RunPython(canonicalize_phone_numbers, migrations.RunPython.noop),
+    ]
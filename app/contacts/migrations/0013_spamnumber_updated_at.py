@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0012_canonical_phone_numbers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spamnumber',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='spamreport',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
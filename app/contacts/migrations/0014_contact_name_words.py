@@ -0,0 +1,83 @@
+# Generated by Django 4.2.30 on 2026-10-17 08:10
+
+from django.db import migrations, models
+
+from contacts.util import name_words, word_soundex
+
+
+BATCH_SIZE = 5000
+
+NAME_WORD_INDEXES = {
+    'contacts_contact_first_word_name': 'name_first_word',
+    'contacts_contact_last_word_name': 'name_last_word',
+}
+
+
+def populate_name_words(apps, schema_editor):
+    Contact = apps.get_model('contacts', 'Contact')
+    NameWord = apps.get_model('contacts', 'NameWord')
+    last_id = 0
+    while True:
+        batch = list(Contact.objects.filter(id__gt=last_id).order_by('id').only('id', 'name_normalized')[:BATCH_SIZE])
+        if not batch:
+            return
+        for contact in batch:
+            words = name_words(contact.name_normalized)
+            contact.name_first_word = words[0] if words else ''
+            contact.name_last_word = words[-1] if words else ''
+        Contact.objects.bulk_update(batch, ['name_first_word', 'name_last_word'])
+        words = {word for contact in batch for word in (contact.name_first_word, contact.name_last_word) if word}
+        NameWord.objects.bulk_create(
+            [NameWord(word=word, soundex=word_soundex(word)) for word in sorted(words)], ignore_conflicts=True,
+        )
+        last_id = batch[-1].id
+
+
+def create_name_word_indexes(apps, schema_editor):
+    # Contacts of one name word in name order, compared by code point like the name prefix index
+    key = 'name_normalized COLLATE "C"' if schema_editor.connection.vendor == 'postgresql' else 'name_normalized'
+    for name, column in NAME_WORD_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON contacts_contact ({column}, ({key}), id)')
+
+
+def drop_name_word_indexes(apps, schema_editor):
+    for name in NAME_WORD_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0013_spamnumber_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NameWord',
+            fields=[
+                ('word', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('soundex', models.CharField(db_index=True, max_length=4)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='name_first_word',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='name_last_word',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_name_words, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='contact',
+            name='name_soundex_first',
+        ),
+        migrations.RemoveField(
+            model_name='contact',
+            name='name_soundex_last',
+        ),
+        # After the field removals, which rebuild the table on SQLite
+        migrations.RunPython(create_name_word_indexes, drop_name_word_indexes),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-17 09:02
+
+from django.db import migrations, models
+
+
+NAME_WORD_INDEXES = {
+    'contacts_contact_first_word_name': 'name_first_word',
+    'contacts_contact_last_word_name': 'name_last_word',
+}
+
+
+def name_key(schema_editor):
+    # Compared by code point: SQLite's default BINARY collation already orders the plain column this way
+    return 'name_normalized COLLATE "C"' if schema_editor.connection.vendor == 'postgresql' else 'name_normalized'
+
+
+def create_name_word_indexes(apps, schema_editor):
+    # Rebuilding the table on SQLite drops the indexes of migration 0014
+    for name, column in NAME_WORD_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON contacts_contact ({column}, ({name_key(schema_editor)}), id)'
+        )
+
+
+def create_name_indexes(apps, schema_editor):
+    # Name pages are ordered by (name, id), the id breaking ties between namesakes, so reading
+    # the index in order needs no sort
+    schema_editor.execute('DROP INDEX IF EXISTS contacts_contact_name_prefix')
+    schema_editor.execute(
+        f'CREATE INDEX contacts_contact_name_prefix ON contacts_contact (({name_key(schema_editor)}), id)'
+    )
+    create_name_word_indexes(apps, schema_editor)
+
+
+def restore_name_prefix_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS contacts_contact_name_prefix')
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX contacts_contact_name_prefix ON contacts_contact ((name_normalized COLLATE "C"), name)'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0014_contact_name_words'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_name_word_indexes),
+        # Superseded by contacts_contact_name_prefix
+        migrations.AlterField(
+            model_name='contact',
+            name='name_normalized',
+            field=models.CharField(default='unknown', editable=False, max_length=255),
+        ),
+        migrations.RunPython(create_name_indexes, restore_name_prefix_index),
+    ]
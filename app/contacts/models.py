@@ -1,10 +1,56 @@
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Least
 from django.contrib.auth.models import AbstractUser
-from .util import phone_number_validator
+from django.utils import timezone
+from .util import phone_number_validator, phone_number_key, normalize_name, name_words, PHONE_NUMBER_MAX_LENGTH
 
 
-class User(AbstractUser):
-    phone_number = models.CharField(max_length=15, unique=True, validators=[phone_number_validator])
+class PhoneKeyModel(models.Model):
+    """
+    Base for models with a ``phone_number``: keeps ``phone_key``, the canonical integer form of the
+    number, in sync so phone lookups and joins compare indexed bigints instead of strings.
+    """
+    phone_key = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    # Fields computed from another one, saved along with it when save() gets update_fields
+    derived_fields = {'phone_number': ('phone_key',)}
+
+    class Meta:
+        abstract = True
+
+    def set_derived_fields(self):
+        # Columns computed from the others, also needed by bulk_create which bypasses save().
+        # Numbers are stored in their canonical E.164 form, so unique constraints on them hold
+        # whatever the formatting they were entered with.
+        self.phone_key = phone_number_key(self.phone_number)
+        if self.phone_key:
+            self.phone_number = f'+{self.phone_key}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Key the row was loaded with, so a changed number can be told apart from a new one
+        instance._loaded_phone_key = instance.__dict__.get('phone_key')
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.set_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {
+                *update_fields,
+                *(
+                    derived
+                    for source, fields in self.derived_fields.items() if source in update_fields
+                    for derived in fields
+                ),
+            }
+        super().save(*args, **kwargs)
+
+
+class User(AbstractUser, PhoneKeyModel):
+    phone_number = models.CharField(max_length=PHONE_NUMBER_MAX_LENGTH, unique=True, validators=[phone_number_validator])
     email = models.EmailField(blank=True, null=True)  # Email is optional
 
     groups = models.ManyToManyField(
@@ -26,30 +72,133 @@ class User(AbstractUser):
         return self.username
 
 
-class SpamNumber(models.Model):
-    phone_number = models.CharField(max_length=15, unique=True, validators=[phone_number_validator])
+# Spam likelihood added by each user marking a number as spam
+SPAM_LIKELIHOOD_PER_MARK = 0.1
+
+# Spam likelihood reported for numbers nobody has marked as spam
+DEFAULT_SPAM_LIKELIHOOD = 0.1
+
+
+class SpamNumber(PhoneKeyModel):
+    phone_number = models.CharField(max_length=PHONE_NUMBER_MAX_LENGTH, unique=True, validators=[phone_number_validator])
+    phone_key = models.BigIntegerField(unique=True, editable=False)
     marked_by = models.ForeignKey(User, related_name="marked_spam", on_delete=models.CASCADE)
     marked_count = models.PositiveIntegerField(default=1)
     spam_likelihood = models.FloatField(default=0.1)  # A value between 0 and 1
+    # Indexed for reading the spam numbers changed since the spam snapshot was built
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Spam: {self.phone_number} marked by {self.marked_by.username} - Likelihood: {self.spam_likelihood}"
 
     def update_spam_likelihood(self):
-        # Update the spam likelihood based on the number of users who marked the number as spam
-        self.spam_likelihood = min(1.0, self.marked_count * 0.1)
-        self.save()
+        # Update the spam likelihood based on the number of users who marked the number as spam,
+        # computed in the database from the stored count so concurrent updates cannot clobber it
+        from .directory import update_spam_likelihoods
+        from .search_cache import search_cache, SPAM_NUMBERS
+        from .spam_cache import spam_cache
+
+        SpamNumber.objects.filter(pk=self.pk).update(
+            spam_likelihood=Least(Value(1.0), F('marked_count') * SPAM_LIKELIHOOD_PER_MARK),
+            updated_at=timezone.now(),
+        )
+        spam_cache.invalidate([self.phone_key])
+        search_cache.bump(SPAM_NUMBERS)
+        self.refresh_from_db(fields=['marked_count', 'spam_likelihood'])
+        update_spam_likelihoods([self])
+
+
+class SpamReport(PhoneKeyModel):
+    """
+    One user's spam mark on a phone number. SpamNumber.marked_count counts these rows and is only
+    bumped when a new reporter inserts one, so repeated marks by the same user are no-ops.
+    """
+    # Reporter lookups use the (reporter, phone_key) unique index
+    reporter = models.ForeignKey(User, related_name='spam_reports', on_delete=models.CASCADE, db_index=False)
+    phone_number = models.CharField(max_length=PHONE_NUMBER_MAX_LENGTH, validators=[phone_number_validator])
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['reporter', 'phone_key'], name='unique_reporter_phone')
+        ]
+
+    def __str__(self):
+        return f"Spam report: {self.phone_number} by {self.reporter.username}"
 
 
-class Contact(models.Model):
-    user = models.ForeignKey(User, related_name='contacts', on_delete=models.CASCADE)
-    phone_number = models.CharField(max_length=15, validators=[phone_number_validator], default='0000000000')
+class Contact(PhoneKeyModel):
+    # Per-user lookups use the (user, phone_key) index
+    user = models.ForeignKey(User, related_name='contacts', on_delete=models.CASCADE, db_index=False)
+    phone_number = models.CharField(max_length=PHONE_NUMBER_MAX_LENGTH, validators=[phone_number_validator], default='0000000000')
     name = models.CharField(max_length=255, default='Unknown')
+    # Lower-cased copy of the name backing the prefix / substring search, indexed along with the
+    # id by migration 0015, see ``contacts.search.name_key``
+    name_normalized = models.CharField(max_length=255, default='unknown', editable=False)
+    # First and last words of the normalized name, backing the fuzzy search. Each is indexed
+    # along with the name order by migration 0014, see ``contacts.search.fuzzy_candidates``
+    name_first_word = models.CharField(max_length=255, default='', editable=False)
+    name_last_word = models.CharField(max_length=255, default='', editable=False)
+    # Lets the in-process name indexes of other workers catch up on renamed contacts
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    derived_fields = {
+        **PhoneKeyModel.derived_fields,
+        'name': ('name_normalized', 'name_first_word', 'name_last_word', 'updated_at'),
+    }
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['name', 'phone_number'], name='unique_name_phone')
         ]
+        indexes = [
+            # Reverse-contact lookups: is this phone number in that user's contacts?
+            models.Index(fields=['user', 'phone_key'], name='contacts_owner_phone_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} - {self.phone_number}'
+
+    def set_derived_fields(self):
+        super().set_derived_fields()
+        self.name_normalized = normalize_name(self.name)
+        words = name_words(self.name_normalized)
+        self.name_first_word = words[0] if words else ''
+        self.name_last_word = words[-1] if words else ''
+
+
+class NameWord(models.Model):
+    """
+    A distinct first or last word of the contact names with its Soundex code: the vocabulary
+    fuzzy searches compute edit distances over, far smaller than the contacts themselves. Words
+    are added as contacts are saved and never removed, a word no contact uses any more only
+    costs an empty index lookup. Maintained by ``contacts.search``.
+    """
+    word = models.CharField(max_length=255, primary_key=True)
+    soundex = models.CharField(max_length=4, db_index=True)
+
+    def __str__(self):
+        return f'{self.word} ({self.soundex})'
+
+
+class PhoneDirectory(models.Model):
+    """
+    Caller-ID entry of one phone number, denormalized from Users, Contacts and SpamNumbers so
+    "who is this number" is a single primary key read. Maintained by ``contacts.directory``.
+    """
+    phone_key = models.BigIntegerField(primary_key=True)
+    phone_number = models.CharField(max_length=PHONE_NUMBER_MAX_LENGTH)
+    registered_user = models.ForeignKey(User, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    # [name, count] pairs of the most common contact names, most saved first
+    names = models.JSONField(default=list)
+    contact_count = models.PositiveIntegerField(default=0)
+    spam_likelihood = models.FloatField(default=DEFAULT_SPAM_LIKELIHOOD)
+
+    def __str__(self):
+        return f'Directory: {self.phone_number}'
+
+    @property
+    def best_name(self):
+        if self.registered_user is not None:
+            return self.registered_user.get_full_name() or self.registered_user.username
+        return self.names[0][0] if self.names else None
@@ -0,0 +1,353 @@
+"""
+Optional in-process trigram index of contact names.
+
+Each worker keeps a map of ``name_normalized`` trigrams to contact ids, so substring searches
+resolve candidate ids in memory and only touch the database to hydrate the results. Gunicorn
+workers load it before serving (``post_worker_init`` in ``gunicorn.conf.py``), other servers in the
+first search. The index is kept current in-process by Contact signals, and every
+``REFRESH_INTERVAL`` catches up on the rows inserted or renamed by other workers: ids above its
+high-water mark and rows whose ``updated_at`` is past the latest it has seen. Until then a
+contact renamed elsewhere is not found under its new name. Catch-up reads and the compaction of
+stale postings run in a background thread started by the first search past the interval, which
+is served from the index as it is. Contacts deleted or renamed away
+elsewhere are harmless, the hydrating query checks every candidate's current name, but their
+entries stay in memory until the worker restarts. It is configured by the ``CONTACT_NAME_INDEX``
+setting:
+
+- ``ENABLED``: turn the index on (default ``False``).
+- ``MAX_CONTACTS``: memory bound; past this many contacts the index disables itself and searches
+  fall back to the database indexes.
+- ``MAX_CANDIDATES``: queries matching more contacts than this are left to the database.
+- ``REFRESH_INTERVAL``: seconds between catch-up reads of newly inserted contacts.
+- ``SNAPSHOT_PATH``: file written by ``manage.py rebuild_name_index`` and loaded by workers
+  instead of reading the whole contact table.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+from .models import Contact
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'MAX_CONTACTS': 5_000_000,
+    'MAX_CANDIDATES': 10_000,
+    'REFRESH_INTERVAL': 30,
+    'SNAPSHOT_PATH': None,
+}
+
+GRAM_LENGTH = 3
+LOAD_CHUNK_SIZE = 20_000
+# Rows updated this long before the latest ``updated_at`` seen are read again, for transactions
+# committing late and clocks differing between servers
+UPDATE_OVERLAP = timedelta(minutes=1)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CONTACT_NAME_INDEX', {})}
+
+
+def trigrams(text):
+    return {text[i:i + GRAM_LENGTH] for i in range(len(text) - GRAM_LENGTH + 1)}
+
+
+class NameIndex:
+    """
+    Trigram -> contact id postings over normalized contact names.
+
+    Postings are append-only arrays; renamed and deleted contacts leave stale ids behind that are
+    filtered out by checking the current name, and compacted away once they pile up.
+    """
+
+    def __init__(self, max_contacts=DEFAULTS['MAX_CONTACTS'], max_candidates=DEFAULTS['MAX_CANDIDATES']):
+        self.max_contacts = max_contacts
+        self.max_candidates = max_candidates
+        self.names = {}
+        self.postings = {}
+        self.high_water_id = 0
+        self.updated_since = None
+        self.stale_postings = 0
+        # Contacts indexed while ``compact`` rebuilds the postings, or None
+        self.compacting = None
+        self.overflowed = False
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _index(self, contact_id, name, postings=None):
+        postings = self.postings if postings is None else postings
+        for gram in trigrams(name):
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array('q')
+            posting.append(contact_id)
+        if self.compacting is not None and postings is self.postings:
+            self.compacting.append((contact_id, name))
+
+    def add(self, contact_id, name):
+        with self.lock:
+            if self.overflowed:
+                return
+
+            previous = self.names.get(contact_id)
+            if previous == name:
+                return
+            if previous is not None:
+                self.stale_postings += len(trigrams(previous))
+            elif len(self.names) >= self.max_contacts:
+                logger.warning("Name index exceeded %d contacts, disabling it.", self.max_contacts)
+                self.overflowed = True
+                self.names.clear()
+                self.postings.clear()
+                return
+
+            self.names[contact_id] = name
+            self._index(contact_id, name)
+            self.high_water_id = max(self.high_water_id, contact_id)
+
+    def remove(self, contact_id):
+        with self.lock:
+            name = self.names.pop(contact_id, None)
+            if name is not None:
+                self.stale_postings += len(trigrams(name))
+
+    def needs_compaction(self):
+        return self.stale_postings > max(1024, len(self.names))
+
+    def compact(self):
+        """
+        Rebuild the postings without stale ids. Searches and changes go on against the current
+        postings meanwhile, the contacts indexed in the meantime are added before swapping.
+        """
+        with self.lock:
+            if self.compacting is not None:
+                return
+            names = dict(self.names)
+            stale_postings = self.stale_postings
+            self.compacting = []
+
+        postings = {}
+        for contact_id, name in names.items():
+            self._index(contact_id, name, postings)
+
+        with self.lock:
+            for contact_id, name in self.compacting:
+                self._index(contact_id, name, postings)
+            if not self.overflowed:
+                self.postings = postings
+            self.stale_postings -= stale_postings
+            self.compacting = None
+
+    def search(self, term):
+        """
+        Return the ids of contacts whose normalized name contains ``term``, or ``None`` when the
+        index cannot answer (disabled, query shorter than a trigram, or too many candidates).
+        """
+        grams = trigrams(term)
+        if self.overflowed or not grams:
+            return None
+
+        with self.lock:
+            postings = []
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    return []
+                postings.append(posting)
+
+            # Verify the rarest trigram's postings against the current names
+            shortest = min(postings, key=len)
+            matches = {
+                contact_id for contact_id in shortest
+                if term in self.names.get(contact_id, '')
+            }
+
+        if len(matches) > self.max_candidates:
+            return None
+        return sorted(matches)
+
+    def load_rows(self, rows):
+        """Bulk-load ``(id, name_normalized)`` rows, used by cold (re)builds and catch-up reads."""
+        with self.lock:
+            names = self.names
+            for contact_id, name in rows:
+                if self.overflowed:
+                    break
+                if contact_id in names or len(names) >= self.max_contacts:
+                    self.add(contact_id, name)
+                    continue
+                # Fast path for contacts not yet indexed
+                names[contact_id] = name
+                self._index(contact_id, name)
+                if contact_id > self.high_water_id:
+                    self.high_water_id = contact_id
+
+    def save(self, path):
+        """Write the index to ``path``, atomically replacing any previous snapshot."""
+        with self.lock:
+            state = {
+                'names': self.names,
+                'postings': {gram: posting.tobytes() for gram, posting in self.postings.items()},
+                'high_water_id': self.high_water_id,
+                'updated_since': self.updated_since,
+                'overflowed': self.overflowed,
+            }
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as snapshot:
+                pickle.dump(state, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, 'rb') as snapshot:
+            state = pickle.load(snapshot)
+
+        index = cls(**kwargs)
+        index.names = state['names']
+        for gram, data in state['postings'].items():
+            posting = index.postings[gram] = array('q')
+            posting.frombytes(data)
+        index.high_water_id = state['high_water_id']
+        index.updated_since = state.get('updated_since')
+        index.overflowed = state['overflowed'] or len(index.names) > index.max_contacts
+        return index
+
+
+class NameIndexRegistry:
+    """Holds the worker's index, loading it once and catching up on contacts changed elsewhere."""
+
+    def __init__(self):
+        self.index = None
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+        # Held by the background refresh while it runs
+        self.refresh_lock = threading.Lock()
+        self.refresher = None
+
+    def build(self, config=None):
+        config = config or get_config()
+        index = NameIndex(config['MAX_CONTACTS'], config['MAX_CANDIDATES'])
+        self.load_changes(index, Contact.objects.all())
+        return index
+
+    def load_changes(self, index, contacts):
+        """Index ``contacts``, moving ``updated_since`` to the latest ``updated_at`` among them."""
+        latest = index.updated_since
+
+        # Load chunk by chunk, so searches only wait for the index while rows are added, not read
+        rows = []
+        values = contacts.order_by().values_list('id', 'name_normalized', 'updated_at')
+        for contact_id, name, updated_at in values.iterator(chunk_size=LOAD_CHUNK_SIZE):
+            if latest is None or updated_at > latest:
+                latest = updated_at
+            rows.append((contact_id, name))
+            if len(rows) == LOAD_CHUNK_SIZE:
+                index.load_rows(rows)
+                rows = []
+        index.load_rows(rows)
+        index.updated_since = latest
+
+    def catch_up(self, index):
+        """Index the contacts inserted or renamed (e.g. by other workers) since ``index`` was loaded."""
+        changed = Q(id__gt=index.high_water_id)
+        if index.updated_since is not None:
+            changed |= Q(updated_at__gte=index.updated_since - UPDATE_OVERLAP)
+        self.load_changes(index, Contact.objects.filter(changed))
+
+    def load(self, config):
+        path = config['SNAPSHOT_PATH']
+        if not path or not os.path.exists(path):
+            return self.build(config)
+
+        index = NameIndex.load(path, max_contacts=config['MAX_CONTACTS'], max_candidates=config['MAX_CANDIDATES'])
+        # Catch up on contacts changed since the snapshot was written
+        self.catch_up(index)
+        return index
+
+    def get(self):
+        """Return the worker's index, or ``None`` when it is disabled."""
+        config = get_config()
+        if not config['ENABLED']:
+            return None
+
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    started = time.monotonic()
+                    self.index = self.load(config)
+                    self.refreshed_at = time.monotonic()
+                    logger.info(
+                        "Loaded name index with %d contacts in %.2fs.",
+                        len(self.index), self.refreshed_at - started,
+                    )
+        elif time.monotonic() - self.refreshed_at > config['REFRESH_INTERVAL']:
+            self.refresh_in_background()
+
+        return self.index
+
+    def refresh(self):
+        """Index contacts inserted or renamed (e.g. by other workers) since the last load or refresh."""
+        with self.lock:
+            self.refreshed_at = time.monotonic()
+            index = self.index
+            if index is None or index.overflowed:
+                return
+            self.catch_up(index)
+        if index.needs_compaction():
+            index.compact()
+
+    def refresh_in_background(self):
+        """Start a refresh in a thread of its own, unless one is running already."""
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.refresher = threading.Thread(target=self._refresh_and_release, name='name-index-refresh', daemon=True)
+            self.refresher.start()
+        except BaseException:
+            self.refresh_lock.release()
+            raise
+
+    def _refresh_and_release(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Name index refresh failed.")
+        finally:
+            connections.close_all()
+            self.refresh_lock.release()
+
+    def load_inserted(self):
+        """Index the contacts inserted since the last load or refresh, e.g. by a bulk import."""
+        with self.lock:
+            index = self.index
+            if index is None or index.overflowed:
+                return
+            rows = Contact.objects.filter(id__gt=index.high_water_id).order_by().values_list('id', 'name_normalized')
+            index.load_rows(rows.iterator(chunk_size=LOAD_CHUNK_SIZE))
+
+    def reset(self):
+        with self.lock:
+            self.index = None
+
+    def contact_saved(self, sender, instance, **kwargs):
+        if self.index is not None:
+            self.index.add(instance.id, instance.name_normalized)
+
+    def contact_deleted(self, sender, instance, **kwargs):
+        if self.index is not None:
+            self.index.remove(instance.id)
+
+
+name_index = NameIndexRegistry()
@@ -0,0 +1,131 @@
+"""
+Fast JSON and MessagePack renderers and parser for the REST API.
+
+JSON is encoded and decoded with ``orjson`` when it is installed, producing the same compact,
+non-ASCII-escaped output as DRF's ``JSONRenderer`` with its default settings, and falls back to
+DRF's pure-Python classes otherwise. MessagePack uses ``msgpack`` when installed and a small
+built-in packer otherwise. Values neither library knows (lazy translations, decimals, dates...)
+are converted by DRF's JSON encoder in both formats.
+"""
+import struct
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+# Datetimes are passed through to DRF's encoder, so they keep its format ("Z" for UTC)
+encoder_default = JSONEncoder().default
+
+
+def json_dumps(data):
+    """Encode ``data`` as compact UTF-8 JSON bytes, with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data, default=encoder_default, option=ORJSON_OPTIONS)
+    return JSONRenderer().render(data)
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Indented output (e.g. "Accept: application/json; indent=4") is left to DRF
+        if orjson is None or data is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return json_dumps(data)
+
+
+class ORJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+def pack_msgpack(data, default=encoder_default):
+    """Encode ``data`` as MessagePack in pure Python, for when ``msgpack`` is not installed."""
+    parts = []
+    _pack(data, parts, default)
+    return b''.join(parts)
+
+
+def _pack_length(parts, length, fix_marker, fix_limit, markers):
+    if length < fix_limit:
+        parts.append(bytes([fix_marker | length]))
+        return
+    for marker, fmt in markers:
+        if length < 1 << (8 * struct.calcsize(fmt)):
+            parts.append(bytes([marker]) + struct.pack(f'>{fmt}', length))
+            return
+    raise ValueError("Object too large for MessagePack.")
+
+
+def _pack(obj, parts, default):
+    if obj is None:
+        parts.append(b'\xc0')
+    elif obj is True or obj is False:
+        parts.append(b'\xc3' if obj else b'\xc2')
+    elif isinstance(obj, int):
+        if 0 <= obj < 128:
+            parts.append(bytes([obj]))
+        elif -32 <= obj < 0:
+            parts.append(struct.pack('>b', obj))
+        elif obj > 0:
+            _pack_length(parts, obj, 0, 0, [(0xcc, 'B'), (0xcd, 'H'), (0xce, 'I'), (0xcf, 'Q')])
+        elif obj >= -1 << 63:
+            marker, fmt = next(
+                (marker, fmt) for marker, fmt in [(0xd0, 'b'), (0xd1, 'h'), (0xd2, 'i'), (0xd3, 'q')]
+                if obj >= -1 << (8 * struct.calcsize(fmt) - 1)
+            )
+            parts.append(bytes([marker]) + struct.pack(f'>{fmt}', obj))
+        else:
+            raise OverflowError("Integer too small for MessagePack.")
+    elif isinstance(obj, float):
+        parts.append(b'\xcb' + struct.pack('>d', obj))
+    elif isinstance(obj, str):
+        encoded = obj.encode()
+        _pack_length(parts, len(encoded), 0xa0, 32, [(0xd9, 'B'), (0xda, 'H'), (0xdb, 'I')])
+        parts.append(encoded)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        encoded = bytes(obj)
+        _pack_length(parts, len(encoded), 0, 0, [(0xc4, 'B'), (0xc5, 'H'), (0xc6, 'I')])
+        parts.append(encoded)
+    elif isinstance(obj, (list, tuple)):
+        _pack_length(parts, len(obj), 0x90, 16, [(0xdc, 'H'), (0xdd, 'I')])
+        for item in obj:
+            _pack(item, parts, default)
+    elif isinstance(obj, dict):
+        _pack_length(parts, len(obj), 0x80, 16, [(0xde, 'H'), (0xdf, 'I')])
+        for key, value in obj.items():
+            _pack(key, parts, default)
+            _pack(value, parts, default)
+    else:
+        _pack(default(obj), parts, default)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if msgpack is not None:
+            return msgpack.packb(data, default=encoder_default, use_bin_type=True)
+        return pack_msgpack(data)
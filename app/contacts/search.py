@@ -0,0 +1,591 @@
+import asyncio
+import base64
+import binascii
+import collections
+import itertools
+import json
+
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Collate
+
+from .concurrency import database_task
+from .models import User, Contact, NameWord, PhoneDirectory
+from .name_index import name_index
+from .search_cache import search_cache
+from .spam_cache import spam_cache
+from .streaming import chunked
+from .util import edit_distance, name_words, normalize_name, phone_number_key, word_soundex
+
+
+# Number of search results per page
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Results per server-side cursor fetch when streaming all results
+STREAM_CHUNK_SIZE = 500
+
+# Ranks of the name matches: names starting with the query, then names containing it
+PREFIX_RANK = 0
+CONTAINS_RANK = 1
+
+# Rank of the names saved for a phone number query that did not match it by name
+DIRECTORY_RANK = 2
+
+# Trigram indexes can only serve substrings of at least this many characters
+TRIGRAM_LENGTH = 3
+
+# Rank of fuzzy matches with an edit distance of 0, ranks grow with the distance
+FUZZY_RANK = 3
+
+# Contact ids are bigints
+MAX_CONTACT_ID = 2 ** 63 - 1
+
+# Name words read by one fuzzy candidates query, well below SQLite's 500 terms of a compound SELECT
+FUZZY_STREAMS_PER_QUERY = 100
+
+# Vocabulary words sharing a Soundex code with the query read per fetch
+FUZZY_VOCABULARY_FETCH_SIZE = 2000
+
+FUZZY_CANDIDATE_FIELDS = [
+    'id', 'name', 'name_normalized', 'phone_number', 'phone_key', 'name_first_word', 'name_last_word',
+]
+
+# SQLite stand-in for the PostgreSQL pg_trgm index: an FTS5 trigram table over
+# ``contacts_contact.name_normalized``, kept in sync by triggers
+SQLITE_NAME_INDEX = 'contacts_contact_name_fts'
+SQLITE_NAME_INDEX_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_NAME_INDEX} USING fts5(
+        name_normalized, content='contacts_contact', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_NAME_INDEX}_insert AFTER INSERT ON contacts_contact BEGIN
+        INSERT INTO {SQLITE_NAME_INDEX}(rowid, name_normalized) VALUES (new.id, new.name_normalized);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_NAME_INDEX}_delete AFTER DELETE ON contacts_contact BEGIN
+        INSERT INTO {SQLITE_NAME_INDEX}({SQLITE_NAME_INDEX}, rowid, name_normalized)
+        VALUES ('delete', old.id, old.name_normalized);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_NAME_INDEX}_update AFTER UPDATE OF name_normalized ON contacts_contact BEGIN
+        INSERT INTO {SQLITE_NAME_INDEX}({SQLITE_NAME_INDEX}, rowid, name_normalized)
+        VALUES ('delete', old.id, old.name_normalized);
+        INSERT INTO {SQLITE_NAME_INDEX}(rowid, name_normalized) VALUES (new.id, new.name_normalized);
+    END
+    """,
+]
+
+
+def install_sqlite_name_index(using='default', **kwargs):
+    """
+    Create the SQLite trigram index for contact names, rebuilding it when its triggers are missing.
+
+    Connected to ``post_migrate``: SQLite migrations that rebuild ``contacts_contact`` drop its
+    triggers, so they are checked (and the index rebuilt) after every migrate run.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        if 'contacts_contact' not in connection.introspection.table_names(cursor):
+            return
+
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{SQLITE_NAME_INDEX}_%'],
+        )
+        if cursor.fetchone()[0] == len(SQLITE_NAME_INDEX_SQL) - 1:
+            return
+
+        for statement in SQLITE_NAME_INDEX_SQL:
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {SQLITE_NAME_INDEX}({SQLITE_NAME_INDEX}) VALUES ('rebuild')")
+
+
+def name_key(using='default'):
+    """
+    Return the normalized name compared by code point, the order of the name indexes:
+    ``contacts_contact_name_prefix`` is an index of ``(name_normalized COLLATE "C", id)`` on
+    PostgreSQL, of ``(name_normalized, id)`` on SQLite whose default collation already compares
+    code points.
+    """
+    if connections[using].vendor == 'postgresql':
+        return Collate(F('name_normalized'), 'C')
+    return F('name_normalized')
+
+
+def name_match_filters(query, using='default'):
+    """
+    Return ``(contains, prefix)`` Q objects matching contact names against the query, the prefix
+    on the ``name_key`` annotation (see :func:`name_key`).
+
+    The prefix is a range of the name index. On PostgreSQL ``LIKE '%q%'`` is served by the pg_trgm
+    GIN index, on SQLite substrings go through the FTS5 trigram table.
+    """
+    term = normalize_name(query)
+
+    # Every string starting with the term sorts between the term and the term followed by the
+    # highest code point
+    prefix = Q(name_key__gte=term, name_key__lt=term + '\U0010ffff')
+
+    if connections[using].vendor != 'sqlite' or len(term) < TRIGRAM_LENGTH:
+        return Q(name_normalized__contains=term), prefix
+
+    phrase = '"' + term.replace('"', '""') + '"'
+    contains = Q(id__in=RawSQL(
+        f'SELECT rowid FROM {SQLITE_NAME_INDEX} WHERE {SQLITE_NAME_INDEX} MATCH %s',
+        [phrase],
+    ))
+    return contains, prefix
+
+
+def visible_emails(viewer, phone_keys):
+    """
+    Return the emails of the registered users owning ``phone_keys`` that ``viewer`` may see, i.e.
+    whose contact list holds the viewer's phone number, as a dict keyed by phone key.
+
+    One query for a whole page of results: each registered user is probed in the
+    ``(user, phone_key)`` index of their contacts for the viewer's current number.
+    """
+    if not phone_keys:
+        return {}
+    return dict(
+        User.objects.filter(
+            phone_key__in=phone_keys, contacts__phone_key=viewer.phone_key, email__isnull=False,
+        ).values_list('phone_key', 'email').distinct()
+    )
+
+
+def directory_matches(phone_key, term):
+    """
+    Return the names saved for the phone number ``phone_key`` as rank 2 results, read from its
+    PhoneDirectory entry in a single primary key lookup. Names containing ``term`` are left out as
+    they already matched by name.
+    """
+    entry = PhoneDirectory.objects.filter(pk=phone_key).first()
+    if entry is None:
+        return []
+
+    matches = []
+    for name, count in entry.names:
+        result = Contact(id=0, name=name, phone_number=entry.phone_number)
+        result.set_derived_fields()
+        if term in result.name_normalized:
+            continue
+        result.match_rank = DIRECTORY_RANK
+        matches.append(result)
+    return sorted(matches, key=lambda result: result.name_normalized)
+
+
+def max_edit_distance(word):
+    """Typos tolerated in a query word: none in very short words, one in short words, else two."""
+    return 0 if len(word) <= 2 else 1 if len(word) <= 4 else 2
+
+
+def record_name_words(contacts):
+    """Add the first and last name words of ``contacts`` to the fuzzy search vocabulary."""
+    words = {word for contact in contacts for word in (contact.name_first_word, contact.name_last_word) if word}
+    NameWord.objects.bulk_create(
+        [NameWord(word=word, soundex=word_soundex(word)) for word in sorted(words)], ignore_conflicts=True,
+    )
+
+
+def contact_name_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'name' in update_fields:
+        record_name_words([instance])
+
+
+def near_words(query_words):
+    """
+    Return, for each query word, the vocabulary words sharing its Soundex code within
+    :func:`max_edit_distance` of it, mapped to their edit distance. One indexed read of the
+    NameWord table, whatever the number of contacts using the words.
+    """
+    codes = [word_soundex(word) for word in query_words]
+    near = [{} for _ in query_words]
+    vocabulary = NameWord.objects.filter(soundex__in=set(codes) - {''}).values_list('word', 'soundex')
+    for word, code in vocabulary.iterator(chunk_size=FUZZY_VOCABULARY_FETCH_SIZE):
+        for query_word, query_code, distances in zip(query_words, codes, near):
+            if code == query_code:
+                bound = max_edit_distance(query_word)
+                distance = edit_distance(query_word, word, bound)
+                if distance <= bound:
+                    distances[word] = distance
+    return near
+
+
+def fuzzy_distance(near, contact):
+    """
+    Return the total edit distance between the query words and the closest of the first and last
+    words of the contact name, or ``None`` when a query word is near neither of them.
+    """
+    total = 0
+    for distances in near:
+        distance = min(
+            (distances[word] for word in (contact.name_first_word, contact.name_last_word) if word in distances),
+            default=None,
+        )
+        if distance is None:
+            return None
+        total += distance
+    return total
+
+
+def fuzzy_candidates(anchors, other_words, after, fetch_size, using='default'):
+    """
+    Return, for each name word of ``anchors``, the first ``fetch_size`` contacts whose first or
+    last word it is, in name order after the ``(name, id)`` position ``after``, each contact with
+    the ``fuzzy_stream`` it was read from.
+
+    Each word and side is one range of its ``(word, name, id)`` index, read in order, and the
+    rows it returns must also use one of the name words near each other query word, the
+    ``other_words`` mappings of :func:`near_words`. As in
+    :func:`contacts.autocomplete.complete_numbers` the ranges are LIMITed subqueries joined by
+    UNION ALL, ``FUZZY_STREAMS_PER_QUERY`` per query.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    key = qn('name_normalized')
+    if connection.vendor == 'postgresql':
+        key = f'({key} COLLATE "C")'
+    fields = ', '.join(qn(field) for field in FUZZY_CANDIDATE_FIELDS)
+    others = ''.join(
+        f" AND ({qn('name_first_word')} IN ({', '.join(['%s'] * len(distances))})"
+        f" OR {qn('name_last_word')} IN ({', '.join(['%s'] * len(distances))}))"
+        for distances in other_words
+    )
+    others_params = [word for distances in other_words for word in [*distances, *distances]]
+    position = f" AND {key} >= %s AND ({key} > %s OR {qn('id')} > %s)" if after is not None else ''
+    position_params = [after[0], after[0], after[1]] if after is not None else []
+
+    streams = [(side, word) for word in anchors for side in ('name_first_word', 'name_last_word')]
+    candidates = []
+    for offset in range(0, len(streams), FUZZY_STREAMS_PER_QUERY):
+        scans, params = [], []
+        for i, (side, word) in enumerate(streams[offset:offset + FUZZY_STREAMS_PER_QUERY], offset):
+            scans.append(f"""
+                SELECT * FROM (
+                    SELECT {i} AS fuzzy_stream, {fields} FROM {qn(Contact._meta.db_table)}
+                    WHERE {qn(side)} = %s{position}{others}
+                    ORDER BY {key}, {qn('id')} LIMIT %s
+                ) AS word_{i}
+            """)
+            params += [word, *position_params, *others_params, fetch_size]
+        candidates += Contact.objects.using(using).raw(' UNION ALL '.join(scans), params)
+    return candidates
+
+
+def fuzzy_band(term, near, distance, after, fetch_size):
+    """
+    Yield the fuzzy matches at ``distance`` of the query words ``near`` describes, in name order after ``after``.
+
+    Contacts are read from the streams of the name words near the first query word, a few at a
+    time, and merged up to the first stream cut short by ``fetch_size``, the next read resuming
+    there. A single query word is as near as its closest name word, so only the words at exactly
+    ``distance`` are read. Otherwise the other query words may add to the distance, and contacts
+    read at the wrong distance are skipped, to be read again by their own band.
+    """
+    anchors = [
+        word for word, word_distance in near[0].items()
+        if (word_distance == distance if len(near) == 1 else word_distance <= distance)
+        # All the contacts using a word containing the query matched it exactly
+        and term not in word
+    ]
+    while anchors:
+        candidates = fuzzy_candidates(anchors, near[1:], after, fetch_size)
+        stream_sizes = collections.Counter(contact.fuzzy_stream for contact in candidates)
+        candidates.sort(key=lambda contact: (contact.name_normalized, contact.id))
+        # Streams cut short may continue with names before the end of the others
+        last_read = {contact.fuzzy_stream: (contact.name_normalized, contact.id) for contact in candidates}
+        end = min(
+            (position for stream, position in last_read.items() if stream_sizes[stream] == fetch_size),
+            default=None,
+        )
+        previous_id = None
+        for contact in candidates:
+            if end is not None and (contact.name_normalized, contact.id) > end:
+                break
+            # A contact with the same word at both ends is read twice
+            if contact.id == previous_id:
+                continue
+            previous_id = contact.id
+            if term in contact.name_normalized or fuzzy_distance(near, contact) != distance:
+                continue
+            contact.match_rank = FUZZY_RANK + distance
+            yield contact
+        if end is None:
+            return
+        after = end
+
+
+def iter_fuzzy_matches(term, position, fetch_size):
+    """
+    Yield the contacts whose first or last name words sound like the words of the normalized
+    query ``term`` and are within a few typos of them, as results ranked after the exact matches:
+    ``FUZZY_RANK`` plus the total edit distance, then by name. With ``position`` only the matches
+    after that ``(rank, name, id)`` cursor position. Contacts are read ``fetch_size`` per name
+    word at a time, the size of a page or of a streamed chunk.
+
+    Edit distances are computed over the vocabulary of name words (see :func:`near_words`), never
+    over the contacts, which are then read in name order through the indexes of their first and
+    last words with keyset pagination, see :func:`fuzzy_band`. Names containing the query are left
+    out as they already matched exactly.
+    """
+    query_words = name_words(term)
+    near = near_words(query_words)
+    if not near or not all(near):
+        return
+
+    for distance in range(sum(max_edit_distance(word) for word in query_words) + 1):
+        after = None
+        if position is not None:
+            if FUZZY_RANK + distance < position[0]:
+                continue
+            if FUZZY_RANK + distance == position[0]:
+                after = tuple(position[1:])
+        yield from fuzzy_band(term, near, distance, after, fetch_size)
+
+
+def fuzzy_matches(term, position, limit):
+    """Return the first ``limit`` fuzzy matches after ``position``, see :func:`iter_fuzzy_matches`."""
+    return list(itertools.islice(iter_fuzzy_matches(term, position, limit), limit))
+
+
+def serialize_result(contact, spam_likelihoods):
+    """Return the viewer-independent fields of a result; the email is added per viewer."""
+    return {
+        'name': contact.name,
+        'phone_number': contact.phone_number,
+        'spam_likelihood': spam_likelihoods[contact.phone_key],
+        'phone_key': contact.phone_key,
+    }
+
+
+def with_emails(results, viewer):
+    """Complete viewer-independent results with the emails ``viewer`` may see, in one query."""
+    return add_emails(results, visible_emails(viewer, {result['phone_key'] for result in results}))
+
+
+def add_emails(results, emails):
+    """Complete viewer-independent results with ``emails``, as returned by :func:`visible_emails`."""
+    return [
+        {
+            'name': result['name'],
+            'phone_number': result['phone_number'],
+            'spam_likelihood': result['spam_likelihood'],
+            'email': emails.get(result['phone_key']),
+        }
+        for result in results
+    ]
+
+
+def encode_cursor(contact):
+    position = [contact.match_rank, contact.name_normalized, contact.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def max_match_rank(query):
+    """Rank of the last possible results of ``query``: fuzzy matches off by all the typos it tolerates."""
+    return FUZZY_RANK + sum(max_edit_distance(word) for word in name_words(normalize_name(query)))
+
+
+def decode_cursor(cursor, query):
+    """
+    Decode a cursor produced by :func:`encode_cursor` for ``query``, raising ``ValueError`` if it
+    is malformed or out of the range of the ranks and ids it can hold.
+    """
+    try:
+        match_rank, name, contact_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, binascii.Error, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if not isinstance(match_rank, int) or not isinstance(name, str) or not isinstance(contact_id, int):
+        raise ValueError("Invalid cursor.")
+    if not 0 <= match_rank <= max_match_rank(query) or not 0 <= contact_id <= MAX_CONTACT_ID:
+        raise ValueError("Invalid cursor.")
+    return match_rank, name, contact_id
+
+
+def name_bands(query, term):
+    """
+    Return the contacts whose name contains the query as ``(rank, contacts)`` pairs in result
+    order: names starting with it, then the others. Both querysets are annotated with the
+    ``name_key`` their results are ordered by, then by id.
+    """
+    name_contains, name_prefix = name_match_filters(query)
+
+    # Let the in-process name index resolve the candidates when it is enabled
+    index = name_index.get()
+    candidate_ids = index.search(term) if index is not None else None
+    if candidate_ids is not None:
+        name_contains = Q(id__in=candidate_ids, name_normalized__contains=term)
+
+    contacts = Contact.objects.annotate(name_key=name_key())
+    return [
+        (PREFIX_RANK, contacts.filter(name_prefix)),
+        (CONTAINS_RANK, contacts.filter(name_contains).exclude(name_prefix)),
+    ]
+
+
+def name_page(query, term, position, limit):
+    """
+    Return up to ``limit + 1`` name matches (ranks 0 and 1) following the cursor ``position``.
+
+    Each rank is read by its own keyset query in the order of the name index, seeking past the
+    cursor's name, so a page reads about ``limit`` index entries however many names match
+    instead of ranking and sorting all of them. Names starting with the query are one range of
+    the index.
+    """
+    if position is not None and position[0] > CONTAINS_RANK:
+        return []
+
+    page = []
+    for rank, matches in name_bands(query, term):
+        if position is not None and position[0] > rank:
+            continue
+        if position is not None and position[0] == rank:
+            _, name, contact_id = position
+            # Seek to the cursor's name, then skip the ids up to the cursor's among its namesakes
+            matches = matches.filter(name_key__gte=name).exclude(name_key=name, id__lte=contact_id)
+        for contact in matches.order_by('name_key', 'id')[:limit + 1 - len(page)]:
+            contact.match_rank = rank
+            page.append(contact)
+        if len(page) > limit:
+            break
+    return page
+
+
+def extra_page(query, term, position, limit, fuzzy):
+    """
+    Return up to ``limit + 1`` of the results ranked after the name matches, following the cursor
+    ``position``: the names saved for the phone number when the query is one, else with ``fuzzy``
+    the names within a few typos of the query.
+    """
+    # Phone numbers match on their canonical key, whatever their formatting
+    phone_key = phone_number_key(query)
+    if phone_key:
+        matches = directory_matches(phone_key, term)
+        if position is not None and position[0] == DIRECTORY_RANK:
+            matches = [result for result in matches if result.name_normalized > position[1]]
+    elif fuzzy:
+        after = tuple(position) if position is not None and position[0] >= FUZZY_RANK else None
+        return fuzzy_matches(term, after, limit + 1)
+    else:
+        return []
+    return matches[:limit + 1]
+
+
+def paginate(matches, limit):
+    """Split the matches following a cursor into a page and the cursor of the next one."""
+    next_cursor = encode_cursor(matches[limit - 1]) if len(matches) > limit else None
+    return matches[:limit], next_cursor
+
+
+def search_page(query, limit, cursor, fuzzy):
+    """
+    Return one page of search results, without the viewer-dependent emails, and the cursor of
+    the next page (``None`` on the last page).
+
+    Names starting with the query come first, then names containing it, each group ordered by
+    name. Pages are fetched by seeking past the ``(rank, name, id)`` position in ``cursor``, so
+    every page costs one bounded SQL statement per rank it spans however deep it is, plus one for
+    the spam likelihoods missing from the cache. When the query is a phone number, the names saved
+    for it that did not match come last, read from its PhoneDirectory entry. Otherwise ``fuzzy``
+    adds names within a few typos of the query after the exact matches, see :func:`fuzzy_matches`.
+    """
+    term = normalize_name(query)
+    position = decode_cursor(cursor, query) if cursor is not None else None
+
+    page = name_page(query, term, position, limit)
+    if len(page) <= limit:
+        page += extra_page(query, term, position, limit, fuzzy)
+    page, next_cursor = paginate(page, limit)
+
+    # Spam likelihoods come from the cache, at most one query for the numbers it misses
+    spam_likelihoods = spam_cache.get_many({contact.phone_key for contact in page})
+
+    return [serialize_result(contact, spam_likelihoods) for contact in page], next_cursor
+
+
+def search_contacts(query, viewer, limit=DEFAULT_PAGE_SIZE, cursor=None, fuzzy=False):
+    """
+    Search contacts by name and phone number, one page at a time, see :func:`search_page`.
+
+    Pages are shared by all viewers through the search result cache, keyed by the normalized
+    query, then completed with the emails ``viewer`` may see in one more query.
+
+    Returns the page of results and the cursor of the next page (``None`` on the last page).
+    """
+    # Matching only depends on the normalized query
+    query = normalize_name(query)
+    results, next_cursor = search_cache.get_or_compute(
+        (query, limit, cursor, fuzzy), lambda: search_page(query, limit, cursor, fuzzy),
+    )
+
+    return with_emails(results, viewer), next_cursor
+
+
+async def asearch_contacts(query, viewer, limit=DEFAULT_PAGE_SIZE, cursor=None, fuzzy=False):
+    """
+    :func:`search_contacts` for async views, running the independent queries of a page at the
+    same time, see :mod:`contacts.concurrency`.
+
+    The name matches and the matches ranked after them (phone number or typos) are read together,
+    the latter even when the name matches fill the page, then the spam likelihoods and the emails
+    ``viewer`` may see are read together. Raises ``ValueError`` for a malformed cursor.
+    """
+    query = normalize_name(query)
+    position = decode_cursor(cursor, query) if cursor is not None else None
+    emails = None
+
+    async def compute():
+        nonlocal emails
+        names, extras = await asyncio.gather(
+            database_task(name_page, query, query, position, limit),
+            database_task(extra_page, query, query, position, limit, fuzzy),
+        )
+        page, next_cursor = paginate(names + extras, limit)
+        phone_keys = {contact.phone_key for contact in page}
+        spam_likelihoods, emails = await asyncio.gather(
+            database_task(spam_cache.get_many, phone_keys),
+            database_task(visible_emails, viewer, phone_keys),
+        )
+        return [serialize_result(contact, spam_likelihoods) for contact in page], next_cursor
+
+    results, next_cursor = await search_cache.aget_or_compute((query, limit, cursor, fuzzy), compute)
+    if emails is None:
+        emails = await database_task(visible_emails, viewer, {result['phone_key'] for result in results})
+    return add_emails(results, emails), next_cursor
+
+
+def iter_search_results(query, viewer, fuzzy=False, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield every result of a search, in the order of the :func:`search_contacts` pages, as lists of
+    at most ``chunk_size`` results.
+
+    Name matches are read through a server-side cursor ``chunk_size`` rows at a time, and each
+    chunk costs one spam likelihood and one email visibility query, so memory use does not depend
+    on the number of results. Results are not cached.
+    """
+    query = normalize_name(query)
+    matches = itertools.chain.from_iterable(
+        contacts.order_by('name_key', 'id').iterator(chunk_size=chunk_size)
+        for _, contacts in name_bands(query, query)
+    )
+
+    def extra_matches():
+        phone_key = phone_number_key(query)
+        if phone_key:
+            yield from directory_matches(phone_key, query)
+        elif fuzzy:
+            yield from iter_fuzzy_matches(query, None, chunk_size)
+
+    for chunk in chunked(itertools.chain(matches, extra_matches()), chunk_size):
+        spam_likelihoods = spam_cache.get_many({contact.phone_key for contact in chunk})
+        yield with_emails([serialize_result(contact, spam_likelihoods) for contact in chunk], viewer)
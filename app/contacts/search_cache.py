@@ -0,0 +1,200 @@
+"""
+Cache of search result pages.
+
+Pages are cached without the per-viewer ``email`` field, keyed by the normalized query and the
+page parameters, so every user searching for the same thing shares the entry and only the email
+visibility check runs per request. Nothing is deleted on writes: the keys embed generation
+counters, one for contacts and one for spam numbers, that are bumped whenever those tables change,
+so entries computed before a change are simply never read again and age out of the LRU.
+
+Counters are bumped by Contact and SpamNumber save/delete signals and by the bulk paths that
+bypass them (contact imports and spam marks), on the spot and again once their transaction
+commits. Configured by the ``SEARCH_RESULT_CACHE`` setting:
+
+- ``ENABLED``: turn caching on (default ``True``).
+- ``MAX_ENTRIES`` / ``TTL``: size and lifetime in seconds of the per-process tier. Without a shared
+  cache the generation counters are per process too, so changes made through other workers show
+  up once the entries expire.
+- ``SHARED_CACHE`` / ``SHARED_TTL``: alias in ``CACHES`` holding the generation counters and a
+  second tier of pages shared by all workers (default ``None``, disabled), and lifetime of its pages.
+"""
+import hashlib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .spam_cache import LRUCache
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 2000,
+    'TTL': 30,
+    'SHARED_CACHE': None,
+    'SHARED_TTL': 60,
+}
+
+CONTACTS = 'contacts'
+SPAM_NUMBERS = 'spam_numbers'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SEARCH_RESULT_CACHE', {})}
+
+
+class SearchResultCache:
+    def __init__(self):
+        self.local = None
+        self.config = None
+        self.generations = {CONTACTS: 0, SPAM_NUMBERS: 0}
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'bumps': 0, 'saved_seconds': 0.0}
+
+    def get_local(self):
+        config = get_config()
+        if config != self.config:
+            self.config = config
+            self.local = LRUCache(config['MAX_ENTRIES'], config['TTL'])
+        return self.local
+
+    def shared(self):
+        alias = self.config['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def generation_key(scope):
+        return f'search_generation:{scope}'
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def current_generations(self, shared):
+        if shared is None:
+            return self.generations[CONTACTS], self.generations[SPAM_NUMBERS]
+
+        keys = [self.generation_key(CONTACTS), self.generation_key(SPAM_NUMBERS)]
+        found = shared.get_many(keys)
+        for key in keys:
+            if key not in found:
+                # An evicted counter restarts from the clock rather than from 0, so it cannot
+                # come back to a value used by older entries
+                shared.add(key, time.time_ns())
+                found[key] = shared.get(key)
+        return tuple(found[key] for key in keys)
+
+    def get_or_compute(self, params, compute):
+        """
+        Return the cached value for the search ``params`` (a tuple of the normalized query and the
+        page parameters), calling ``compute()`` and caching its result on a miss.
+        """
+        self.get_local()
+        if not self.config['ENABLED']:
+            return compute()
+
+        key, value = self.get(params)
+        if value is None:
+            started = time.perf_counter()
+            value = compute()
+            self.set(key, value, time.perf_counter() - started)
+        return value
+
+    async def aget_or_compute(self, params, compute):
+        """
+        :meth:`get_or_compute` for async views: ``compute`` is a coroutine function, and the shared
+        cache, when there is one, is read and written in a worker thread.
+        """
+        self.get_local()
+        if not self.config['ENABLED']:
+            return await compute()
+
+        blocking = self.shared() is not None
+        key, value = await sync_to_async(self.get, thread_sensitive=False)(params) if blocking else self.get(params)
+        if value is None:
+            started = time.perf_counter()
+            value = await compute()
+            cost = time.perf_counter() - started
+            if blocking:
+                await sync_to_async(self.set, thread_sensitive=False)(key, value, cost)
+            else:
+                self.set(key, value, cost)
+        return value
+
+    def get(self, params):
+        """Return the cache key of the search ``params`` and its cached value, ``None`` on a miss."""
+        local = self.get_local()
+        shared = self.shared()
+        key = (*self.current_generations(shared), *params)
+        entry = local.get(key)
+        if entry is None and shared is not None:
+            entry = shared.get(self.shared_key(key))
+            if entry is not None:
+                local.set(key, entry)
+                self.count('shared_hits')
+
+        if entry is None:
+            self.count('misses')
+            return key, None
+
+        value, cost = entry
+        self.count('hits')
+        self.count('saved_seconds', cost)
+        return key, value
+
+    def set(self, key, value, cost):
+        """Cache ``value``, which took ``cost`` seconds to compute, under a key returned by :meth:`get`."""
+        entry = (value, cost)
+        self.get_local().set(key, entry)
+        shared = self.shared()
+        if shared is not None:
+            shared.set(self.shared_key(key), entry, timeout=self.config['SHARED_TTL'])
+
+    @staticmethod
+    def shared_key(key):
+        return 'search:' + hashlib.blake2b(repr(key).encode(), digest_size=20).hexdigest()
+
+    def bump(self, scope):
+        """Bump the generation of ``scope`` now and again once the current transaction commits."""
+        self._bump(scope)
+        transaction.on_commit(lambda: self._bump(scope))
+
+    def _bump(self, scope):
+        self.get_local()
+        with self.lock:
+            self.generations[scope] += 1
+            self.counters['bumps'] += 1
+        shared = self.shared()
+        if shared is not None:
+            try:
+                shared.incr(self.generation_key(scope))
+            except ValueError:
+                shared.add(self.generation_key(scope), time.time_ns())
+
+    def clear(self):
+        with self.lock:
+            for scope in self.generations:
+                self.generations[scope] += 1
+        self.get_local().clear()
+
+    def stats(self):
+        """Return the hit/miss counters, the hit rate, the query time saved and the per-process size."""
+        with self.lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+                'size': len(self.get_local()),
+            }
+
+    def contact_changed(self, sender, **kwargs):
+        self.bump(CONTACTS)
+
+    def spam_number_changed(self, sender, **kwargs):
+        self.bump(SPAM_NUMBERS)
+
+
+search_cache = SearchResultCache()
@@ -3,10 +3,27 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.validators import RegexValidator
 from django.contrib.auth.hashers import make_password
+from rest_framework.validators import UniqueValidator
 from .models import User, SpamNumber, Contact
+from .util import normalize_phone_number, phone_number_validator, PHONE_NUMBER_MAX_LENGTH
+
+
+class PhoneNumberField(serializers.CharField):
+    """Phone number string in its canonical E.164 form, so uniqueness is checked on the stored value."""
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        value = super().to_internal_value(data)
+        return normalize_phone_number(value) or value
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
+    phone_number = PhoneNumberField(
+        max_length=PHONE_NUMBER_MAX_LENGTH,
+        validators=[phone_number_validator, UniqueValidator(queryset=User.objects.all())],
+    )
+
     class Meta:
         model = User
         fields = ['username', 'phone_number', 'password', 'email']
@@ -0,0 +1,117 @@
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .directory import update_spam_likelihoods
+from .models import SpamNumber, SpamReport, SPAM_LIKELIHOOD_PER_MARK
+from .search_cache import search_cache, SPAM_NUMBERS
+from .spam_cache import spam_cache
+from .util import phone_number_key
+
+
+# Maximum number of phone numbers accepted by a bulk spam mark
+MAX_BULK_MARKS = 1000
+
+SPAM_NUMBER_COLUMNS = ['id', 'phone_number', 'phone_key', 'marked_by_id', 'marked_count', 'spam_likelihood']
+
+
+def _insert_reports(connection, numbers, user):
+    """
+    Insert the user's reports for ``numbers`` (a phone key -> phone number dict), returning the
+    keys they had not reported before.
+    """
+    qn = connection.ops.quote_name
+    now = timezone.now()
+    sql = f"""
+        INSERT INTO {qn(SpamReport._meta.db_table)} ({qn('reporter_id')}, {qn('phone_number')}, {qn('phone_key')}, {qn('created_at')})
+        VALUES {', '.join(['(%s, %s, %s, %s)'] * len(numbers))}
+        ON CONFLICT ({qn('reporter_id')}, {qn('phone_key')}) DO NOTHING
+        RETURNING {qn('phone_key')}
+    """
+    params = [value for key, phone_number in numbers.items() for value in (user.pk, phone_number, key, now)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {key for key, in cursor.fetchall()}
+
+
+def _increment_spam_numbers(connection, numbers, user):
+    """
+    Insert the SpamNumbers of ``numbers`` (a phone key -> phone number dict) or increment their
+    count and likelihood, returning the updated rows.
+    """
+    qn = connection.ops.quote_name
+    table = qn(SpamNumber._meta.db_table)
+    least = 'LEAST' if connection.vendor == 'postgresql' else 'MIN'
+    now = timezone.now()
+    sql = f"""
+        INSERT INTO {table} ({qn('phone_number')}, {qn('phone_key')}, {qn('marked_by_id')}, {qn('marked_count')}, {qn('spam_likelihood')}, {qn('updated_at')})
+        VALUES {', '.join(['(%s, %s, %s, 1, %s, %s)'] * len(numbers))}
+        ON CONFLICT ({qn('phone_key')}) DO UPDATE SET
+            {qn('marked_count')} = {table}.{qn('marked_count')} + 1,
+            {qn('spam_likelihood')} = {least}(1.0, ({table}.{qn('marked_count')} + 1) * %s),
+            {qn('updated_at')} = %s
+        RETURNING {', '.join(qn(column) for column in SPAM_NUMBER_COLUMNS)}
+    """
+    params = [
+        value for key, phone_number in numbers.items()
+        for value in (phone_number, key, user.pk, SPAM_LIKELIHOOD_PER_MARK, now)
+    ]
+    params += [SPAM_LIKELIHOOD_PER_MARK, now]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def mark_spam_numbers(phone_numbers, user):
+    """
+    Record ``user``'s spam marks for ``phone_numbers`` in a constant number of SQL statements.
+
+    Marks are stored as SpamReports unique per (reporter, phone number). Only new reports bump the
+    SpamNumber counters, in a single ``INSERT ... ON CONFLICT DO UPDATE`` that increments
+    ``marked_count`` and recomputes ``spam_likelihood`` in the database, so concurrent marks never
+    lose increments. Numbers the user already reported are only read back. Numbers are matched on
+    their canonical ``phone_key``, so "+1234567890" and "1234567890" are the same number, stored in
+    its canonical form. Raises ``ValueError`` for values that are not phone numbers (key 0), which
+    would otherwise all be counted on one SpamNumber.
+
+    Returns a dict mapping each phone number to ``(spam_number, created, counted)``.
+    """
+    keys = {phone_number: phone_number_key(phone_number) for phone_number in phone_numbers}
+    invalid = [phone_number for phone_number, key in keys.items() if not key]
+    if invalid:
+        raise ValueError(f"Not phone numbers: {invalid!r}")
+    # Different spellings of a number share its canonical key. Keys are sorted so concurrent
+    # batches lock the same rows in the same order.
+    numbers = {key: f'+{key}' for key in sorted(set(keys.values()))}
+    if not numbers:
+        return {}
+
+    using = router.db_for_write(SpamNumber)
+    connection = connections[using]
+    marks = {}
+
+    with transaction.atomic(using=using):
+        counted = _insert_reports(connection, numbers, user)
+
+        already_reported = [key for key in numbers if key not in counted]
+        if already_reported:
+            for spam_number in SpamNumber.objects.using(using).filter(phone_key__in=already_reported):
+                marks[spam_number.phone_key] = (spam_number, False, False)
+
+        # New reports, plus reports left without their SpamNumber, count as a mark
+        to_increment = {key: phone_number for key, phone_number in numbers.items() if key not in marks}
+        if to_increment:
+            spam_cache.invalidate(to_increment)
+            search_cache.bump(SPAM_NUMBERS)
+            for row in _increment_spam_numbers(connection, to_increment, user):
+                spam_number = SpamNumber.from_db(using, SPAM_NUMBER_COLUMNS, row)
+                marks[spam_number.phone_key] = (
+                    spam_number, spam_number.marked_count == 1, spam_number.phone_key in counted
+                )
+            update_spam_likelihoods(marks[key][0] for key in to_increment)
+
+    return {phone_number: marks[key] for phone_number, key in keys.items()}
+
+
+def mark_spam(phone_number, user):
+    """Record ``user``'s spam mark for one phone number, see :func:`mark_spam_numbers`."""
+    return mark_spam_numbers([phone_number], user)[phone_number]
@@ -0,0 +1,242 @@
+"""
+Cache of spam likelihoods by phone key.
+
+The first tier is a bounded LRU with TTL in each process, optionally backed by a second tier in
+one of Django's caches shared by all workers. Numbers without a SpamNumber are cached too
+("negative caching"), since most looked up numbers are not spam. Entries are invalidated whenever
+a SpamNumber changes: by spam marks (on the spot and again once their transaction commits) and by
+SpamNumber save/delete signals. With a shared tier, invalidations also bump a generation counter
+in it, which every read checks, so the per-process tiers of the other workers stop serving their
+entries at once; without one, other workers see a change once their entries expire. Configured by
+the ``SPAM_LIKELIHOOD_CACHE`` setting:
+
+- ``ENABLED``: turn caching on (default ``True``).
+- ``MAX_ENTRIES`` / ``TTL``: size and lifetime in seconds of the per-process tier.
+- ``SHARED_CACHE`` / ``SHARED_TTL``: alias in ``CACHES`` of the shared tier (default ``None``,
+  disabled) and lifetime of its entries.
+- ``SNAPSHOT_PATH``: spam snapshot written by ``manage.py build_spam_snapshot``, used instead of
+  the database to resolve cache misses (see :mod:`contacts.spam_snapshot`).
+- ``SNAPSHOT_CHECK_INTERVAL`` / ``DELTA_INTERVAL``: seconds between checks for a rebuilt snapshot
+  and between reads of the marks made since it was built.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import SpamNumber, DEFAULT_SPAM_LIKELIHOOD
+from .spam_snapshot import spam_snapshot
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 100_000,
+    'TTL': 60,
+    'SHARED_CACHE': None,
+    'SHARED_TTL': 300,
+    'SNAPSHOT_PATH': None,
+    'SNAPSHOT_CHECK_INTERVAL': 30,
+    'DELTA_INTERVAL': 5,
+}
+
+# Cached in place of a likelihood for numbers without a SpamNumber
+NOT_SPAM = -1.0
+
+# Key in the shared tier of the generation per-process entries are cached under
+GENERATION_KEY = 'spam_likelihood_generation'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SPAM_LIKELIHOOD_CACHE', {})}
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with a per-entry time to live."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SpamLikelihoodCache:
+    def __init__(self):
+        self.local = None
+        self.config = None
+        # Bumped by every invalidation, so values read from the database while a mark was being
+        # invalidated are not cached
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get_local(self):
+        config = get_config()
+        if config != self.config:
+            self.config = config
+            self.local = LRUCache(config['MAX_ENTRIES'], config['TTL'])
+        return self.local
+
+    def shared(self):
+        alias = self.config['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def shared_key(phone_key):
+        return f'spam_likelihood:{phone_key}'
+
+    @staticmethod
+    def current_generation(shared):
+        if shared is None:
+            return None
+        generation = shared.get(GENERATION_KEY)
+        if generation is None:
+            # An evicted counter restarts from the clock rather than from 0, so it cannot come
+            # back to a value older entries were cached under
+            shared.add(GENERATION_KEY, time.time_ns())
+            generation = shared.get(GENERATION_KEY)
+        return generation
+
+    def count(self, counter, amount=1):
+        if amount:
+            with self.lock:
+                self.counters[counter] += amount
+
+    def get_many(self, phone_keys):
+        """Return a dict mapping each phone key to its spam likelihood, reading misses in one query."""
+        phone_keys = set(phone_keys)
+        if not get_config()['ENABLED']:
+            self.get_local()
+            return self.load(phone_keys)
+
+        local = self.get_local()
+        shared = self.shared()
+        # Per-process entries are keyed by the shared generation, bumped by every invalidation
+        generation = self.current_generation(shared)
+        results = {}
+        missing = []
+        for phone_key in phone_keys:
+            value = local.get((generation, phone_key))
+            if value is None:
+                missing.append(phone_key)
+            else:
+                results[phone_key] = value
+        self.count('hits', len(results))
+
+        if missing and shared is not None:
+            found = shared.get_many([self.shared_key(phone_key) for phone_key in missing])
+            still_missing = []
+            for phone_key in missing:
+                value = found.get(self.shared_key(phone_key))
+                if value is None:
+                    still_missing.append(phone_key)
+                else:
+                    results[phone_key] = value
+                    local.set((generation, phone_key), value)
+            self.count('shared_hits', len(missing) - len(still_missing))
+            missing = still_missing
+
+        if missing:
+            self.count('misses', len(missing))
+            epoch = self.epoch
+            loaded = self.load(missing, raw=True)
+            if epoch == self.epoch:
+                for phone_key, value in loaded.items():
+                    local.set((generation, phone_key), value)
+                if shared is not None:
+                    shared.set_many(
+                        {self.shared_key(phone_key): value for phone_key, value in loaded.items()},
+                        timeout=self.config['SHARED_TTL'],
+                    )
+            results.update(loaded)
+
+        return {
+            phone_key: DEFAULT_SPAM_LIKELIHOOD if value == NOT_SPAM else value
+            for phone_key, value in results.items()
+        }
+
+    def get(self, phone_key):
+        return self.get_many([phone_key])[phone_key]
+
+    def load(self, phone_keys, raw=False):
+        snapshot = spam_snapshot.get(self.config['SNAPSHOT_PATH'], self.config['SNAPSHOT_CHECK_INTERVAL'])
+        if snapshot is not None:
+            likelihoods = spam_snapshot.likelihoods(snapshot, phone_keys, self.config['DELTA_INTERVAL'])
+        else:
+            likelihoods = dict(
+                SpamNumber.objects.filter(phone_key__in=phone_keys).values_list('phone_key', 'spam_likelihood')
+            )
+        missing = NOT_SPAM if raw else DEFAULT_SPAM_LIKELIHOOD
+        return {phone_key: likelihoods.get(phone_key, missing) for phone_key in phone_keys}
+
+    def invalidate(self, phone_keys):
+        """Drop cached likelihoods of ``phone_keys`` now and again once the current transaction commits."""
+        phone_keys = list(phone_keys)
+        self._invalidate(phone_keys)
+        transaction.on_commit(lambda: self._invalidate(phone_keys))
+
+    def _invalidate(self, phone_keys):
+        with self.lock:
+            self.epoch += 1
+            self.counters['invalidations'] += 1
+        local = self.get_local()
+        for phone_key in phone_keys:
+            local.delete((None, phone_key))
+        if self.config['SNAPSHOT_PATH']:
+            spam_snapshot.invalidate(phone_keys)
+        shared = self.shared()
+        if shared is not None:
+            shared.delete_many([self.shared_key(phone_key) for phone_key in phone_keys])
+            try:
+                shared.incr(GENERATION_KEY)
+            except ValueError:
+                shared.add(GENERATION_KEY, time.time_ns())
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+        self.get_local().clear()
+
+    def stats(self):
+        """Return the hit/miss counters and the size of the per-process tier."""
+        with self.lock:
+            return {**self.counters, 'size': len(self.get_local())}
+
+    def spam_number_changed(self, sender, instance, **kwargs):
+        self.invalidate([instance.phone_key])
+
+
+spam_cache = SpamLikelihoodCache()
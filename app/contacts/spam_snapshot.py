@@ -0,0 +1,268 @@
+"""
+Memory-mapped snapshot of spam likelihoods shared by all workers.
+
+``manage.py build_spam_snapshot`` writes every SpamNumber to one binary file: a Bloom filter of
+the phone keys followed by the sorted keys and their likelihoods. Workers ``mmap`` the file
+read-only, so the operating system shares its pages between them, and look numbers up by checking
+the Bloom filter and then binary searching the keys. Most looked up numbers are not spam and are
+answered by the filter alone.
+
+Changes newer than the snapshot are covered by a delta: the SpamNumbers updated since the
+snapshot was built (marks, recomputed likelihoods), read through their indexed ``updated_at`` in
+one query at most every ``DELTA_INTERVAL`` seconds. Numbers invalidated in this process (e.g. by
+its own marks) are read from the database until the delta covers them; at most
+``MAX_DIRTY_KEYS`` are tracked, past that the worker reads every likelihood from the database
+until the next snapshot. SpamNumbers deleted through other workers leave no row for the delta and
+are served from the snapshot until it is rebuilt. A rebuilt snapshot atomically replaces the file
+and workers swap it in on their next check.
+
+File layout (little endian)::
+
+    header      magic, version, Bloom hash count, key count, Bloom filter size, build timestamp
+    bloom       Bloom filter bits, padded to 8 bytes
+    keys        sorted phone keys, int64 each
+    likelihoods spam likelihoods in 1/10000 units, uint16 each
+"""
+import bisect
+import datetime
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+from .models import SpamNumber
+
+
+MAGIC = b'SPAMSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQd')
+
+# Likelihoods are stored as integers in units of 1/LIKELIHOOD_SCALE
+LIKELIHOOD_SCALE = 10_000
+
+# Target false positive rate of the Bloom filter
+BLOOM_ERROR_RATE = 0.01
+
+# Spam numbers updated up to this many seconds before the snapshot was built are re-read by the
+# delta, covering marks whose transaction committed while the snapshot was being built
+DELTA_OVERLAP = 60
+
+# Phone keys invalidated in this process and not yet covered by the delta tracked at most
+MAX_DIRTY_KEYS = 10_000
+
+BUILD_CHUNK_SIZE = 20_000
+
+
+def bloom_size(count, error_rate=BLOOM_ERROR_RATE):
+    """Return the ``(bytes, hash count)`` of a Bloom filter holding ``count`` keys."""
+    bits = max(64, math.ceil(-count * math.log(error_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / max(count, 1) * math.log(2)))
+    return (bits + 63) // 64 * 8, hashes
+
+
+def bloom_positions(phone_key, hashes, bits):
+    digest = hashlib.blake2b(phone_key.to_bytes(8, 'little', signed=True), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+def write_snapshot(path, rows, built_at):
+    """
+    Write ``(phone_key, spam_likelihood)`` rows sorted by phone key to ``path``, atomically
+    replacing any previous snapshot.
+    """
+    keys = array('q')
+    likelihoods = array('H')
+    for phone_key, likelihood in rows:
+        keys.append(phone_key)
+        likelihoods.append(round(min(max(likelihood, 0.0), 1.0) * LIKELIHOOD_SCALE))
+
+    bloom_bytes, hashes = bloom_size(len(keys))
+    bloom = bytearray(bloom_bytes)
+    for phone_key in keys:
+        for position in bloom_positions(phone_key, hashes, bloom_bytes * 8):
+            bloom[position >> 3] |= 1 << (position & 7)
+
+    if keys.itemsize != 8 or likelihoods.itemsize != 2:
+        raise RuntimeError("Unsupported platform array sizes.")
+    if struct.pack('=H', 1) != struct.pack('<H', 1):
+        keys.byteswap()
+        likelihoods.byteswap()
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as snapshot:
+        snapshot.write(HEADER.pack(MAGIC, VERSION, hashes, len(keys), bloom_bytes, built_at))
+        snapshot.write(bytes(-HEADER.size % 8))
+        snapshot.write(bloom)
+        snapshot.write(keys.tobytes())
+        snapshot.write(likelihoods.tobytes())
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(tmp_path, path)
+    return len(keys)
+
+
+def build_snapshot(path):
+    """Export every SpamNumber to a snapshot at ``path``, returning the number of rows written."""
+    # Taken before reading, so marks made during the export are picked up by the delta
+    built_at = time.time()
+    rows = SpamNumber.objects.order_by('phone_key').values_list('phone_key', 'spam_likelihood')
+    return write_snapshot(path, rows.iterator(chunk_size=BUILD_CHUNK_SIZE), built_at)
+
+
+class SpamSnapshot:
+    """Read-only view of a snapshot file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot:
+            stat = os.fstat(snapshot.fileno())
+            self.map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"{path} is not a spam snapshot.")
+        magic, version, self.hashes, self.count, bloom_bytes, self.built_at = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} spam snapshot.")
+
+        view = memoryview(self.map)
+        bloom_start = HEADER.size + (-HEADER.size % 8)
+        keys_start = bloom_start + bloom_bytes
+        likelihoods_start = keys_start + self.count * 8
+        if len(self.map) != likelihoods_start + self.count * 2:
+            raise ValueError(f"{path} is truncated.")
+
+        self.bloom = view[bloom_start:keys_start]
+        self.bloom_bits = bloom_bytes * 8
+        self.keys = view[keys_start:likelihoods_start].cast('q')
+        self.likelihoods = view[likelihoods_start:].cast('H')
+
+    def __len__(self):
+        return self.count
+
+    def might_contain(self, phone_key):
+        bloom = self.bloom
+        return all(
+            bloom[position >> 3] & (1 << (position & 7))
+            for position in bloom_positions(phone_key, self.hashes, self.bloom_bits)
+        )
+
+    def get(self, phone_key):
+        """Return the spam likelihood of ``phone_key``, or ``None`` when it is not a spam number."""
+        if not self.might_contain(phone_key):
+            return None
+        i = bisect.bisect_left(self.keys, phone_key)
+        if i < self.count and self.keys[i] == phone_key:
+            return self.likelihoods[i] / LIKELIHOOD_SCALE
+        return None
+
+
+class SpamSnapshotRegistry:
+    """Holds the worker's snapshot, swapping in rebuilt files and tracking the delta since it was built."""
+
+    def __init__(self):
+        self.snapshot = None
+        self.path = None
+        self.checked_at = 0.0
+        self.delta = {}
+        self.delta_loaded_at = None
+        # Phone keys invalidated in this process, with the time of their invalidation
+        self.dirty = {}
+        # Set when more than MAX_DIRTY_KEYS are dirty: the snapshot is bypassed until the next one
+        self.overflowed = False
+        self.lock = threading.Lock()
+
+    def get(self, path, check_interval):
+        """Return the snapshot at ``path``, or ``None`` when there is none."""
+        if not path:
+            return None
+
+        now = time.monotonic()
+        if path != self.path or now - self.checked_at > check_interval:
+            with self.lock:
+                self.checked_at = now
+                try:
+                    file_id = os.stat(path)
+                    file_id = (file_id.st_ino, file_id.st_mtime_ns)
+                except FileNotFoundError:
+                    file_id = None
+                if path != self.path or (self.snapshot and self.snapshot.file_id) != file_id:
+                    self.swap(path, SpamSnapshot(path) if file_id else None)
+        return self.snapshot
+
+    def swap(self, path, snapshot):
+        self.path = path
+        self.snapshot = snapshot
+        self.delta = {}
+        self.delta_loaded_at = None
+        if snapshot is not None:
+            since = snapshot.built_at - DELTA_OVERLAP
+            self.dirty = {phone_key: at for phone_key, at in self.dirty.items() if at >= since}
+            self.overflowed = False
+
+    def get_delta(self, snapshot, delta_interval):
+        """Return the likelihoods of numbers updated since the snapshot was built."""
+        now = time.monotonic()
+        if self.delta_loaded_at is None or now - self.delta_loaded_at > delta_interval:
+            # Invalidations older than the read are covered by it: their transaction committed
+            read_at = time.time()
+            since = datetime.datetime.fromtimestamp(snapshot.built_at - DELTA_OVERLAP, tz=datetime.timezone.utc)
+            self.delta = dict(
+                SpamNumber.objects.filter(updated_at__gte=since).values_list('phone_key', 'spam_likelihood')
+            )
+            self.delta_loaded_at = now
+            # Keys missing from the delta were deleted since the snapshot, they stay dirty
+            self.dirty = {
+                phone_key: at for phone_key, at in self.dirty.items()
+                if at >= read_at or phone_key not in self.delta
+            }
+        return self.delta
+
+    def likelihoods(self, snapshot, phone_keys, delta_interval):
+        """Return a dict of the spam likelihoods of the spam numbers among ``phone_keys``."""
+        if self.overflowed:
+            return dict(
+                SpamNumber.objects.filter(phone_key__in=phone_keys).values_list('phone_key', 'spam_likelihood')
+            )
+
+        dirty = [phone_key for phone_key in phone_keys if phone_key in self.dirty]
+        fresh = dict(
+            SpamNumber.objects.filter(phone_key__in=dirty).values_list('phone_key', 'spam_likelihood')
+        ) if dirty else {}
+        delta = self.get_delta(snapshot, delta_interval)
+
+        likelihoods = {}
+        for phone_key in phone_keys:
+            if phone_key in self.dirty:
+                likelihood = fresh.get(phone_key)
+            elif phone_key in delta:
+                likelihood = delta[phone_key]
+            else:
+                likelihood = snapshot.get(phone_key)
+            if likelihood is not None:
+                likelihoods[phone_key] = likelihood
+        return likelihoods
+
+    def invalidate(self, phone_keys):
+        now = time.time()
+        for phone_key in phone_keys:
+            self.dirty[phone_key] = now
+        if len(self.dirty) > MAX_DIRTY_KEYS:
+            self.overflowed = True
+            self.dirty = {}
+
+    def reset(self):
+        with self.lock:
+            self.snapshot = self.path = None
+            self.delta = {}
+            self.delta_loaded_at = None
+            self.dirty = {}
+            self.overflowed = False
+
+
+spam_snapshot = SpamSnapshotRegistry()
@@ -0,0 +1,91 @@
+"""
+Streamed NDJSON responses.
+
+Large result sets are written as newline-delimited JSON while they are read, one line per row, so
+memory use per request does not depend on the number of rows. Views opt in by listing
+:class:`NDJSONRenderer`: clients ask for ``Accept: application/x-ndjson`` or ``?format=ndjson``
+and the view answers with :func:`ndjson_response`. Async views stream with :func:`aiter_chunks`.
+"""
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+from .models import Contact
+from .renderers import json_dumps
+
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# Rows per server-side cursor fetch, and per chunk written to the client
+EXPORT_CHUNK_SIZE = 2000
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` consecutive items of ``iterable``."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def ndjson_lines(rows):
+    return b''.join(json_dumps(row) + b'\n' for row in rows)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Negotiates NDJSON for the views that stream it. Responses that are not streamed (e.g. errors)
+    are rendered as one line, or one line per item of a list.
+    """
+    media_type = NDJSON_CONTENT_TYPE
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return ndjson_lines(data if isinstance(data, list) else [data])
+
+
+def wants_ndjson(request):
+    return getattr(request, 'accepted_renderer', None) is not None and request.accepted_renderer.format == 'ndjson'
+
+
+async def aiter_chunks(chunks):
+    """
+    Iterate ``chunks``, a synchronous iterable reading the database, from an async view.
+
+    Each chunk is read in the thread of the request's synchronous code, so a server-side cursor
+    stays on the connection it was opened with, like the async iteration of a QuerySet.
+    """
+    iterator = await sync_to_async(iter)(chunks)
+    while (chunk := await sync_to_async(next)(iterator, None)) is not None:
+        yield chunk
+
+
+def ndjson_response(chunks, filename=None):
+    """
+    Stream ``chunks``, an iterable or async iterable of lists of rows, as NDJSON, one write per
+    chunk. Async iterables are needed under ASGI, where synchronous iterables are read in full
+    before the response is sent.
+    """
+    if hasattr(chunks, '__aiter__'):
+        content = (ndjson_lines(chunk) async for chunk in chunks)
+    else:
+        content = (ndjson_lines(chunk) for chunk in chunks)
+    response = StreamingHttpResponse(content, content_type=NDJSON_CONTENT_TYPE)
+    response['X-Accel-Buffering'] = 'no'
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def export_contacts(user, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield ``user``'s contacts as lists of at most ``chunk_size`` ``{'name', 'phone_number'}`` rows,
+    the format accepted by the contact import. Contacts are read through a server-side cursor in
+    the order of the ``(user, phone_key)`` index, so nothing is sorted.
+    """
+    rows = Contact.objects.filter(user=user).order_by('phone_key').values('name', 'phone_number')
+    yield from chunked(rows.iterator(chunk_size=chunk_size), chunk_size)
@@ -0,0 +1,181 @@
+"""
+Query plan regression tests: every SELECT run by the endpoints on a seeded dataset must be served
+by an index. On PostgreSQL sequential scans are disabled for the check, so a ``Seq Scan`` in a
+plan means no index can serve the query at all.
+
+Name queries shorter than a trigram are left out: substrings that short cannot use the trigram
+indexes and scan the contact names by design.
+"""
+import os
+import re
+import tempfile
+import time
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .directory import build_entries, rebuild_directory
+from .models import User, SpamNumber, SpamReport, Contact
+from .search import record_name_words
+from .search_cache import search_cache
+from .spam_cache import spam_cache
+from .spam_snapshot import SpamSnapshotRegistry, SpamSnapshot, write_snapshot
+
+
+USERS = 50
+CONTACTS_PER_USER = 60
+SPAM_NUMBERS = 300
+
+# SQLite reports a full table scan as "SCAN <table>" without an index, virtual tables (the FTS5
+# name index) are searched through their own index. Scans of subquery results and CTEs are only
+# as large as their (indexed, bounded) subqueries, so only real tables count.
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)(?!.*\b(?:USING|VIRTUAL TABLE)\b)')
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = [User(username=f"user{i}", phone_number=f"55500{i:05d}", email=f"user{i}@example.com") for i in range(USERS)]
+        for user in users:
+            user.set_derived_fields()
+        User.objects.bulk_create(users)
+        users = list(User.objects.order_by('id'))
+
+        contacts = []
+        for i, user in enumerate(users):
+            for j in range(CONTACTS_PER_USER):
+                contacts.append(Contact(user=user, name=f"Name {i} {j}", phone_number=f"44{(i * 7 + j * 13) % 2000:08d}"))
+            # Everybody saves their neighbour, so some emails are visible
+            contacts.append(Contact(user=user, name=f"Friend {i}", phone_number=users[(i + 1) % USERS].phone_number))
+        for contact in contacts:
+            contact.set_derived_fields()
+        Contact.objects.bulk_create(contacts)
+        record_name_words(contacts)
+
+        spam_numbers = [
+            SpamNumber(phone_number=f"44{i * 5:08d}", marked_by=users[i % USERS], marked_count=i % 10 + 1)
+            for i in range(SPAM_NUMBERS)
+        ]
+        for spam_number in spam_numbers:
+            spam_number.set_derived_fields()
+        SpamNumber.objects.bulk_create(spam_numbers)
+        reports = [SpamReport(reporter=users[i % USERS], phone_number=f"44{i * 5:08d}") for i in range(SPAM_NUMBERS)]
+        for report in reports:
+            report.set_derived_fields()
+        SpamReport.objects.bulk_create(reports)
+
+        list(rebuild_directory())
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        cls.user = users[0]
+
+    def setUp(self):
+        spam_cache.clear()
+        search_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+            self.addCleanup(self.reset_seqscan)
+
+    def reset_seqscan(self):
+        with connection.cursor() as cursor:
+            cursor.execute('RESET enable_seqscan')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return '\n'.join(row[-1] for row in cursor.fetchall())
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def assertIndexed(self, sql):
+        plan = self.explain(sql)
+        if connection.vendor == 'sqlite':
+            tables = set(connection.introspection.table_names())
+            full_scans = [
+                line for line in plan.splitlines()
+                if (match := SQLITE_FULL_SCAN.search(line)) and match.group(1) in tables
+            ]
+        else:
+            full_scans = [line for line in plan.splitlines() if 'Seq Scan' in line]
+        self.assertFalse(full_scans, f"Sequential scan in the plan of:\n{sql}\n\n{plan}")
+
+    def assertQueriesIndexed(self, queries):
+        selects = [query['sql'] for query in queries if query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertIndexed(sql)
+
+    def test_search_by_name(self):
+        """Test that name searches, first and later pages, use the name indexes."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/search/', {'query': 'Name 1', 'limit': 10})
+            self.client.get('/api/search/', {'query': 'Name 1', 'limit': 10, 'cursor': response['X-Next-Cursor']})
+            self.client.get('/api/search/', {'query': 'friend'})
+            self.client.get('/api/search/', {'query': 'Frend', 'fuzzy': 'true'})
+        self.assertQueriesIndexed(queries)
+
+    def test_search_pages_read_names_in_index_order(self):
+        """Test that name pages, however short the query, and fuzzy pages read the name indexes in order instead of sorting the matches."""
+        with CaptureQueriesContext(connection) as queries:
+            for query in ['n', 'e']:
+                response = self.client.get('/api/search/', {'query': query, 'limit': 10})
+                self.client.get('/api/search/', {'query': query, 'limit': 10, 'cursor': response['X-Next-Cursor']})
+        pages = [query['sql'] for query in queries if 'ORDER BY' in query['sql'] and '"name_key"' in query['sql']]
+        self.assertTrue(pages)
+        # Fuzzy candidates are ranges of the name word indexes
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/search/', {'query': 'Frend', 'fuzzy': 'true', 'limit': 3})
+        fuzzy_pages = [query['sql'] for query in queries if 'fuzzy_stream' in query['sql']]
+        self.assertTrue(fuzzy_pages)
+        pages += fuzzy_pages
+        for sql in pages:
+            plan = self.explain(sql)
+            if connection.vendor == 'sqlite':
+                sorts = [line for line in plan.splitlines() if 'TEMP B-TREE FOR ORDER BY' in line]
+            else:
+                # Any sort node, an incremental sort included, but not the sort keys of a Merge Append
+                sorts = [line for line in plan.splitlines() if re.match(r'\s*(->\s+)?(\w+\s+)?Sort\s+\(', line)]
+            self.assertFalse(sorts, f"Sort in the plan of:\n{sql}\n\n{plan}")
+
+    def test_search_by_phone_number(self):
+        """Test that phone number searches use the phone indexes and the directory key."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/search/', {'query': '4400000013'})
+            self.client.get('/api/search/', {'query': self.user.phone_number})
+        self.assertTrue(response.data)
+        self.assertQueriesIndexed(queries)
+
+    def test_autocomplete(self):
+        """Test that name and number completions seek through the prefix indexes."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/autocomplete/', {'prefix': 'name 1'})
+            self.client.get('/api/autocomplete/', {'prefix': '44000'})
+        self.assertQueriesIndexed(queries)
+
+    def test_lookup_and_spam_marks(self):
+        """Test that caller-ID lookups and spam marks read spam numbers and reports by index."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/lookup/', {'phone_numbers': ['4400000005', '5550000001', '4400000001']}, format='json')
+            self.client.post('/api/mark_spam/bulk/', {'phone_numbers': ['4400000005', '4400000001']}, format='json')
+            self.client.post('/api/mark_spam/bulk/', {'phone_numbers': ['4400000005']}, format='json')
+        self.assertQueriesIndexed(queries)
+
+    def test_maintenance_queries(self):
+        """Test that per-user contact listings, directory refreshes and the spam delta use indexes."""
+        with CaptureQueriesContext(connection) as queries:
+            list(Contact.objects.filter(user=self.user).order_by('phone_key'))
+            build_entries({4400000005, 5550000001, 4400000001})
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'spam.snapshot')
+                write_snapshot(path, [], built_at=time.time())
+                SpamSnapshotRegistry().get_delta(SpamSnapshot(path), delta_interval=0)
+        self.assertQueriesIndexed(queries)
@@ -1,8 +1,48 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import User, SpamNumber, Contact
+from .models import User, SpamNumber, SpamReport, Contact, NameWord, PhoneDirectory
 from rest_framework_simplejwt.tokens import RefreshToken
+from .name_index import NameIndex, name_index
+from .spam import mark_spam
+from . import renderers
+from .renderers import ORJSONParser, ORJSONRenderer, pack_msgpack
+from .log import JSONFormatter, QueueFileHandler
+from .metrics import LATENCY_BUCKETS, metrics
+from .search_cache import search_cache
+from .spam_cache import LRUCache, SpamLikelihoodCache, spam_cache
+from .spam_snapshot import SpamSnapshot, spam_snapshot, write_snapshot
+from .importers import iter_json_array, ImportFormatError
+from .lookup import MAX_LOOKUP_NUMBERS
+from . import search
+from .concurrency import database_task
+from .instrumentation import RequestInstrumentationMiddleware
+from .search import iter_search_results, record_name_words, search_contacts, FUZZY_RANK, MAX_PAGE_SIZE
+from .views import AsyncLookupNumbersView, AsyncSearchPersonView
+from .directory import rebuild_directory
+from .util import normalize_phone_number, phone_number_key, soundex, edit_distance, word_soundex
 
 
 class UserRegistrationTests(TestCase):
@@ -62,6 +102,20 @@ class UserRegistrationTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('username', response.data)  # Assuming unique username validation
 
+    def test_register_user_duplicate_phone_number_in_another_format(self):
+        """Test that a phone number already registered in another format is rejected."""
+        User.objects.create_user(username="user", password="password@123", phone_number="9876543210")
+
+        response = self.client.post('/api/register/', {
+            "username": "other",
+            "phone_number": "+9876543210",
+            "password": "password@123",
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('phone_number', response.data)
+        self.assertEqual(User.objects.get(username="user").phone_number, "+9876543210")
+
     def test_register_user_invalid_email(self):
         """Test registration with invalid email format."""
         url = '/api/register/'
@@ -151,6 +205,7 @@ class UserProfileTests(TestCase):
 
 class MarkSpamViewTest(TestCase):
     def setUp(self):
+        spam_cache.clear()
         self.client = APIClient()
 
         # Creating a test user
@@ -179,8 +234,8 @@ class MarkSpamViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
         # Check that the phone number has been marked as spam in the database
-        spam_entry = SpamNumber.objects.get(phone_number="1234567890")
-        self.assertEqual(spam_entry.phone_number, "1234567890")
+        spam_entry = SpamNumber.objects.get(phone_number="+1234567890")
+        self.assertEqual(spam_entry.phone_number, "+1234567890")
         self.assertEqual(spam_entry.marked_by, self.user)
         self.assertEqual(spam_entry.marked_count, 1)
         self.assertEqual(spam_entry.spam_likelihood, 0.1)  # Assuming initial likelihood is 0.1
@@ -216,9 +271,21 @@ class MarkSpamViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Ensure the marked_count is incremented
-        spam_entry = SpamNumber.objects.get(phone_number=phone_number)
+        spam_entry = SpamNumber.objects.get(phone_key=1234567890)
         self.assertEqual(spam_entry.marked_count, 2)
 
+    def test_mark_spam_twice_by_same_user(self):
+        """Test that marking the same number twice only counts the first mark."""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        data = {"phone_number": "1234567890"}
+
+        self.client.post("/api/mark_spam/", data, format="json")
+        response = self.client.post("/api/mark_spam/", data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['marked_count'], 1)
+        self.assertEqual(SpamNumber.objects.get(phone_number="+1234567890").marked_count, 1)
+
     def test_mark_spam_invalid_phone_number(self):
         """Test marking an invalid phone number."""
         # Set authentication header with the token
@@ -232,9 +299,125 @@ class MarkSpamViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('phone_number', response.data)
 
+    def test_mark_spam_rejects_numbers_that_are_not_strings(self):
+        """Test that JSON numbers are rejected like by the bulk endpoint, not stored under phone key 0."""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+
+        for phone_number in [9876543210, 1234567890]:
+            response = self.client.post("/api/mark_spam/", {"phone_number": phone_number}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(SpamNumber.objects.exists())
+        with self.assertRaises(ValueError):
+            mark_spam(9876543210, self.user)
+
+
+class BulkMarkSpamViewTest(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="user",
+            phone_number="1234567891",
+            password="password@123",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.url = '/api/mark_spam/bulk/'
+
+    def test_bulk_mark_spam(self):
+        """Test that a batch is marked in a constant number of queries with per-item results."""
+        SpamNumber.objects.create(phone_number="5551234567", marked_by=self.user, marked_count=3)
+        SpamReport.objects.create(reporter=self.user, phone_number="5551234567")
+        other_user = User.objects.create(username="other", phone_number="1234567892")
+        SpamNumber.objects.create(phone_number="9876543210", marked_by=other_user, marked_count=1)
+        phone_numbers = ["1234567890", "invalid_number", "9876543210", "5551234567", 42, "1234567890"]
+        phone_numbers += [f"44400000{i:02d}" for i in range(50)]
+
+        # Authentication (1) + savepoint (2) + reports (1) + already reported (1) + counters (1)
+        # + phone directory (1)
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url, {"phone_numbers": phone_numbers}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), len(phone_numbers))
+        self.assertEqual(
+            [result['status'] for result in results[:6]],
+            ["created", "invalid", "marked", "already_marked", "invalid", "created"]
+        )
+        self.assertEqual(results[2]['marked_count'], 2)
+        self.assertEqual(results[3]['marked_count'], 3)
+        self.assertEqual(SpamNumber.objects.get(phone_number="+1234567890").marked_count, 1)
+        self.assertEqual(SpamNumber.objects.filter(phone_number__startswith="+444").count(), 50)
+
+    def test_bulk_mark_spam_rejects_bad_payloads(self):
+        """Test that missing, empty and oversized batches are rejected."""
+        for phone_numbers in [None, [], "1234567890", ["1234567890"] * 1001]:
+            response = self.client.post(self.url, {"phone_numbers": phone_numbers}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MarkSpamConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        spam_cache.clear()
+        self.users = [
+            User.objects.create(username=f"user{i}", phone_number=f"12345678{i:02d}")
+            for i in range(12)
+        ]
+
+    def test_mark_spam_creates_then_increments(self):
+        """Test that the first mark creates the row and marks by new reporters increment it."""
+        spam_number, created, counted = mark_spam("1234567890", self.users[0])
+        self.assertTrue(created and counted)
+        self.assertEqual((spam_number.marked_count, spam_number.spam_likelihood), (1, 0.1))
+
+        spam_number, created, counted = mark_spam("1234567890", self.users[1])
+        self.assertFalse(created)
+        self.assertTrue(counted)
+        self.assertEqual(spam_number.marked_count, 2)
+        self.assertAlmostEqual(spam_number.spam_likelihood, 0.2)
+
+    def test_repeated_marks_by_one_reporter_are_counted_once(self):
+        """Test that a user re-marking a number does not inflate its count."""
+        for _ in range(3):
+            spam_number, created, counted = mark_spam("1234567890", self.users[0])
+
+        self.assertFalse(counted)
+        self.assertEqual(spam_number.marked_count, 1)
+        self.assertEqual(SpamReport.objects.filter(phone_number="+1234567890").count(), 1)
+
+    def test_marks_match_numbers_on_their_canonical_key(self):
+        """Test that different spellings of a number are marked as the same number."""
+        mark_spam("+1234567890", self.users[0])
+        spam_number, created, counted = mark_spam("1234567890", self.users[1])
+        self.assertFalse(created)
+        self.assertEqual(spam_number.marked_count, 2)
+
+        spam_number, created, counted = mark_spam("1234567890", self.users[0])
+        self.assertFalse(counted)
+        self.assertEqual(SpamNumber.objects.get().phone_key, 1234567890)
+
+    def test_parallel_marks_are_counted_exactly(self):
+        """Test that concurrent marks of the same number never lose an increment."""
+        def mark(user):
+            try:
+                return mark_spam("1234567890", user)[1]
+            finally:
+                connection.close()
+
+        # Every user marks twice, only the first mark of each counts
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            created = list(executor.map(mark, self.users * 2))
+
+        spam_number = SpamNumber.objects.get(phone_number="+1234567890")
+        self.assertEqual(spam_number.marked_count, len(self.users))
+        self.assertEqual(spam_number.spam_likelihood, 1.0)
+        self.assertEqual(created.count(True), 1)
+
 
 class SearchPersonViewTest(TestCase):
     def setUp(self):
+        spam_cache.clear()
+        search_cache.clear()
         self.client = APIClient()
 
         # Creating a test user
@@ -292,7 +475,7 @@ class SearchPersonViewTest(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['phone_number'], '9876543210')
+        self.assertEqual(response.data[0]['phone_number'], '+9876543210')
 
     def test_search_by_name_and_phone_number(self):
         """Test searching by both name and phone number."""
@@ -303,9 +486,9 @@ class SearchPersonViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
 
-        self.assertEqual(response.data[0]['phone_number'], '5551234567')
+        self.assertEqual(response.data[0]['phone_number'], '+5551234567')
         self.assertEqual(response.data[0]['name'], '5551234567')
-        self.assertEqual(response.data[1]['phone_number'], '5551234567')
+        self.assertEqual(response.data[1]['phone_number'], '+5551234567')
         self.assertEqual(response.data[1]['name'], 'Jack Black')
 
     #
@@ -330,3 +513,1477 @@ class SearchPersonViewTest(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 0)  # No results should be returned
+
+    def test_search_email_visible_to_contacts_of_registered_user(self):
+        """Test that a registered user's email is shown only if the searcher is in their contacts."""
+        registered_user = User.objects.create_user(
+            username="jill",
+            phone_number="5559876543",
+            password="password@123",
+            email="jill@example.com"
+        )
+        Contact.objects.create(name="Jill Valentine", phone_number="5559876543", user=self.user)
+        url = '/api/search/'
+
+        response = self.client.get(url, {'query': 'Jill'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data[0]['email'])
+
+        # The registered user saves the searcher's number in their contacts
+        Contact.objects.create(name="User", phone_number=self.user.phone_number, user=registered_user)
+
+        response = self.client.get(url, {'query': 'Jill'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['email'], 'jill@example.com')
+
+    def test_email_visibility_checked_for_whole_page(self):
+        """Test that email visibility is resolved for a page of registered users in one query."""
+        owners = [
+            User.objects.create(username=f"owner{i}", phone_number=f"55500000{i:02d}", email=f"owner{i}@example.com")
+            for i in range(5)
+        ]
+        for i, owner in enumerate(owners):
+            Contact.objects.create(name=f"Owner {i}", phone_number=owner.phone_number, user=self.user)
+            if i % 2 == 0:
+                Contact.objects.create(name=f"Searcher {i}", phone_number=self.user.phone_number, user=owner)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/search/', {'query': 'Owner'}, format='json')
+        self.assertEqual(
+            [result['email'] for result in response.data],
+            ["owner0@example.com", None, "owner2@example.com", None, "owner4@example.com"],
+        )
+        visibility_queries = [
+            query for query in queries if 'JOIN "contacts_contact"' in query['sql'] and '"email"' in query['sql']
+        ]
+        self.assertEqual(len(visibility_queries), 1)
+
+        # Visibility follows the searcher's current number
+        user = User.objects.get(pk=self.user.pk)
+        user.phone_number = "5550009999"
+        user.save()
+        response = self.client.get('/api/search/', {'query': 'Owner'}, format='json')
+        self.assertEqual([result['email'] for result in response.data], [None] * 5)
+
+        Contact.objects.create(name="New number", phone_number="+5550009999", user=owners[1])
+        response = self.client.get('/api/search/', {'query': 'Owner 1'}, format='json')
+        self.assertEqual(response.data[0]['email'], "owner1@example.com")
+
+    def test_search_query_count_is_constant(self):
+        """Test that the number of queries does not grow with the number of matches."""
+        url = '/api/search/'
+
+        # Authentication (1) + search results, one per rank (2) + visible emails (1)
+        # + spam likelihoods missing from the cache (1)
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {'query': 'John'}, format='json')
+        self.assertEqual(len(response.data), 2)
+
+        # Another page size is another result cache entry, but spam likelihoods are now cached
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'query': 'John', 'limit': 10}, format='json')
+        self.assertEqual(len(response.data), 2)
+
+        for i in range(50):
+            contact = Contact.objects.create(name=f"Johnny {i}", phone_number=f"44400000{i:02d}", user=self.user)
+            SpamNumber.objects.create(phone_number=contact.phone_number, marked_by=self.user)
+
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {'query': 'John', 'limit': 100}, format='json')
+        self.assertEqual(len(response.data), 52)
+
+    def test_search_pagination(self):
+        """Test that cursors walk all results in ranking order without repeating any."""
+        url = '/api/search/'
+        for i in range(5):
+            Contact.objects.create(name=f"Johnny {i}", phone_number=f"44400000{i:02d}", user=self.user)
+        Contact.objects.create(name="Johnny 0", phone_number="5559876543", user=self.user)
+        spam_cache.get_many(Contact.objects.values_list('phone_key', flat=True))
+
+        names = []
+        cursor = None
+        while True:
+            params = {'query': 'John', 'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            # Authentication (1) + one query per rank on the page (1 or 2) + visible emails (1)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params, format='json')
+            self.assertLessEqual(len(queries), 4)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data), 3)
+            names += [(result['name'], result['phone_number']) for result in response.data]
+            cursor = response.get('X-Next-Cursor')
+            if not cursor:
+                break
+            self.assertIn(f'cursor={cursor}', response['Link'])
+
+        self.assertEqual(names, [
+            ('John Doe', '+1234567890'),
+            ('Johnny 0', '+4440000000'),
+            ('Johnny 0', '+5559876543'),
+            ('Johnny 1', '+4440000001'),
+            ('Johnny 2', '+4440000002'),
+            ('Johnny 3', '+4440000003'),
+            ('Johnny 4', '+4440000004'),
+            ('Jane john Smith', '+9876543210'),
+        ])
+
+    def test_search_invalid_pagination_parameters(self):
+        """Test that malformed limits and cursors are rejected."""
+        url = '/api/search/'
+
+        out_of_range = [[0, 'a', 10 ** 30], [0, 'a', -1], [-1, 'a', 1], [10 ** 30, 'a', 1], [FUZZY_RANK + 3, 'a', 1]]
+        cursors = [base64.urlsafe_b64encode(json.dumps(position).encode()).decode() for position in out_of_range]
+        for params in [{'limit': 0}, {'limit': 1000}, {'limit': 'ten'}, {'cursor': 'not-a-cursor'}] + [
+            {'cursor': cursor, 'fuzzy': 'true'} for cursor in cursors
+        ]:
+            response = self.client.get(url, {'query': 'John', **params}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_by_phone_number_in_another_format(self):
+        """Test that phone number searches and spam joins ignore the number's formatting."""
+        response = self.client.get('/api/search/', {'query': '+98 7654-3210'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['phone_number'], '+9876543210')
+        self.assertEqual(response.data[0]['spam_likelihood'], 0.4)
+
+    def test_phone_number_normalization(self):
+        """Test the canonical form and integer key of phone numbers."""
+        self.assertEqual(normalize_phone_number("+1 (234) 567-890"), "+1234567890")
+        self.assertEqual(normalize_phone_number("1234567890"), "+1234567890")
+        self.assertIsNone(normalize_phone_number("John"))
+        self.assertEqual(phone_number_key("+1234567890"), phone_number_key("1234567890"))
+        self.assertEqual(phone_number_key("John"), 0)
+
+        self.contact_1.phone_number = "+15550001111"
+        self.contact_1.save(update_fields=['phone_number'])
+        self.contact_1.refresh_from_db()
+        self.assertEqual(self.contact_1.phone_key, 15550001111)
+
+    def test_search_reflects_renamed_and_deleted_contacts(self):
+        """Test that the name index follows contact updates and deletions."""
+        url = '/api/search/'
+        self.contact_1.name = "Jim Beam"
+        self.contact_1.save()
+        self.contact_2.delete()
+
+        response = self.client.get(url, {'query': 'John'}, format='json')
+        self.assertEqual(len(response.data), 0)
+
+        response = self.client.get(url, {'query': 'beam'}, format='json')
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['name'], 'Jim Beam')
+
+    def test_search_streams_ndjson(self):
+        """Test that NDJSON searches stream every result, in page order, chunk by chunk."""
+        for i in range(5):
+            Contact.objects.create(name=f"Johnny {i}", phone_number=f"44400000{i:02d}", user=self.user)
+        SpamNumber.objects.create(phone_number="4440000001", marked_by=self.user, marked_count=4, spam_likelihood=0.4)
+        paged = self.client.get('/api/search/', {'query': 'john', 'limit': 100}).data
+
+        response = self.client.get('/api/search/', {'query': 'john', 'limit': 2}, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], paged)
+        self.assertEqual(len(lines), 7)
+
+        response = self.client.get('/api/search/', {'query': 'john', 'format': 'ndjson'})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 7)
+
+        # One query per rank, then each chunk costs a spam likelihood and an email visibility
+        # query, whatever its size
+        spam_cache.clear()
+        with self.assertNumQueries(2 + 2 * 4):
+            chunks = list(iter_search_results('john', self.user, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 2, 1])
+
+        response = self.client.get('/api/search/', {'format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), {"detail": "Query parameter is required."})
+
+    def test_fuzzy_search(self):
+        """Test that fuzzy searches tolerate typos and rank exact prefix matches first."""
+        url = '/api/search/'
+        Contact.objects.create(name="Jhonny Bravo", phone_number="5550000001", user=self.user)
+        Contact.objects.create(name="Jon Doe", phone_number="5550000002", user=self.user)
+
+        response = self.client.get(url, {'query': 'Jhon'}, format='json')
+        self.assertEqual([result['name'] for result in response.data], ["Jhonny Bravo"])
+
+        # Authentication (1) + exact matches, one per rank (2) + near name words (1)
+        # + fuzzy candidates (1) + visible emails (1) + spam likelihoods (1)
+        with self.assertNumQueries(7):
+            response = self.client.get(url, {'query': 'Jhon', 'fuzzy': 'true'}, format='json')
+        # Only the first and last name words are compared, "Jane john Smith" is no fuzzy match
+        self.assertEqual([result['name'] for result in response.data], ["Jhonny Bravo", "John Doe", "Jon Doe"])
+
+        response = self.client.get(url, {'query': 'jhon deo', 'fuzzy': '1', 'limit': 1}, format='json')
+        self.assertEqual([result['name'] for result in response.data], ["John Doe"])
+        response = self.client.get(
+            url, {'query': 'jhon deo', 'fuzzy': '1', 'cursor': response['X-Next-Cursor']}, format='json'
+        )
+        self.assertEqual([result['name'] for result in response.data], ["Jon Doe"])
+
+        # Too many typos for a short word
+        response = self.client.get(url, {'query': 'Jxyz', 'fuzzy': 'true'}, format='json')
+        self.assertEqual(response.data, [])
+
+    def test_fuzzy_search_pages_through_name_words(self):
+        """Test that fuzzy matches are read in name order, page after page, across their name words."""
+        contacts = [
+            Contact(name=f"{first} {i:03d} {last}", phone_number=f"44400{i:05d}", user=self.user)
+            for i in range(150)
+            for first, last in [("Jon", "Doe"), ("Jhon", "Dow"), ("Ann", "John")]
+        ]
+        for contact in contacts:
+            contact.set_derived_fields()
+        Contact.objects.bulk_create(contacts)
+        record_name_words(contacts)
+
+        exact = sorted(contact.name for contact in contacts if contact.name.startswith("Jhon"))
+        fuzzy = sorted(["John Doe"] + [contact.name for contact in contacts if not contact.name.startswith("Jhon")])
+        # Pages and chunks shorter than the contacts of each name word
+        names, cursor = [], None
+        while True:
+            results, cursor = search_contacts('jhon', self.user, limit=40, cursor=cursor, fuzzy=True)
+            names += [result['name'] for result in results]
+            if cursor is None:
+                break
+        chunks = list(iter_search_results('jhon', self.user, fuzzy=True, chunk_size=7))
+
+        self.assertEqual(names, exact + fuzzy)
+        self.assertEqual([result['name'] for chunk in chunks for result in chunk], names)
+
+    def test_name_words(self):
+        """Test the first and last name words stored for contacts and their Soundex codes."""
+        self.assertEqual([soundex(word) for word in ["robert", "rupert", "ashcraft", "tymczak", "pfister"]],
+                         ["R163", "R163", "A261", "T522", "P236"])
+        self.assertEqual(edit_distance("jhon", "john", 1), 1)
+        self.assertEqual(edit_distance("smith", "jones", 2), 3)
+
+        self.contact_1.name = "Zoë O'Brien"
+        self.contact_1.save(update_fields=['name'])
+        self.contact_1.refresh_from_db()
+        self.assertEqual((self.contact_1.name_first_word, self.contact_1.name_last_word), ("zoë", "brien"))
+        self.assertEqual(NameWord.objects.get(word="zoë").soundex, word_soundex("zoë"))
+        self.assertEqual(NameWord.objects.get(word="brien").soundex, "B650")
+
+    def test_search_short_and_special_character_queries(self):
+        """Test queries shorter than a trigram and queries containing quotes or wildcards."""
+        url = '/api/search/'
+
+        response = self.client.get(url, {'query': 'jo'}, format='json')
+        self.assertEqual([result['name'] for result in response.data], ['John Doe', 'Jane john Smith'])
+
+        response = self.client.get(url, {'query': '"jo%'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 0)
+
+
+@override_settings(CONTACT_NAME_INDEX={'ENABLED': True, 'MAX_CONTACTS': 100})
+class NameIndexTests(TestCase):
+    def setUp(self):
+        search_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="user",
+            phone_number="1234567891",
+            password="password@123",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+        self.contact = Contact.objects.create(name="John Doe", phone_number="1234567890", user=self.user)
+        Contact.objects.create(name="Jane john Smith", phone_number="9876543210", user=self.user)
+        name_index.reset()
+        self.addCleanup(name_index.reset)
+
+    def test_search_uses_index(self):
+        """Test that searches resolve candidates through the in-process index."""
+        response = self.client.get('/api/search/', {'query': 'John'}, format='json')
+
+        self.assertEqual([result['name'] for result in response.data], ['John Doe', 'Jane john Smith'])
+        self.assertEqual(name_index.index.search('john'), sorted(name_index.index.names))
+
+    def test_index_follows_contact_signals(self):
+        """Test that saved, renamed and deleted contacts are reflected in the index."""
+        index = name_index.get()
+        new_contact = Contact.objects.create(name="Johnny Bravo", phone_number="5551234567", user=self.user)
+        self.contact.name = "Jim Beam"
+        self.contact.save()
+
+        self.assertIn(new_contact.id, index.search('johnny'))
+        self.assertNotIn(self.contact.id, index.search('john'))
+        self.assertEqual(index.search('beam'), [self.contact.id])
+
+        self.contact.delete()
+        self.assertEqual(index.search('beam'), [])
+
+    def test_index_catches_up_on_bulk_inserts(self):
+        """Test that contacts inserted without signals are picked up by a refresh."""
+        index = name_index.get()
+        Contact.objects.bulk_create([Contact(name="Johanna", name_normalized="johanna", phone_number="5550000000", user=self.user)])
+
+        name_index.refresh()
+        self.assertEqual(len(index.search('johanna')), 1)
+
+    def test_index_catches_up_on_renames_elsewhere(self):
+        """Test that contacts renamed without signals (e.g. by another worker) are picked up by a refresh."""
+        index = name_index.get()
+        Contact.objects.filter(pk=self.contact.pk).update(
+            name="Zed Zulu", name_normalized="zed zulu", updated_at=timezone.now(),
+        )
+        self.assertEqual(index.search('zulu'), [])
+
+        name_index.refresh()
+        self.assertEqual(index.search('zulu'), [self.contact.id])
+        self.assertNotIn(self.contact.id, index.search('john'))
+
+    @override_settings(CONTACT_NAME_INDEX={'ENABLED': True, 'MAX_CONTACTS': 100, 'REFRESH_INTERVAL': 0})
+    def test_refresh_runs_in_background(self):
+        """Test that a stale index is served as it is while a background thread catches up."""
+        index = name_index.get()
+        started, release = threading.Event(), threading.Event()
+        refreshing_threads = []
+
+        def refresh():
+            refreshing_threads.append(threading.get_ident())
+            started.set()
+            release.wait(5)
+
+        with mock.patch.object(name_index, 'refresh', side_effect=refresh):
+            self.assertIs(name_index.get(), index)
+            self.assertTrue(started.wait(5))
+            # A refresh is running, no other one is started
+            self.assertIs(name_index.get(), index)
+            release.set()
+            name_index.refresher.join(5)
+
+        self.assertEqual(len(refreshing_threads), 1)
+        self.assertNotEqual(refreshing_threads[0], threading.get_ident())
+        self.assertFalse(name_index.refresh_lock.locked())
+
+    def test_compaction_keeps_contacts_indexed_meanwhile(self):
+        """Test that contacts added while the postings are rebuilt are in the compacted postings."""
+        index = NameIndex()
+        index.load_rows([(1, 'john doe'), (2, 'jane doe')])
+        index.add(1, 'jim beam')
+        build = index._index
+
+        def index_and_add(contact_id, name, postings=None):
+            build(contact_id, name, postings)
+            if contact_id == 2 and postings is not index.postings:
+                index.add(3, 'jack doe')
+
+        with mock.patch.object(index, '_index', side_effect=index_and_add):
+            index.compact()
+
+        self.assertEqual(index.search('doe'), [2, 3])
+        self.assertEqual(index.search('beam'), [1])
+        # The postings of the name 1 had before its rename are gone
+        self.assertNotIn('joh', index.postings)
+        self.assertEqual(index.stale_postings, 0)
+
+    def test_index_memory_bound(self):
+        """Test that the index disables itself past MAX_CONTACTS and searches fall back to the database."""
+        index = NameIndex(max_contacts=2)
+        index.load_rows([(1, 'john doe'), (2, 'jane doe'), (3, 'jack doe')])
+
+        self.assertTrue(index.overflowed)
+        self.assertIsNone(index.search('doe'))
+
+    def test_rebuild_command_writes_snapshot(self):
+        """Test that the rebuild command writes a snapshot workers can load."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'names.idx')
+            call_command('rebuild_name_index', output=path, stdout=io.StringIO())
+
+            index = NameIndex.load(path)
+            self.assertEqual(len(index.search('john')), 2)
+
+
+class ContactImportViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="user",
+            phone_number="1234567891",
+            password="password@123",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.url = '/api/contacts/import/'
+
+    def test_export_round_trips_through_import(self):
+        """Test that the export streams the caller's contacts as NDJSON the import accepts."""
+        other = User.objects.create(username="other", phone_number="5550000000")
+        Contact.objects.create(name="Not Mine", phone_number="5550000001", user=other)
+        contacts = [{"name": f"Contact {i}", "phone_number": f"+4440000{i:04d}"} for i in range(5)]
+        self.client.post(self.url, json.dumps(contacts), content_type='application/json')
+
+        response = self.client.get('/api/contacts/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('attachment', response['Content-Disposition'])
+        body = b''.join(response.streaming_content)
+        self.assertEqual([json.loads(line) for line in body.splitlines()], contacts)
+
+        Contact.objects.filter(user=self.user).delete()
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.data['accepted'], 5)
+
+    def test_import_json_array(self):
+        """Test importing a JSON array, skipping invalid entries and existing contacts, whatever their number's format."""
+        Contact.objects.create(name="John Doe", phone_number="1234567890", user=self.user)
+        contacts = [
+            {"name": "John Doe", "phone_number": "+1234567890"},
+            {"name": "Jane Smith", "phone_number": "9876543210"},
+            {"name": "", "phone_number": "5551234567"},
+            {"name": "Jack Black", "phone_number": "invalid_number"},
+            "Jill",
+        ]
+
+        response = self.client.post(self.url, json.dumps(contacts), content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['received'], 5)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['skipped'], 1)
+        self.assertEqual(response.data['invalid'], 3)
+        self.assertEqual([error['index'] for error in response.data['errors']], [2, 3, 4])
+        self.assertEqual(
+            sorted(Contact.objects.filter(user=self.user).values_list('name_normalized', flat=True)),
+            ['jane smith', 'john doe']
+        )
+
+    def test_import_ndjson_and_csv(self):
+        """Test importing NDJSON and CSV streams."""
+        ndjson = '{"name": "Jane Smith", "phone_number": "9876543210"}\n\n{"name": "Jack Black", "phone_number": "5551234567"}\n'
+        response = self.client.post(self.url, ndjson, content_type='application/x-ndjson')
+        self.assertEqual(response.data['accepted'], 2)
+
+        csv_data = 'name,phone_number\nJill Valentine,5559876543\n"Doe, John",1234567890\nbroken row\n'
+        response = self.client.post(self.url, csv_data, content_type='text/csv; charset=utf-8')
+        self.assertEqual(response.data['accepted'], 2)
+        self.assertEqual(response.data['invalid'], 1)
+        self.assertTrue(Contact.objects.filter(name="Doe, John", user=self.user).exists())
+
+    def test_import_counts_only_inserted_contacts(self):
+        """Test that duplicate rows are reported as skipped and imported contacts are searchable at once."""
+        contacts = [{"name": "Alice Liddell", "phone_number": "5551230000"}] * 3
+        with override_settings(CONTACT_NAME_INDEX={'ENABLED': True}):
+            name_index.reset()
+            self.addCleanup(name_index.reset)
+            name_index.get()
+
+            response = self.client.post(self.url, json.dumps(contacts), content_type='application/json')
+            self.assertEqual((response.data['accepted'], response.data['skipped']), (1, 2))
+            results, _ = search_contacts('lidd', self.user)
+            self.assertEqual([result['name'] for result in results], ["Alice Liddell"])
+
+        response = self.client.post(self.url, json.dumps(contacts), content_type='application/json')
+        self.assertEqual((response.data['accepted'], response.data['skipped']), (0, 3))
+        self.assertEqual(Contact.objects.filter(name="Alice Liddell").count(), 1)
+
+    def test_import_rejects_malformed_uploads(self):
+        """Test that malformed bodies and unsupported content types are rejected."""
+        response = self.client.post(self.url, '[{"name": "John"', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(self.url, '{"name": "John"}', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(self.url, 'name: John', content_type='text/plain')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_json_array_parser_across_read_boundaries(self):
+        """Test that items split across stream reads are decoded correctly."""
+        items = [{"name": f"Jöhn {i}", "phone_number": f"44400000{i:02d}"} for i in range(20)] + [12345, "x"]
+        data = json.dumps(items, ensure_ascii=False).encode()
+
+        self.assertEqual(list(iter_json_array(io.BytesIO(data), read_size=7)), items)
+        self.assertEqual(list(iter_json_array(io.BytesIO(b' [ ] '), read_size=1)), [])
+        with self.assertRaises(ImportFormatError):
+            list(iter_json_array(io.BytesIO(b'[1 2]'), read_size=3))
+
+
+class LookupNumbersViewTest(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="user",
+            phone_number="1234567891",
+            password="password@123",
+            first_name="Jill",
+            last_name="Valentine",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.url = '/api/lookup/'
+
+        other_users = [User.objects.create(username=f"other{i}", phone_number=f"55500000{i:02d}") for i in range(3)]
+        Contact.objects.create(name="John Doe", phone_number="1234567890", user=other_users[0])
+        Contact.objects.create(name="john doe", phone_number="1234567890", user=other_users[1])
+        Contact.objects.create(name="Johnny", phone_number="1234567890", user=other_users[2])
+        Contact.objects.create(name="Jill", phone_number="1234567891", user=other_users[0])
+        SpamNumber.objects.create(phone_number="1234567890", marked_by=self.user, marked_count=5, spam_likelihood=0.5)
+
+    def test_lookup_numbers(self):
+        """Test that names, registration and spam likelihood are resolved for every number."""
+        phone_numbers = ["1234567890", "1234567891", "9876543210", "invalid_number"]
+
+        # Authentication (1) + phone directory (1)
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {"phone_numbers": phone_numbers}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['invalid'], ["invalid_number"])
+        self.assertEqual(response.data['results'], {
+            "1234567890": {"spam_likelihood": 0.5, "name": "John Doe", "registered": False},
+            "1234567891": {"spam_likelihood": 0.1, "name": "Jill Valentine", "registered": True},
+            "9876543210": {"spam_likelihood": 0.1, "name": None, "registered": False},
+        })
+
+    def test_lookup_query_count_does_not_grow_with_batch(self):
+        """Test that larger batches cost the same number of queries."""
+        phone_numbers = [f"44400{i:05d}" for i in range(MAX_LOOKUP_NUMBERS)]
+
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {"phone_numbers": phone_numbers}, format="json")
+        self.assertEqual(len(response.data['results']), MAX_LOOKUP_NUMBERS)
+
+        response = self.client.post(self.url, {"phone_numbers": phone_numbers + ["1234567890"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AutocompleteViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="user", phone_number="1234567891", password="password@123")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.url = '/api/autocomplete/'
+
+        other_users = [User.objects.create(username=f"other{i}", phone_number=f"55500000{i:02d}") for i in range(3)]
+        for other_user in other_users:
+            Contact.objects.create(name="John Doe", phone_number=f"+44{other_user.phone_number}", user=other_user)
+        Contact.objects.create(name="Johnny", phone_number="1234567890", user=other_users[0])
+        Contact.objects.create(name="Joan Smith", phone_number="12345", user=other_users[1])
+        Contact.objects.create(name="Bob Jones", phone_number="9876543210", user=other_users[2])
+
+    def test_autocomplete(self):
+        """Test that distinct names and known numbers starting with the prefix are returned in order."""
+        # The token is checked without loading the user, a prefix that is not a number only
+        # reads names (1)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'prefix': 'Jo'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'names': ["Joan Smith", "John Doe", "Johnny"], 'numbers': []})
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Authorization', response['Vary'])
+
+        # Names (1) + numbers (1)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'prefix': '+1 23'})
+        # Shorter numbers first, registered users' numbers included
+        self.assertEqual(response.json()['numbers'], ["+12345", "+1234567890", "+1234567891"])
+
+        response = self.client.get(self.url, {'prefix': 'john', 'limit': 1})
+        self.assertEqual(response.json()['names'], ["John Doe"])
+
+    def test_autocomplete_numbers_ignore_non_digits(self):
+        """Test that prefixes that cannot start a phone number only complete names."""
+        Contact.objects.create(name="0800 Hotline", phone_number="800123", user=self.user)
+
+        response = self.client.get(self.url, {'prefix': '0800'})
+        self.assertEqual(response.json(), {'names': ["0800 Hotline"], 'numbers': []})
+
+    def test_autocomplete_invalid_parameters(self):
+        """Test that a missing prefix or an out of range limit is rejected."""
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'prefix': 'jo', 'limit': 500})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.credentials()
+        self.assertEqual(self.client.get(self.url, {'prefix': 'jo'}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AsyncViewTests(TransactionTestCase):
+    # Concurrent queries run in worker threads, with their own connections: data must be committed
+    def setUp(self):
+        spam_cache.clear()
+        search_cache.clear()
+        self.user = User.objects.create_user(
+            username="user", phone_number="1234567891", password="password@123", email="user@example.com",
+        )
+        self.others = [User.objects.create(username=f"other{i}", phone_number=f"55500000{i:02d}") for i in range(3)]
+        self.others[0].email = "other0@example.com"
+        self.others[0].save()
+        Contact.objects.create(name="User", phone_number="1234567891", user=self.others[0])
+        for i, name in enumerate(["John Doe", "Johnny", "Jane john Smith", "Jon Snow", "Jack Black"]):
+            Contact.objects.create(name=name, phone_number=f"98765432{i:02d}", user=self.user)
+        Contact.objects.create(name="Saved John", phone_number="5550000000", user=self.others[1])
+        Contact.objects.create(name="Agent", phone_number="5550000000", user=self.others[2])
+        SpamNumber.objects.create(phone_number="9876543200", marked_by=self.user, marked_count=5, spam_likelihood=0.5)
+
+        self.client = APIClient()
+        self.token = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.client.credentials(HTTP_AUTHORIZATION=self.token)
+        self.factory = AsyncRequestFactory()
+
+    def call(self, view, request):
+        return async_to_sync(view.as_view())(request)
+
+    def search(self, params, **headers):
+        request = self.factory.get('/api/search/', params, headers={'Authorization': self.token, **headers})
+        return self.call(AsyncSearchPersonView, request)
+
+    def test_search_matches_sync_view(self):
+        """Test that the async search returns the pages, cursors and emails of the sync view."""
+        for params in [
+            {'query': 'john'},
+            {'query': 'john', 'limit': 2},
+            {'query': '555 000 0000'},
+            {'query': 'jonh', 'fuzzy': 'true'},
+            {'query': 'nobody'},
+        ]:
+            while params:
+                expected = self.client.get('/api/search/', params)
+                search_cache.clear()
+                response = self.search(params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(json.loads(response.content), expected.data, params)
+                self.assertEqual(response.get('X-Next-Cursor'), expected.get('X-Next-Cursor'))
+                cursor = response.get('X-Next-Cursor')
+                params = {**params, 'cursor': cursor} if cursor else None
+
+        # Served from the search cache, with the emails of the viewer
+        response = self.search({'query': '5550000000'})
+        self.assertEqual(json.loads(response.content), self.client.get('/api/search/', {'query': '5550000000'}).data)
+
+    def test_search_runs_independent_queries_concurrently(self):
+        """Test that name matches and phone matches are read at the same time, in worker threads."""
+        barrier = threading.Barrier(2, timeout=5)
+        name_page, extra_page = search.name_page, search.extra_page
+
+        def waiting(function):
+            def wait_then_call(*args):
+                # Raises BrokenBarrierError unless the other query is running too
+                barrier.wait()
+                return function(*args)
+            return wait_then_call
+
+        with mock.patch.object(search, 'name_page', waiting(name_page)), \
+                mock.patch.object(search, 'extra_page', waiting(extra_page)):
+            response = self.search({'query': '5550000000'})
+        self.assertEqual([result['name'] for result in json.loads(response.content)], ["Agent", "Saved John"])
+
+    def test_search_errors(self):
+        """Test that the async search answers errors like the sync view."""
+        response = self.call(AsyncSearchPersonView, self.factory.get('/api/search/', {'query': 'john'}))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content), {"detail": "Authentication credentials were not provided."})
+        self.assertTrue(response['WWW-Authenticate'].startswith('Bearer'))
+
+        response = self.search({'query': 'john'}, Authorization='Bearer invalid')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content)['code'], 'token_not_valid')
+
+        for params, detail in [
+            ({}, "Query parameter is required."),
+            ({'query': 'john', 'limit': 0}, f"limit must be an integer between 1 and {MAX_PAGE_SIZE}."),
+            ({'query': 'john', 'cursor': 'invalid'}, "Invalid cursor."),
+        ]:
+            response = self.search(params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(json.loads(response.content), {"detail": detail})
+
+    def test_search_streams_ndjson(self):
+        """Test that the async search streams every result as NDJSON."""
+        response = self.search({'query': 'john', 'format': 'ndjson'})
+        self.assertTrue(response.is_async)
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = async_to_sync(read)().decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.client.get('/api/search/', {'query': 'john', 'limit': 100}).data)
+
+    def test_lookup_matches_sync_view(self):
+        """Test that the async lookup resolves numbers and rejects bad bodies like the sync view."""
+        for body in [
+            {"phone_numbers": ["9876543200", "1234567891", "5550000000", "invalid_number"]},
+            {"phone_numbers": []},
+            {"phone_numbers": ["1"] * (MAX_LOOKUP_NUMBERS + 1)},
+        ]:
+            request = self.factory.post(
+                '/api/lookup/', json.dumps(body), content_type='application/json', headers={'Authorization': self.token},
+            )
+            response = self.call(AsyncLookupNumbersView, request)
+            expected = self.client.post('/api/lookup/', body, format='json')
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(json.loads(response.content), expected.data)
+
+        request = self.factory.post(
+            '/api/lookup/', '{', content_type='application/json', headers={'Authorization': self.token},
+        )
+        self.assertEqual(self.call(AsyncLookupNumbersView, request).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_worker_threads_keep_their_connections(self):
+        """Test that database tasks reuse their thread's connection even when CONN_MAX_AGE is 0."""
+        opened = []
+        receiver = lambda connection, **kwargs: opened.append(threading.get_ident())
+        connection_created.connect(receiver)
+        self.addCleanup(connection_created.disconnect, receiver)
+
+        async def count_contacts():
+            return await database_task(Contact.objects.count)
+
+        with mock.patch.dict(connection.settings_dict, {'CONN_MAX_AGE': 0}):
+            for _ in range(5):
+                self.assertEqual(async_to_sync(count_contacts)(), 8)
+        self.assertEqual(len(opened), len(set(opened)))
+
+    def test_queries_in_worker_threads_are_instrumented(self):
+        """Test that the async instrumentation counts the queries of the async ORM and worker threads."""
+        middleware = RequestInstrumentationMiddleware(AsyncSearchPersonView.as_view())
+        request = self.factory.get('/api/search/', {'query': '5550000000'}, headers={'Authorization': self.token})
+        with self.assertLogs('contacts.instrumentation', 'INFO') as logs:
+            response = async_to_sync(middleware)(request)
+
+        # Authentication (1) + name matches, one per rank (2) + directory entry (1)
+        # + spam likelihoods (1) + visible emails (1)
+        self.assertEqual(logs.records[0].timings['queries'], 6)
+        self.assertIn('desc="6 queries"', response['Server-Timing'])
+
+
+class SpamLikelihoodCacheTests(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        self.user = User.objects.create(username="user", phone_number="1234567891")
+        self.spam_number = SpamNumber.objects.create(
+            phone_number="1234567890", marked_by=self.user, marked_count=3, spam_likelihood=0.3
+        )
+
+    def test_hits_and_negative_entries(self):
+        """Test that spam and non-spam numbers are both served from the cache once read."""
+        before = spam_cache.stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(spam_cache.get_many([1234567890, 9876543210]), {1234567890: 0.3, 9876543210: 0.1})
+        with self.assertNumQueries(0):
+            self.assertEqual(spam_cache.get_many([1234567890, 9876543210]), {1234567890: 0.3, 9876543210: 0.1})
+
+        stats = spam_cache.stats()
+        self.assertEqual(stats['misses'] - before['misses'], 2)
+        self.assertEqual(stats['hits'] - before['hits'], 2)
+
+    def test_marks_invalidate_cached_likelihoods(self):
+        """Test that a cached likelihood is never served after a spam mark changes it."""
+        self.assertEqual(spam_cache.get(1234567890), 0.3)
+        self.assertEqual(spam_cache.get(9876543210), 0.1)
+
+        mark_spam("+1234567890", User.objects.create(username="other", phone_number="1234567892"))
+        mark_spam("9876543210", self.user)
+        self.assertAlmostEqual(spam_cache.get(1234567890), 0.4)
+        self.assertAlmostEqual(spam_cache.get(9876543210), 0.1)
+
+        # Also through the counters of the model and the mark spam endpoint
+        SpamNumber.objects.filter(pk=self.spam_number.pk).update(marked_count=8)
+        self.spam_number.update_spam_likelihood()
+        self.assertAlmostEqual(spam_cache.get(1234567890), 0.8)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        client.post('/api/mark_spam/', {'phone_number': '1234567890'}, format='json')
+        self.assertAlmostEqual(spam_cache.get(1234567890), 0.9)
+
+        self.spam_number.delete()
+        self.assertEqual(spam_cache.get(1234567890), 0.1)
+
+    def test_lru_bound_and_ttl(self):
+        """Test that the per-process tier evicts the least recently used and expired entries."""
+        cache = LRUCache(max_entries=2, ttl=60)
+        cache.set(1, 0.1)
+        cache.set(2, 0.2)
+        cache.get(1)
+        cache.set(3, 0.3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), 0.1)
+
+        cache = LRUCache(max_entries=2, ttl=-1)
+        cache.set(1, 0.1)
+        self.assertIsNone(cache.get(1))
+
+    @override_settings(
+        CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'spam'}},
+        SPAM_LIKELIHOOD_CACHE={'SHARED_CACHE': 'shared'},
+    )
+    def test_shared_tier(self):
+        """Test that a worker with a cold local tier reads likelihoods cached by another worker."""
+        self.addCleanup(caches['shared'].clear)
+        spam_cache.get(1234567890)
+        spam_cache.get_local().clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(spam_cache.get(1234567890), 0.3)
+
+        mark_spam("1234567890", self.user)
+        spam_cache.get_local().clear()
+        self.assertAlmostEqual(spam_cache.get(1234567890), 0.4)
+
+    @override_settings(
+        CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'spam'}},
+        SPAM_LIKELIHOOD_CACHE={'SHARED_CACHE': 'shared'},
+    )
+    def test_marks_invalidate_other_workers(self):
+        """Test that a mark made through one worker is not served from another worker's local tier."""
+        self.addCleanup(caches['shared'].clear)
+        other_worker = SpamLikelihoodCache()
+        self.assertEqual(other_worker.get(1234567890), 0.3)
+        with self.assertNumQueries(0):
+            self.assertEqual(other_worker.get(1234567890), 0.3)
+
+        mark_spam("1234567890", self.user)
+        self.assertAlmostEqual(other_worker.get(1234567890), 0.4)
+        self.assertEqual(other_worker.stats()['invalidations'], 0)
+
+
+class SearchResultCacheTests(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        search_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="user", phone_number="1234567891", password="password@123")
+        self.other = User.objects.create_user(
+            username="other", phone_number="1234567890", password="password@123", email="other@example.com",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        Contact.objects.create(name="John Doe", phone_number="1234567890", user=self.user)
+        Contact.objects.create(name="Jane john Smith", phone_number="9876543210", user=self.user)
+
+    def search(self, query, user=None):
+        if user is not None:
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        response = self.client.get('/api/search/', {'query': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_hits_share_pages_between_viewers(self):
+        """Test that a cached page is served to every viewer with their own email visibility."""
+        before = search_cache.stats()
+        self.search('John')
+
+        # Authentication (1) + visible emails (1)
+        with self.assertNumQueries(2):
+            results = self.search('  JOHN ')
+        self.assertIsNone(results[0]['email'])
+
+        # The other user saves the viewer's number (a new generation), the viewer can see their email
+        Contact.objects.create(name="User", phone_number="1234567891", user=self.other)
+        results = self.search('john')
+        self.assertEqual(results[0]['email'], 'other@example.com')
+        results = self.search('john', user=self.other)
+        self.assertEqual([result['name'] for result in results], ["John Doe", "Jane john Smith"])
+        self.assertIsNone(results[0]['email'])
+
+        stats = search_cache.stats()
+        self.assertEqual(stats['misses'] - before['misses'], 2)
+        self.assertEqual(stats['hits'] - before['hits'], 2)
+        self.assertGreater(stats['saved_seconds'], before['saved_seconds'])
+        self.assertGreater(stats['hit_rate'], 0)
+
+    def test_writes_bump_generations(self):
+        """Test that contact and spam writes, including the bulk paths, make cached pages stale."""
+        self.assertEqual(len(self.search('john')), 2)
+
+        contact = Contact.objects.create(name="Johnny", phone_number="5550000000", user=self.user)
+        self.assertEqual(len(self.search('john')), 3)
+        contact.delete()
+        self.assertEqual(len(self.search('john')), 2)
+
+        self.client.post('/api/mark_spam/bulk/', {'phone_numbers': ["1234567890"]}, format='json')
+        self.assertEqual(self.search('john')[0]['spam_likelihood'], 0.1)
+        self.client.post('/api/mark_spam/', {'phone_number': "1234567890"}, format='json')
+        SpamNumber.objects.filter(phone_number="+1234567890").update(marked_count=5)
+        SpamNumber.objects.get(phone_number="+1234567890").update_spam_likelihood()
+        self.assertEqual(self.search('john')[0]['spam_likelihood'], 0.5)
+
+        self.client.post(
+            '/api/contacts/import/', json.dumps([{'name': "Johnny", 'phone_number': "5550000001"}]),
+            content_type='application/json',
+        )
+        self.assertEqual(len(self.search('john')), 3)
+
+    @override_settings(SEARCH_RESULT_CACHE={'ENABLED': False})
+    def test_disabled(self):
+        """Test that nothing is cached when the cache is disabled."""
+        self.search('john')
+        # Authentication (1) + search results, one per rank (2) + visible emails (1)
+        with self.assertNumQueries(4):
+            self.search('john')
+
+
+class RendererTests(TestCase):
+    def setUp(self):
+        self.payload = [
+            {'name': "Zoë Ångström", 'phone_number': "+4915112345678", 'spam_likelihood': 0.1, 'email': None},
+            {'name': "John Doe", 'phone_number': "1234567890", 'spam_likelihood': 1.0, 'email': "john@example.com"},
+            {'created_at': datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc), 'count': 12},
+            {1234567890: [True, False, -1, 2 ** 40], 'detail': gettext_lazy("Not found.")},
+        ]
+
+    def test_json_matches_drf_output(self):
+        """Test that the orjson renderer and its fallback produce DRF's JSON byte for byte."""
+        expected = JSONRenderer().render(self.payload)
+        self.assertEqual(ORJSONRenderer().render(self.payload), expected)
+        with mock.patch('contacts.renderers.orjson', None):
+            self.assertEqual(ORJSONRenderer().render(self.payload), expected)
+        self.assertEqual(
+            ORJSONRenderer().render(self.payload, 'application/json; indent=2'),
+            JSONRenderer().render(self.payload, 'application/json; indent=2'),
+        )
+
+    def test_parser(self):
+        """Test that the orjson parser and its fallback decode bodies and reject malformed ones."""
+        for orjson_module in [renderers.orjson, None]:
+            with mock.patch('contacts.renderers.orjson', orjson_module):
+                self.assertEqual(ORJSONParser().parse(io.BytesIO('{"name": "Zoë", "n": [1, 2.5]}'.encode())),
+                                 {'name': "Zoë", 'n': [1, 2.5]})
+                with self.assertRaises(ParseError):
+                    ORJSONParser().parse(io.BytesIO(b'{"name": '))
+
+    def test_msgpack(self):
+        """Test the built-in MessagePack packer against the format, and against msgpack when installed."""
+        self.assertEqual(
+            pack_msgpack({'a': [1, None, True, 0.5, "x", -5, 200, -200, 70000]}),
+            bytes.fromhex('81 a161 99 01 c0 c3 cb3fe0000000000000 a178 fb ccc8 d1ff38 ce00011170'),
+        )
+        self.assertEqual(pack_msgpack("é" * 40), bytes.fromhex('d950') + "é".encode() * 40)
+        if renderers.msgpack is not None:
+            self.assertEqual(
+                pack_msgpack(self.payload),
+                renderers.msgpack.packb(self.payload, default=renderers.encoder_default, use_bin_type=True),
+            )
+
+    def test_negotiation(self):
+        """Test that API responses are JSON by default and MessagePack on request."""
+        user = User.objects.create_user(username="user", phone_number="1234567891", password="password@123")
+        Contact.objects.create(name="John Doe", phone_number="1234567890", user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+        response = client.get('/api/search/', {'query': 'john'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        expected = pack_msgpack(json.loads(response.content))
+
+        response = client.get('/api/search/', {'query': 'john'}, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(response.content, expected)
+
+        response = client.post('/api/mark_spam/', b'{"phone_number": ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RequestInstrumentationTests(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        search_cache.clear()
+        self.user = User.objects.create_user(username="user", phone_number="1234567891", password="password@123")
+        Contact.objects.create(name="John Doe", phone_number="1234567890", user=self.user)
+
+    def client_for(self, user):
+        # Middleware is loaded by each client, after the settings under test are applied
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        return client
+
+    def test_server_timing_and_log_line(self):
+        """Test that query counts and timings are sent in Server-Timing and logged once."""
+        client = self.client_for(self.user)
+        with self.assertLogs('contacts.instrumentation', 'INFO') as logs, CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/search/', {'query': 'john'})
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        record = logs.records[0].timings
+        self.assertEqual(record['path'], '/api/search/')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['queries'], len(queries))
+        self.assertEqual(record['over_budget'], [])
+        self.assertGreater(record['render_ms'], 0)
+        self.assertGreaterEqual(record['total_ms'], record['view_ms'] + record['render_ms'])
+
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'view', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+
+    @override_settings(REQUEST_INSTRUMENTATION={'QUERY_BUDGET': 100, 'PATH_BUDGETS': {'/api/search/': {'QUERY_BUDGET': 1}}})
+    def test_budgets(self):
+        """Test that requests over their path's query budget are logged as warnings."""
+        client = self.client_for(self.user)
+        with self.assertLogs('contacts.instrumentation', 'INFO') as logs:
+            client.get('/api/search/', {'query': 'john'})
+            client.get('/api/profile/')
+
+        self.assertEqual([record.levelname for record in logs.records], ['WARNING', 'INFO'])
+        self.assertEqual(logs.records[0].timings['over_budget'], ['queries'])
+
+    @override_settings(REQUEST_INSTRUMENTATION={'ENABLED': False})
+    def test_disabled(self):
+        """Test that a disabled middleware is left out of the chain."""
+        client = self.client_for(self.user)
+        with self.assertNoLogs('contacts.instrumentation'):
+            response = client.get('/api/search/', {'query': 'john'})
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.user = User.objects.create_user(username="user", phone_number="1234567891", password="password@123")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.admin = User.objects.create_user(username="admin", phone_number="1234567892", is_staff=True)
+
+    def scrape(self, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', f'Bearer {RefreshToken.for_user(self.admin).access_token}')
+        response = APIClient().get('/api/metrics/', **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_requests_and_latencies_by_view(self):
+        """Test that requests are counted per view, method and status, with latency histograms."""
+        self.client.get('/api/search/', {'query': 'john'})
+        self.client.get('/api/search/', {'query': 'john'})
+        self.client.get('/api/search/')
+        APIClient().post('/api/token/', {'username': 'user', 'password': 'password@123'}, format='json')
+        self.client.get('/api/no-such-page/')
+
+        samples = self.scrape()
+        self.assertEqual(samples['contacts_http_requests_total{view="search_by_name",method="GET",status="200"}'], 2)
+        self.assertEqual(samples['contacts_http_requests_total{view="search_by_name",method="GET",status="400"}'], 1)
+        self.assertEqual(samples['contacts_http_requests_total{view="token_obtain_pair",method="POST",status="200"}'], 1)
+        self.assertEqual(samples['contacts_http_requests_total{view="unmatched",method="GET",status="404"}'], 1)
+
+        self.assertEqual(samples['contacts_http_request_duration_seconds_count{view="search_by_name"}'], 3)
+        self.assertEqual(samples['contacts_http_request_duration_seconds_bucket{view="search_by_name",le="+Inf"}'], 3)
+        self.assertLessEqual(
+            samples['contacts_http_request_duration_seconds_bucket{view="search_by_name",le="0.005"}'],
+            samples['contacts_http_request_duration_seconds_bucket{view="search_by_name",le="10.0"}'],
+        )
+        self.assertGreater(samples['contacts_http_request_duration_seconds_sum{view="search_by_name"}'], 0)
+
+    def test_multiprocess_aggregation(self):
+        """Test that a scrape sums the files written by every worker sharing the directory."""
+        with tempfile.TemporaryDirectory() as directory:
+            other_worker = {
+                'requests': [['search_by_name', 'GET', 200, 5]],
+                'latencies': {'search_by_name': [5] + [0] * len(LATENCY_BUCKETS) + [0.01]},
+            }
+            with open(os.path.join(directory, 'metrics-1-1.json'), 'w') as metrics_file:
+                json.dump(other_worker, metrics_file)
+
+            with override_settings(REQUEST_METRICS={'MULTIPROCESS_DIR': directory}):
+                client = APIClient()
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+                client.get('/api/search/', {'query': 'john'})
+                samples = self.scrape()
+                self.assertEqual(len(os.listdir(directory)), 2)
+
+        self.assertEqual(samples['contacts_http_requests_total{view="search_by_name",method="GET",status="200"}'], 6)
+        self.assertEqual(samples['contacts_http_request_duration_seconds_count{view="search_by_name"}'], 6)
+        self.assertGreaterEqual(samples['contacts_http_request_duration_seconds_bucket{view="search_by_name",le="0.005"}'], 5)
+
+    def test_concurrent_flushes(self):
+        """Test that threads flushing at once write one complete file, and failed flushes do not fail requests."""
+        metrics.observe('search_by_name', 'GET', 200, 0.01)
+        with tempfile.TemporaryDirectory() as directory:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(lambda _: metrics.flush(directory), range(64)))
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(metrics.collect(directory)['requests'][('search_by_name', 'GET', 200)], 1)
+
+            with override_settings(REQUEST_METRICS={'MULTIPROCESS_DIR': directory, 'FLUSH_INTERVAL': 0}), \
+                    mock.patch('contacts.metrics.tempfile.mkstemp', side_effect=OSError("disk full")), \
+                    self.assertLogs('contacts.metrics', 'WARNING'):
+                response = self.client.get('/api/search/', {'query': 'john'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(REQUEST_METRICS={'SCRAPE_TOKEN': 'secret'})
+    def test_scrape_token(self):
+        """Test that a configured scrape token is required."""
+        self.assertEqual(APIClient().get('/api/metrics/').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('contacts_http_requests_total', str(self.scrape(HTTP_AUTHORIZATION='Bearer secret')))
+
+    def test_scrape_requires_admin_without_token(self):
+        """Test that without a scrape token the metrics are only served to admin users."""
+        self.assertEqual(APIClient().get('/api/metrics/').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertIn('contacts_http_requests_total', str(self.scrape()))
+
+
+class QueueLoggingTests(TestCase):
+    def handler(self, directory, **kwargs):
+        handler = QueueFileHandler(os.path.join(directory, 'api.log'), **kwargs)
+        handler.setFormatter(JSONFormatter())
+        logger = logging.getLogger('contacts.tests.queue_logging')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+        return logger, handler
+
+    def read_lines(self, directory):
+        return [
+            json.loads(line)
+            for name in sorted(os.listdir(directory))
+            for line in open(os.path.join(directory, name))
+        ]
+
+    def test_json_lines_written_on_close(self):
+        """Test that records are written as JSON lines by the listener, all of them once closed."""
+        with tempfile.TemporaryDirectory() as directory:
+            logger, handler = self.handler(directory)
+            logger.warning("Imported %d contacts for %s", 3, 'user', extra={'timings': {'path': '/api/'}, 'request': object()})
+            try:
+                raise ValueError("bad row")
+            except ValueError:
+                logger.exception("Import failed")
+            handler.close()
+
+            first, second = self.read_lines(directory)
+        self.assertEqual(first['level'], 'WARNING')
+        self.assertEqual(first['message'], "Imported 3 contacts for user")
+        self.assertEqual(first['logger'], 'contacts.tests.queue_logging')
+        self.assertEqual(first['timings'], {'path': '/api/'})
+        self.assertTrue(first['request'].startswith('<object object'))
+        self.assertEqual(second['message'], "Import failed")
+        self.assertIn("ValueError: bad row", second['exception'])
+
+    def test_logging_does_not_wait_for_the_file(self):
+        """Test that a slow file only slows the listener down, not the logging thread."""
+        with tempfile.TemporaryDirectory() as directory:
+            logger, handler = self.handler(directory)
+            emit = handler.target.emit
+
+            def slow_emit(record):
+                time.sleep(0.05)
+                emit(record)
+
+            with mock.patch.object(handler.target, 'emit', slow_emit):
+                started = time.perf_counter()
+                for i in range(10):
+                    logger.warning("Record %d", i)
+                self.assertLess(time.perf_counter() - started, 0.05)
+                handler.close()
+            self.assertEqual([line['message'] for line in self.read_lines(directory)], [f"Record {i}" for i in range(10)])
+
+    def test_full_queue_drops_records(self):
+        """Test that records are dropped and counted when the listener cannot keep up."""
+        release = threading.Event()
+        with tempfile.TemporaryDirectory() as directory:
+            logger, handler = self.handler(directory, queue_size=1)
+            handle = handler.target.handle
+            with mock.patch.object(handler.target, 'handle', lambda record: release.wait() and handle(record)):
+                for i in range(5):
+                    logger.warning("Record %d", i)
+                self.assertGreaterEqual(handler.dropped, 3)
+                release.set()
+                handler.close()
+            lines = self.read_lines(directory)
+        # The dropped records are counted in the file, at the latest when the handler is closed
+        reports = [line for line in lines if 'dropped' in line]
+        self.assertEqual(sum(line['dropped'] for line in reports), handler.dropped)
+        self.assertEqual({line['level'] for line in reports}, {'WARNING'})
+        self.assertEqual(len(lines) - len(reports), 5 - handler.dropped)
+
+    def test_size_rotation(self):
+        """Test that the file is rotated when it would grow past its maximum size."""
+        with tempfile.TemporaryDirectory() as directory:
+            logger, handler = self.handler(directory, max_bytes=1000, backup_count=100)
+            with mock.patch.object(handler.target, 'format', wraps=handler.target.format) as format_record:
+                for i in range(20):
+                    logger.warning("Record %d", i)
+                handler.close()
+            # Each record is formatted once, its size is checked before it is written
+            self.assertEqual(format_record.call_count, 20)
+
+            names = os.listdir(directory)
+            self.assertGreater(len(names), 1)
+            self.assertTrue(all(os.path.getsize(os.path.join(directory, name)) <= 1000 for name in names))
+            messages = {line['message'] for line in self.read_lines(directory)}
+        self.assertEqual(messages, {f"Record {i}" for i in range(20)})
+
+    def test_per_process_files(self):
+        """Test that per-process handlers write a file named after the process, also once forked."""
+        with tempfile.TemporaryDirectory() as directory:
+            logger, handler = self.handler(directory, per_process=True)
+            logger.warning("Parent")
+            # A forked worker has no listener thread and restarts it
+            handler.listener.stop()
+            with mock.patch('contacts.log.os.getpid', return_value=999999):
+                handler.restart()
+            logger.warning("Child")
+            handler.close()
+
+            self.assertEqual(sorted(os.listdir(directory)), sorted([f'api.{os.getpid()}.log', 'api.999999.log']))
+            with open(os.path.join(directory, 'api.999999.log')) as log_file:
+                self.assertEqual(json.loads(log_file.read())['message'], "Child")
+
+
+class SpamSnapshotTests(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        spam_snapshot.reset()
+        self.addCleanup(spam_snapshot.reset)
+        self.user = User.objects.create(username="user", phone_number="1234567891")
+        SpamNumber.objects.create(phone_number="1234567890", marked_by=self.user, marked_count=3, spam_likelihood=0.3)
+        SpamNumber.objects.create(phone_number="5551234567", marked_by=self.user, marked_count=10, spam_likelihood=1.0)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'spam.snapshot')
+
+    def test_snapshot_lookup(self):
+        """Test that the snapshot finds every exported number and rejects the others."""
+        rows = [(key, (key % 10) / 10) for key in range(1000, 100000, 7)]
+        write_snapshot(self.path, rows, built_at=0.0)
+        snapshot = SpamSnapshot(self.path)
+
+        self.assertEqual(len(snapshot), len(rows))
+        for key, likelihood in rows:
+            self.assertEqual(snapshot.get(key), likelihood)
+        self.assertIsNone(snapshot.get(1001))
+        self.assertIsNone(snapshot.get(0))
+        # Most absent numbers are rejected by the Bloom filter alone
+        rejected = sum(not snapshot.might_contain(key) for key in range(200000, 210000))
+        self.assertGreater(rejected, 9700)
+
+        write_snapshot(self.path, [], built_at=0.0)
+        self.assertIsNone(SpamSnapshot(self.path).get(1234567890))
+
+    def test_lookups_read_the_snapshot(self):
+        """Test that cache misses are answered from the snapshot plus the delta of recent marks."""
+        call_command('build_spam_snapshot', output=self.path, stdout=io.StringIO())
+
+        with override_settings(SPAM_LIKELIHOOD_CACHE={'ENABLED': False, 'SNAPSHOT_PATH': self.path}):
+            # Delta of recent marks (1)
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    spam_cache.get_many([1234567890, 5551234567, 9876543210]),
+                    {1234567890: 0.3, 5551234567: 1.0, 9876543210: 0.1},
+                )
+            with self.assertNumQueries(0):
+                self.assertEqual(spam_cache.get(1234567890), 0.3)
+
+            # Marks by this worker are read back at once
+            mark_spam("9876543210", self.user)
+            self.assertEqual(spam_cache.get(9876543210), 0.1)
+            mark_spam("1234567890", self.user)
+            self.assertAlmostEqual(spam_cache.get(1234567890), 0.4)
+
+            # Marks by other workers show up with the next delta
+            other_user = User.objects.create(username="other", phone_number="1234567892")
+            mark_spam("1234567890", other_user)
+            spam_snapshot.dirty.clear()
+            spam_snapshot.delta_loaded_at = None
+            self.assertAlmostEqual(spam_cache.get(1234567890), 0.5)
+
+    def test_delta_covers_likelihood_updates_without_reports(self):
+        """Test that likelihoods recomputed elsewhere, without a new report, are read by the delta."""
+        call_command('build_spam_snapshot', output=self.path, stdout=io.StringIO())
+
+        with override_settings(SPAM_LIKELIHOOD_CACHE={'ENABLED': False, 'SNAPSHOT_PATH': self.path}):
+            self.assertEqual(spam_cache.get(1234567890), 0.3)
+
+            spam_number = SpamNumber.objects.get(phone_key=1234567890)
+            SpamNumber.objects.filter(pk=spam_number.pk).update(marked_count=8)
+            spam_number.update_spam_likelihood()
+            # As seen by another worker
+            spam_snapshot.dirty.clear()
+            spam_snapshot.delta_loaded_at = None
+            self.assertAlmostEqual(spam_cache.get(1234567890), 0.8)
+
+    def test_dirty_keys_are_bounded(self):
+        """Test that invalidated keys are dropped once the delta covers them, and bypass the snapshot past the bound."""
+        call_command('build_spam_snapshot', output=self.path, stdout=io.StringIO())
+
+        with override_settings(SPAM_LIKELIHOOD_CACHE={'ENABLED': False, 'SNAPSHOT_PATH': self.path}):
+            mark_spam("1234567890", self.user)
+            self.assertIn(1234567890, spam_snapshot.dirty)
+            spam_snapshot.delta_loaded_at = None
+            self.assertAlmostEqual(spam_cache.get(1234567890), 0.4)
+            self.assertNotIn(1234567890, spam_snapshot.dirty)
+
+            with mock.patch('contacts.spam_snapshot.MAX_DIRTY_KEYS', 3):
+                spam_snapshot.invalidate(range(4))
+            self.assertTrue(spam_snapshot.overflowed)
+            self.assertEqual(spam_snapshot.dirty, {})
+            # Read from the database until the next snapshot
+            with self.assertNumQueries(1):
+                self.assertEqual(spam_cache.get(5551234567), 1.0)
+
+            call_command('build_spam_snapshot', output=self.path, stdout=io.StringIO())
+            spam_snapshot.checked_at = 0.0
+            spam_cache.get(5551234567)
+            self.assertFalse(spam_snapshot.overflowed)
+
+    def test_rebuilt_snapshot_is_swapped_in(self):
+        """Test that workers pick up a rebuilt snapshot file."""
+        # Changed long before the snapshot, so the delta does not read them
+        SpamNumber.objects.update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        write_snapshot(self.path, [(1234567890, 0.3)], built_at=time.time())
+        config = {'ENABLED': False, 'SNAPSHOT_PATH': self.path, 'SNAPSHOT_CHECK_INTERVAL': 0}
+
+        with override_settings(SPAM_LIKELIHOOD_CACHE=config):
+            self.assertEqual(spam_cache.get(5551234567), 0.1)
+            call_command('build_spam_snapshot', output=self.path, stdout=io.StringIO())
+            self.assertEqual(spam_cache.get(5551234567), 1.0)
+            self.assertEqual(len(spam_snapshot.snapshot), 2)
+
+
+class PhoneDirectoryTests(TestCase):
+    def setUp(self):
+        search_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="user",
+            phone_number="1234567891",
+            password="password@123",
+            email="user@example.com",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.others = [User.objects.create(username=f"other{i}", phone_number=f"55500000{i:02d}") for i in range(3)]
+
+    def entries(self):
+        return {
+            entry.phone_key: (entry.phone_number, entry.registered_user_id, entry.names, entry.contact_count, entry.spam_likelihood)
+            for entry in PhoneDirectory.objects.all()
+        }
+
+    def test_directory_follows_writes(self):
+        """Test that directory entries are kept current by contact, user and spam writes."""
+        Contact.objects.create(name="John Doe", phone_number="1234567890", user=self.others[0])
+        Contact.objects.create(name="john doe", phone_number="+1234567890", user=self.others[1])
+        contact = Contact.objects.create(name="Johnny", phone_number="1234567890", user=self.others[2])
+        entry = PhoneDirectory.objects.get(pk=1234567890)
+        self.assertEqual(entry.names, [["John Doe", 2], ["Johnny", 1]])
+        self.assertEqual(entry.contact_count, 3)
+
+        mark_spam("1234567890", self.user)
+        self.assertEqual(PhoneDirectory.objects.get(pk=1234567890).spam_likelihood, 0.1)
+        mark_spam("1234567890", self.others[0])
+        self.assertAlmostEqual(PhoneDirectory.objects.get(pk=1234567890).spam_likelihood, 0.2)
+
+        contact.name = "Jo"
+        contact.phone_number = "9876543210"
+        contact.save()
+        self.assertEqual(PhoneDirectory.objects.get(pk=1234567890).names, [["John Doe", 2]])
+        self.assertEqual(PhoneDirectory.objects.get(pk=9876543210).names, [["Jo", 1]])
+        contact.delete()
+        self.assertFalse(PhoneDirectory.objects.filter(pk=9876543210).exists())
+
+        # Changing a registered user's number moves their registration
+        user = User.objects.get(pk=self.user.pk)
+        user.phone_number = "1234567890"
+        user.save()
+        self.assertEqual(PhoneDirectory.objects.get(pk=1234567890).registered_user, self.user)
+        self.assertFalse(PhoneDirectory.objects.filter(pk=1234567891).exists())
+
+    def test_imports_update_directory(self):
+        """Test that bulk contact imports refresh the entries of their numbers."""
+        self.client.post(
+            '/api/contacts/import/',
+            b'{"name": "Ada", "phone_number": "4440000001"}\n{"name": "Bob", "phone_number": "5550000000"}\n',
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(PhoneDirectory.objects.get(pk=4440000001).names, [["Ada", 1]])
+        self.assertEqual(PhoneDirectory.objects.get(pk=5550000000).registered_user, self.others[0])
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        """Test that a batched rebuild reproduces the incrementally maintained directory."""
+        for i in range(28):
+            Contact.objects.create(name=f"Name {i % 4}", phone_number=f"44400000{i % 7:02d}", user=self.others[i % 3])
+        SpamNumber.objects.create(phone_number="4440000003", marked_by=self.user, marked_count=4, spam_likelihood=0.4)
+        mark_spam("9990000000", self.user)
+        expected = self.entries()
+
+        PhoneDirectory.objects.all().delete()
+        PhoneDirectory.objects.create(phone_key=1, phone_number="1")
+        self.assertEqual(sum(rebuild_directory(batch_size=2)), len(expected))
+        self.assertEqual(self.entries(), expected)
+
+        PhoneDirectory.objects.all().delete()
+        call_command('rebuild_phone_directory', stdout=io.StringIO())
+        self.assertEqual(self.entries(), expected)
+
+    def test_search_phone_number_reads_directory(self):
+        """Test that the phone number branch of search is answered from the directory entry."""
+        Contact.objects.create(name="John Doe", phone_number="1234567890", user=self.others[0])
+        Contact.objects.create(name="Johnny", phone_number="1234567890", user=self.others[1])
+        Contact.objects.create(name="Jane", phone_number="1234567890", user=self.others[2])
+        Contact.objects.create(name="Jill", phone_number="5550000000", user=self.others[2])
+        # other0 has the searcher in their contacts, so their email is visible
+        self.others[0].email = "other0@example.com"
+        self.others[0].save()
+        Contact.objects.create(name="User", phone_number="1234567891", user=self.others[0])
+
+        # Authentication (1) + name matches, one per rank (2) + directory entry (1)
+        # + spam likelihoods (1) + visible emails (1)
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/search/', {'query': '+1 234 567 890'})
+        self.assertEqual([result['name'] for result in response.data], ["Jane", "John Doe", "Johnny"])
+
+        response = self.client.get('/api/search/', {'query': '5550000000', 'limit': 1})
+        self.assertEqual(response.data, [
+            {'name': 'Jill', 'phone_number': '+5550000000', 'spam_likelihood': 0.1, 'email': 'other0@example.com'},
+        ])
+
+        names = []
+        params = {'query': '1234567890', 'limit': 2}
+        while params:
+            response = self.client.get('/api/search/', params)
+            names += [result['name'] for result in response.data]
+            cursor = response.get('X-Next-Cursor')
+            params = {**params, 'cursor': cursor} if cursor else None
+        self.assertEqual(names, ["Jane", "John Doe", "Johnny"])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class PhoneDirectoryConcurrencyTests(TransactionTestCase):
+    # Two connections writing the same number: data must be committed
+    def test_concurrent_writes_of_a_number_take_turns(self):
+        """Test that a directory refresh waits for a concurrent one of the same number instead of overwriting it."""
+        owners = [User.objects.create(username=f"owner{i}", phone_number=f"55500000{i:02d}") for i in range(2)]
+        first_refreshed = threading.Event()
+
+        def first_writer():
+            try:
+                with transaction.atomic():
+                    # Its refresh locks the entry until the transaction commits
+                    Contact.objects.create(name="First", phone_number="4440000000", user=owners[0])
+                    first_refreshed.set()
+                    time.sleep(0.5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=first_writer)
+        thread.start()
+        self.assertTrue(first_refreshed.wait(5))
+        Contact.objects.create(name="Second", phone_number="4440000000", user=owners[1])
+        thread.join()
+
+        entry = PhoneDirectory.objects.get(pk=phone_number_key("4440000000"))
+        self.assertEqual(entry.names, [["First", 1], ["Second", 1]])
+        self.assertEqual(entry.contact_count, 2)
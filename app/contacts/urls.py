@@ -1,9 +1,21 @@
+from django.conf import settings
 from django.urls import path
-from .views import UserRegistrationView, UserProfileView, MarkSpamView, SearchPersonView
+from .views import UserRegistrationView, UserProfileView, MarkSpamView, BulkMarkSpamView, SearchPersonView, ContactImportView, LookupNumbersView, AutocompleteView, CacheStatsView, ContactExportView, MetricsView, AsyncSearchPersonView, AsyncLookupNumbersView
+
+# Under ASGI, search and lookup are served by async views (ASYNC_VIEWS setting)
+search_view = AsyncSearchPersonView if settings.ASYNC_VIEWS else SearchPersonView
+lookup_view = AsyncLookupNumbersView if settings.ASYNC_VIEWS else LookupNumbersView
 
 urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='register'),
     path('profile/', UserProfileView.as_view(), name='profile'),
     path('mark_spam/', MarkSpamView.as_view(), name='mark_spam'),
-    path('search/', SearchPersonView.as_view(), name='search_by_name'),
+    path('mark_spam/bulk/', BulkMarkSpamView.as_view(), name='mark_spam_bulk'),
+    path('search/', search_view.as_view(), name='search_by_name'),
+    path('autocomplete/', AutocompleteView.as_view(), name='autocomplete'),
+    path('lookup/', lookup_view.as_view(), name='lookup_numbers'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('contacts/import/', ContactImportView.as_view(), name='contact_import'),
+    path('contacts/export/', ContactExportView.as_view(), name='contact_export'),
 ]
@@ -1,8 +1,124 @@
+import re
+import unicodedata
+
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class PhoneNumberValidator(RegexValidator):
+    """
+    E.164 phone numbers, given as strings: ``RegexValidator`` validates ``str(value)``, which would
+    let a JSON number through while :func:`phone_number_key` has no key for it.
+    """
+
+    def __call__(self, value):
+        if not isinstance(value, str):
+            raise ValidationError(self.message, code=self.code, params={'value': value})
+        super().__call__(value)
 
 
 # Define a regex validator for phone number
-phone_number_validator = RegexValidator(
+phone_number_validator = PhoneNumberValidator(
     regex=r'^\+?[1-9]\d{1,14}$',  # E.164 phone number format
     message="Enter a valid phone number with country code (e.g., +1234567890)."
-)
\ No newline at end of file
+)
+
+# Longest canonical phone number: "+" and the 15 digits of E.164
+PHONE_NUMBER_MAX_LENGTH = 16
+
+# Formatting characters allowed around the digits of a phone number
+PHONE_NUMBER_SEPARATORS = re.compile(r'[\s\-.()]')
+CANONICAL_PHONE_NUMBER = re.compile(r'^\+?(\d{1,18})$')
+
+
+def normalize_phone_number(value):
+    """
+    Return the canonical E.164 form of a phone number ("+" followed by digits), or ``None`` when
+    the value is not a phone number. "+1234567890", "1234567890" and "+1 (234) 567-890" are the
+    same number.
+    """
+    if not isinstance(value, str):
+        return None
+    match = CANONICAL_PHONE_NUMBER.match(PHONE_NUMBER_SEPARATORS.sub('', value))
+    return f'+{match.group(1)}' if match else None
+
+
+def phone_number_key(value):
+    """
+    Return the integer key of a phone number: its canonical digits as a bigint, used for indexed
+    equality joins between users, contacts and spam numbers. Non-numbers, including values that
+    are not strings, map to 0, which ``phone_number_validator`` keeps out of the tables.
+    """
+    canonical = normalize_phone_number(value)
+    return int(canonical[1:]) if canonical else 0
+
+
+def normalize_name(name):
+    """Normalize a contact name for indexed, case-insensitive matching."""
+    return name.lower()
+
+
+SOUNDEX_DIGITS = {
+    letter: digit
+    for letters, digit in [('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6')]
+    for letter in letters
+}
+
+
+def name_tokens(name):
+    """Split a name into lower-case ASCII words, dropping accents, digits and punctuation."""
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    return re.findall(r'[a-z]+', ascii_name)
+
+
+def name_words(name_normalized):
+    """Split a normalized name into its words, keeping accents but dropping digits and punctuation."""
+    return re.findall(r'[^\W\d_]+', name_normalized)
+
+
+def soundex(word):
+    """Return the American Soundex code of a lower-case ASCII word, e.g. "robert" -> "R163"."""
+    if not word:
+        return ''
+    code = word[0].upper()
+    previous = SOUNDEX_DIGITS.get(word[0])
+    for letter in word[1:]:
+        digit = SOUNDEX_DIGITS.get(letter)
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # Letters coded the same on both sides of an "h" or "w" are coded once
+        if letter not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def word_soundex(word):
+    """Return the Soundex code of a name word, accents dropped, e.g. "zoë" -> "Z000"."""
+    return soundex(''.join(name_tokens(word)))
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Return the optimal string alignment distance between ``a`` and ``b`` (insertions, deletions,
+    substitutions and adjacent transpositions), or ``max_distance + 1`` once it exceeds
+    ``max_distance``.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous_row = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous_row, row = previous_row, row, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return min(row[-1], max_distance + 1)
@@ -1,4 +1,4 @@
-
+import hmac
 import logging
 
 from rest_framework.views import APIView
@@ -6,15 +6,28 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.generics import RetrieveUpdateAPIView
 from rest_framework.exceptions import NotAuthenticated
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework import status
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
 from .serializers import UserRegistrationSerializer, UserProfileSerializer, SpamNumberSerializer
-from .models import User, SpamNumber, Contact
 from .util import phone_number_validator
+from .spam import mark_spam, mark_spam_numbers, MAX_BULK_MARKS
+from .importers import import_contacts, ImportFormatError, PARSERS
+from .lookup import lookup_numbers, alookup_numbers, MAX_LOOKUP_NUMBERS
+from .search import search_contacts, asearch_contacts, iter_search_results, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics, render_prometheus, get_config as get_metrics_config
+from .search_cache import search_cache
+from .spam_cache import spam_cache
+from .streaming import NDJSONRenderer, NDJSON_CONTENT_TYPE, aiter_chunks, ndjson_response, wants_ndjson, export_contacts
+from .async_api import AsyncAPIView, json_response, parse_json
+from .autocomplete import autocomplete, DEFAULT_AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_AGE
 from django.db import IntegrityError
 from django.core.exceptions import ValidationError
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.utils.cache import patch_cache_control, patch_vary_headers
 
 
 # Logger
@@ -36,13 +49,13 @@ class UserRegistrationView(APIView):
                     status=status.HTTP_201_CREATED
                 )
             except IntegrityError as e:  # Handle duplicate phone number or username
-                logger.error(f"IntegrityError during registration: {str(e)}")
+                logger.error("IntegrityError during registration: %s", e)
                 return Response(
                     {"error": "A user with this phone number or username already exists."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             except Exception as e:  # Handle unexpected errors
-                logger.error(f"Unexpected error during registration: {str(e)}")
+                logger.exception("Unexpected error during registration: %s", e)
                 return Response(
                     {"error": "An unexpected error occurred. Please try again later."},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -66,7 +79,7 @@ class UserProfileView(RetrieveUpdateAPIView):
         return user  # Return the logged-in user
 
     def update(self, request, *args, **kwargs):
-        logger.info(f"Profile update requested by user: {request.user.username}")
+        logger.info("Profile update requested by user: %s", request.user.username)
         return super().update(request, *args, **kwargs)
 
 
@@ -95,29 +108,169 @@ class MarkSpamView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Check if the spam number already exists
-        spam_number = SpamNumber.objects.filter(phone_number=phone_number).first()
+        spam_number, created, counted = mark_spam(phone_number, request.user)
+        serializer = SpamNumberSerializer(spam_number)
+        if not counted:
+            return Response(
+                {"message": f"Phone number {phone_number} already marked as spam by you.", "data": serializer.data}
+            )
+        return Response(
+            {"message": f"Phone number {phone_number} marked as spam.", "data": serializer.data},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
 
-        if spam_number:
-            # Increment the marked_count
-            spam_number.marked_count += 1
-            spam_number.update_spam_likelihood()
-            serializer = SpamNumberSerializer(spam_number)
-            return Response({"message": f"Phone number {phone_number} marked as spam.", "data": serializer.data})
-        else:
-            # Create a new SpamNumber entry if it doesn't exist
-            user = request.user
-            spam_number = SpamNumber.objects.create(phone_number=phone_number, marked_by=user)
-            spam_number.update_spam_likelihood()
-            serializer = SpamNumberSerializer(spam_number)
+class BulkMarkSpamView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        phone_numbers = request.data.get("phone_numbers")
+
+        if not isinstance(phone_numbers, list) or not phone_numbers:
             return Response(
-                {"message": f"Phone number {phone_number} marked as spam.", "data": serializer.data},
-                status=status.HTTP_201_CREATED
+                {"error": "A non-empty list of phone numbers is required to mark as spam."},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        if len(phone_numbers) > MAX_BULK_MARKS:
+            return Response(
+                {"error": f"At most {MAX_BULK_MARKS} phone numbers can be marked at once."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Validate every entry up front, invalid ones are reported without failing the batch
+        valid = []
+        for phone_number in phone_numbers:
+            try:
+                if not isinstance(phone_number, str):
+                    raise ValidationError("Phone number must be a string.")
+                phone_number_validator(phone_number)
+            except ValidationError:
+                valid.append(False)
+            else:
+                valid.append(True)
+
+        marks = mark_spam_numbers(
+            [phone_number for phone_number, is_valid in zip(phone_numbers, valid) if is_valid], request.user
+        )
+
+        results = []
+        for phone_number, is_valid in zip(phone_numbers, valid):
+            if not is_valid:
+                results.append({
+                    "phone_number": phone_number,
+                    "status": "invalid",
+                    "error": "Enter a valid phone number with country code (e.g., +1234567890).",
+                })
+                continue
+
+            spam_number, created, counted = marks[phone_number]
+            results.append({
+                "phone_number": phone_number,
+                "status": "created" if created else "marked" if counted else "already_marked",
+                "marked_count": spam_number.marked_count,
+                "spam_likelihood": spam_number.spam_likelihood,
+            })
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class ContactImportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # The body is parsed incrementally from the stream, request.data is never touched
+        content_type = request.content_type.split(';')[0].strip().lower()
+        parser = PARSERS.get(content_type)
+        if parser is None:
+            return Response(
+                {"error": f"Unsupported content type, use one of: {', '.join(PARSERS)}."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+
+        stream = request.stream
+        try:
+            summary = import_contacts(request.user, parser(stream) if stream is not None else [])
+        except ImportFormatError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        logger.info(
+            "Contact import by user %s: %d received, %d accepted, %d skipped, %d invalid.",
+            request.user.username, summary['received'], summary['accepted'], summary['skipped'],
+            summary['invalid'],
+        )
+        return Response(summary, status=status.HTTP_200_OK)
+
+
+class ContactExportView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [NDJSONRenderer]
+
+    def get(self, request):
+        # Streamed in the NDJSON format accepted by the contact import
+        return ndjson_response(export_contacts(request.user), filename='contacts.ndjson')
+
+
+class LookupNumbersView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        phone_numbers = request.data.get("phone_numbers")
+
+        error = lookup_error(phone_numbers)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        valid_numbers, invalid_numbers = split_phone_numbers(phone_numbers)
+        return Response(
+            {"results": lookup_numbers(valid_numbers), "invalid": invalid_numbers},
+            status=status.HTTP_200_OK
+        )
+
+
+class AsyncLookupNumbersView(AsyncAPIView):
+    """LookupNumbersView for ASGI servers, see contacts/async_api.py."""
+
+    async def post(self, request):
+        data = parse_json(request)
+        phone_numbers = data.get("phone_numbers") if isinstance(data, dict) else None
+
+        error = lookup_error(phone_numbers)
+        if error:
+            return json_response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        valid_numbers, invalid_numbers = split_phone_numbers(phone_numbers)
+        return json_response({"results": await alookup_numbers(valid_numbers), "invalid": invalid_numbers})
+
+
+def lookup_error(phone_numbers):
+    """Return why ``phone_numbers`` cannot be looked up, ``None`` if they can."""
+    if not isinstance(phone_numbers, list) or not phone_numbers:
+        return "A non-empty list of phone numbers is required."
+    if len(phone_numbers) > MAX_LOOKUP_NUMBERS:
+        return f"At most {MAX_LOOKUP_NUMBERS} phone numbers can be looked up at once."
+    return None
+
+
+def split_phone_numbers(phone_numbers):
+    """Split ``phone_numbers`` into the valid ones and the invalid ones."""
+    valid_numbers = []
+    invalid_numbers = []
+    for phone_number in phone_numbers:
+        try:
+            if not isinstance(phone_number, str):
+                raise ValidationError("Phone number must be a string.")
+            phone_number_validator(phone_number)
+        except ValidationError:
+            invalid_numbers.append(phone_number)
+        else:
+            valid_numbers.append(phone_number)
+    return valid_numbers, invalid_numbers
 
 
 class SearchPersonView(APIView):
     permission_classes = [IsAuthenticated]
+    # Accept: application/x-ndjson or ?format=ndjson streams every result instead of a page
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
 
     def get(self, request):
         query = request.query_params.get('query', '').strip()
@@ -125,64 +278,131 @@ class SearchPersonView(APIView):
         if not query:
             return Response({"detail": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Search by name where names start with the query
-        results_by_name_start = Contact.objects.filter(
-            name__istartswith=query
-        ).order_by('name')  # Prioritize names that start with the query
+        fuzzy = request.query_params.get('fuzzy', '').lower() in ('1', 'true', 'yes')
+        if wants_ndjson(request):
+            return ndjson_response(iter_search_results(query, request.user, fuzzy=fuzzy))
+
+        limit = parse_limit(request.query_params, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if limit is None:
+            return Response(
+                {"detail": f"limit must be an integer between 1 and {MAX_PAGE_SIZE}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            search_results, next_cursor = search_contacts(
+                query, request.user, limit=limit, cursor=request.query_params.get('cursor'), fuzzy=fuzzy,
+            )
+        except ValueError:
+            return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Search by name where names contain the query but do not start with it
-        results_by_name_contains = Contact.objects.filter(
-            name__icontains=query
-        ).exclude(name__istartswith=query).order_by('name')
+        return link_next_page(request, Response(search_results, status=status.HTTP_200_OK), next_cursor)
 
-        # Combine the two querysets, ensuring the order is respected
-        combined_results = list(results_by_name_start) + list(results_by_name_contains)
 
-        # Prepare the search results
-        search_results = []
-        search_set = set()
-        for result in combined_results:
-            user = request.user  # The current authenticated user
-            registered_user = User.objects.filter(contacts=result).first()
+class AsyncSearchPersonView(AsyncAPIView):
+    """SearchPersonView for ASGI servers, see contacts/async_api.py. Pages are always JSON."""
 
-            if registered_user and user in registered_user.contacts.all():
-                email = registered_user.email
-            else:
-                email = None  # Do not display email if the user is not in the contact list
+    async def get(self, request):
+        query = request.GET.get('query', '').strip()
 
-            spam_likelihood = SpamNumber.objects.filter(phone_number=result.phone_number).first()
-            spam_likelihood_value = spam_likelihood.spam_likelihood if spam_likelihood else 0.1
+        if not query:
+            return json_response({"detail": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            search_results.append({
-                'name': result.name,
-                'phone_number': result.phone_number,
-                'spam_likelihood': spam_likelihood_value,
-                'email': email
-            })
-            search_set.add((result.name, result.phone_number))
+        fuzzy = request.GET.get('fuzzy', '').lower() in ('1', 'true', 'yes')
+        if request.GET.get('format') == 'ndjson' or NDJSON_CONTENT_TYPE in request.headers.get('Accept', ''):
+            return ndjson_response(aiter_chunks(iter_search_results(query, request.user, fuzzy=fuzzy)))
+
+        limit = parse_limit(request.GET, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if limit is None:
+            return json_response(
+                {"detail": f"limit must be an integer between 1 and {MAX_PAGE_SIZE}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            search_results, next_cursor = await asearch_contacts(
+                query, request.user, limit=limit, cursor=request.GET.get('cursor'), fuzzy=fuzzy,
+            )
+        except ValueError:
+            return json_response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return link_next_page(request, json_response(search_results), next_cursor)
+
+
+def parse_limit(query_params, default, maximum):
+    """Return the ``limit`` query parameter, ``None`` unless it is an integer between 1 and ``maximum``."""
+    try:
+        limit = int(query_params.get('limit', default))
+    except ValueError:
+        return None
+    return limit if 1 <= limit <= maximum else None
+
+
+def link_next_page(request, response, next_cursor):
+    if next_cursor:
+        # The body stays a plain list, the next page is advertised in the headers
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        response['X-Next-Cursor'] = next_cursor
+        response['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+class AutocompleteView(APIView):
+    # Completions are the same for every user: the token is checked without loading its user
+    authentication_classes = [JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        prefix = request.query_params.get('prefix', '').strip()
 
-        result_by_phone_number = Contact.objects.filter(phone_number=query)
+        if not prefix:
+            return Response({"detail": "prefix parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # If there's exactly one match (registered user), show that contact
-        if result_by_phone_number:
-            for contact in result_by_phone_number:
-                if (contact.name, contact.phone_number) not in search_set:
-                    spam_likelihood = SpamNumber.objects.filter(phone_number=contact.phone_number).first()
-                    spam_likelihood_value = spam_likelihood.spam_likelihood if spam_likelihood else 0.1
+        limit = parse_limit(request.query_params, DEFAULT_AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT)
+        if limit is None:
+            return Response(
+                {"detail": f"limit must be an integer between 1 and {MAX_AUTOCOMPLETE_LIMIT}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-                    user = request.user  # The current authenticated user
-                    registered_user = User.objects.filter(contacts=contact).first()
+        response = Response(autocomplete(prefix, limit), status=status.HTTP_200_OK)
+        patch_cache_control(response, private=True, max_age=AUTOCOMPLETE_MAX_AGE)
+        patch_vary_headers(response, ['Authorization'])
+        return response
 
-                    if registered_user and user in registered_user.contacts.all():
-                        email = registered_user.email
-                    else:
-                        email = None  # Do not display email if the user is not in the contact list
 
-                    search_results.append({
-                        'name': contact.name,
-                        'phone_number': contact.phone_number,
-                        'spam_likelihood': spam_likelihood_value,
-                        'email': email
-                    })
+class CacheStatsView(APIView):
+    # Counters of the worker serving the request
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(
+            {"search": search_cache.stats(), "spam_likelihood": spam_cache.stats()},
+            status=status.HTTP_200_OK
+        )
+
+
+class MetricsView(APIView):
+    # Scraped by Prometheus with a static token. Without a token configured only admins, signed
+    # in with their JWT, may read the metrics.
+    permission_classes = [IsAdminUser]
+
+    def get_authenticators(self):
+        # The scrape token is not a JWT
+        if get_metrics_config()['SCRAPE_TOKEN']:
+            return []
+        return super().get_authenticators()
+
+    def get_permissions(self):
+        if get_metrics_config()['SCRAPE_TOKEN']:
+            return [AllowAny()]
+        return super().get_permissions()
+
+    def get(self, request):
+        config = get_metrics_config()
+        token = config['SCRAPE_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
 
-        return Response(search_results, status=status.HTTP_200_OK)
+        text = render_prometheus(metrics.collect(config['MULTIPROCESS_DIR']))
+        return HttpResponse(text, content_type=METRICS_CONTENT_TYPE)
@@ -10,5 +10,14 @@ echo "Running migrations..."
 python manage.py makemigrations
 python manage.py migrate
 
-# Start the Django development server (or use Gunicorn in production)
-exec python manage.py runserver 0.0.0.0:8000
+# Start the server: APP_SERVER=wsgi or asgi runs Gunicorn with the settings of gunicorn.conf.py,
+# anything else the Django development server
+case "${APP_SERVER:-runserver}" in
+    wsgi|asgi)
+        echo "Starting Gunicorn ($APP_SERVER)..."
+        exec gunicorn --config gunicorn.conf.py
+        ;;
+    *)
+        exec python manage.py runserver 0.0.0.0:8000
+        ;;
+esac
@@ -0,0 +1,75 @@
+"""
+Gunicorn settings of the production server, see ``entrypoint.sh``.
+
+Gunicorn loads this file from the working directory. Every setting can be changed through the
+environment:
+
+- ``APP_SERVER``: ``wsgi`` serves ``contact_mgm.wsgi`` with sync or threaded workers, ``asgi``
+  serves ``contact_mgm.asgi`` with uvicorn workers.
+- ``WEB_CONCURRENCY``: worker processes (default ``2 * CPUs + 1``).
+- ``WEB_THREADS``: threads per WSGI worker (default 1). More than one uses the ``gthread``
+  worker, which also keeps idle client connections open without tying up a thread.
+- ``WEB_BIND``, ``WEB_TIMEOUT``, ``WEB_GRACEFUL_TIMEOUT``, ``WEB_KEEPALIVE``, ``WEB_BACKLOG``.
+- ``WEB_MAX_REQUESTS`` / ``WEB_MAX_REQUESTS_JITTER``: restart workers after that many requests
+  (default 0, never), to bound slow memory growth.
+- ``WEB_PRELOAD``: import the application once in the master before forking (``1``), sharing its
+  memory between workers at the cost of not reloading code on ``HUP``.
+
+With several workers each one logs to a file of its own (``LOG_PER_PROCESS``, see
+``contacts/log.py``), as they would otherwise rotate the same file under each other.
+
+Workers load the in-process contact name index, when enabled, before accepting requests.
+"""
+import multiprocessing
+import os
+
+
+app_server = os.getenv('APP_SERVER', 'wsgi')
+
+wsgi_app = 'contact_mgm.asgi:application' if app_server == 'asgi' else 'contact_mgm.wsgi:application'
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('WEB_THREADS', '1'))
+if app_server == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    worker_class = 'gthread' if threads > 1 else 'sync'
+
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+backlog = int(os.getenv('WEB_BACKLOG', '2048'))
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', '0'))
+preload_app = os.getenv('WEB_PRELOAD', '0') == '1'
+if workers > 1:
+    # Read by the LOGGING setting of every worker
+    os.environ.setdefault('LOG_PER_PROCESS', '1')
+
+accesslog = os.getenv('WEB_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('WEB_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Per-worker metrics files of the previous run would be added to this run's counters
+    directory = os.getenv('METRICS_MULTIPROCESS_DIR')
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith('metrics-'):
+                os.remove(os.path.join(directory, name))
+
+
+def pre_fork(server, worker):
+    # Database connections opened while preloading must not be shared by the forked workers
+    if preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    # Load the in-process name index (when enabled) before serving, not in the first search
+    from django.db import connections
+    from contacts.name_index import name_index
+    name_index.get()
+    connections.close_all()